@@ -0,0 +1,101 @@
+#encoding:utf-8
+
+import sys
+
+import numpy as np
+import soundfile as sf
+import torch
+import torchaudio
+
+#音声波形からスペクトログラムを計算する関数　学習時(dataset_util.py)と同じ設定で計算する
+def compute_spectrogram(wav, filter_length=1024, hop_length=256, win_length=1024):
+	pad_size = int((filter_length-hop_length)/2)
+	wav_padded = torch.nn.functional.pad(wav, (pad_size, pad_size), mode='reflect')
+	spec = torchaudio.functional.spectrogram(
+						waveform=wav_padded,
+						pad=0,#torchaudio.functional.spectrogram内で使われているtorch.nn.functional.padはmode='constant'となっているが、今回はmode='reflect'としたいため手動でpaddingする
+						window=torch.hann_window(win_length, device=wav.device),
+						n_fft=filter_length,
+						hop_length=hop_length,
+						win_length=win_length,
+						power=2,
+						normalized=False,
+						center=False
+					)
+	return spec
+
+#音声波形からメルスペクトログラムを計算する関数　学習時(vits_train.pyのmel_reconstruction_loss)と同じ設定で計算する
+def compute_mel_spectrogram(wav, sampling_rate, n_mels=80, filter_length=1024, hop_length=256, win_length=1024):
+	spec = compute_spectrogram(wav, filter_length, hop_length, win_length)
+	fbanks = torchaudio.functional.melscale_fbanks(n_freqs=filter_length//2 + 1, f_min=0, f_max=sampling_rate//2, n_mels=n_mels, sample_rate=sampling_rate).to(wav.device)
+	mel_spec = torch.matmul(spec.transpose(-1, -2), fbanks).transpose(-1, -2)
+	return mel_spec
+
+#音声波形を少しずつ受け取りながら、compute_spectrogramと同じスペクトログラムをフレームごとに計算するクラス
+#push()に渡した波形から計算できるようになったフレームを返し、finish()で末尾のフレームを返す
+#保持する波形はfilter_length程度に限られるため、入力の長さによらずメモリの使用量は一定となる
+class StreamingSpectrogram():
+	def __init__(self, filter_length=1024, hop_length=256, win_length=1024):
+		self.filter_length = filter_length
+		self.hop_length = hop_length
+		self.win_length = win_length
+		self.pad_size = int((filter_length-hop_length)/2)
+		#compute_spectrogramでreflect paddingした波形のうち、まだフレームの計算に用いていない部分
+		self.buffer = torch.zeros(0)
+		#先頭のreflect paddingに必要な長さの波形が揃ったかどうか
+		self.started = False
+
+	#wav : torch.Size([length])
+	def push(self, wav):
+		self.buffer = torch.cat([self.buffer, wav])
+		if not self.started:
+			if self.buffer.size(0) <= self.pad_size:
+				return self._empty()
+			#先頭はcompute_spectrogramと同じくreflect paddingする
+			self.buffer = torch.cat([self.buffer[1:self.pad_size+1].flip(0), self.buffer])
+			self.started = True
+		return self._compute_frames()
+
+	def finish(self):
+		#末尾もreflect paddingする　paddingに用いる波形はbufferの末尾に残っている
+		if not self.started:
+			#入力全体がpad_size以下の長さの場合は、compute_spectrogramと同様にpaddingできない
+			return compute_spectrogram(self.buffer.unsqueeze(0), self.filter_length, self.hop_length, self.win_length)
+		self.buffer = torch.cat([self.buffer, self.buffer[-self.pad_size-1:-1].flip(0)])
+		return self._compute_frames()
+
+	def _compute_frames(self):
+		n_frames = (self.buffer.size(0) - self.filter_length) // self.hop_length + 1
+		if n_frames <= 0:
+			return self._empty()
+		used_length = (n_frames - 1) * self.hop_length + self.filter_length
+		spec = torchaudio.functional.spectrogram(
+							waveform=self.buffer[:used_length].unsqueeze(0),
+							pad=0,
+							window=torch.hann_window(self.win_length, device=self.buffer.device),
+							n_fft=self.filter_length,
+							hop_length=self.hop_length,
+							win_length=self.win_length,
+							power=2,
+							normalized=False,
+							center=False
+						)
+		self.buffer = self.buffer[n_frames*self.hop_length:]
+		return spec
+
+	def _empty(self):
+		return torch.zeros(1, self.filter_length//2 + 1, 0)
+
+#音声ファイルをblock_samplesサンプルずつ読み込むgenerator　各blockはtorch.Size([block_samples])(最後のみ短い)
+#pathに"-"を指定した場合は、標準入力から16bit monoのraw PCMを読み込む(マイク入力などを模したpipeでの入力に用いる)
+def read_wav_blocks(path, block_samples):
+	if path == "-":
+		while True:
+			data = sys.stdin.buffer.read(block_samples * 2)
+			if len(data) < 2:
+				break
+			yield torch.from_numpy(np.frombuffer(data[:len(data)//2*2], dtype=np.int16).astype(np.float32) / 32768.0)
+	else:
+		for block in sf.blocks(path, blocksize=block_samples, dtype="float32", always_2d=True):
+			#複数チャンネルの場合は1チャンネル目のみを用いる
+			yield torch.from_numpy(block[:, 0].copy())
@@ -0,0 +1,52 @@
+#encoding:utf-8
+
+import torch
+
+from .audio_util import compute_spectrogram
+
+#学習時のbatch(collate_fnの出力)と、学習の1stepの直前の乱数の状態を記録したdictを作る関数
+#学習の1stepで用いる乱数(rand_slice_segmentsの切り出し位置、PosteriorEncoderのサンプリング、StochasticDurationPredictorのノイズ、dropout)は全てtorchの既定の乱数生成器から引かれるため、
+#その状態を戻してから同じ処理を実行すれば、同じ乱数が同じ順に引かれる
+#スペクトログラムは波形から再計算できるため保存しない　波形は16bitの値で表せる場合(16bitのwavファイルから読み込んだ場合)はint16で保存する
+def capture_batch(data, device):
+	wav_padded, wav_lengths, spec_padded, spec_lengths, speaker_id, text_padded, text_lengths = data
+	wav_int16 = torch.round(wav_padded * 32768)
+	if torch.equal(wav_int16 / 32768, wav_padded) and wav_int16.abs().max() <= 32767:
+		wav_padded = wav_int16.to(torch.int16)
+	device = torch.device(device)
+	return {
+		"wav_padded" : wav_padded.clone(),
+		"wav_lengths" : wav_lengths.clone(),
+		"spec_lengths" : spec_lengths.clone(),
+		"speaker_id" : speaker_id.clone(),
+		"text_padded" : text_padded.clone(),
+		"text_lengths" : text_lengths.clone(),
+		"cpu_rng_state" : torch.get_rng_state(),
+		"cuda_rng_state" : torch.cuda.get_rng_state(device) if device.type == "cuda" else None,
+	}
+
+#capture_batchで記録したdictから、collate_fnの出力と同じbatchを作る関数
+def restore_batch(captured, filter_length=1024, hop_length=256, win_length=1024):
+	wav_padded = captured["wav_padded"]
+	if wav_padded.dtype == torch.int16:
+		wav_padded = wav_padded.float() / 32768
+	#スペクトログラムは発話ごとに元の長さの波形から計算し、collate_fnと同様に左詰めで0埋めする
+	specs = [compute_spectrogram(wav_padded[i, :, :captured["wav_lengths"][i]], filter_length, hop_length, win_length)[0] for i in range(wav_padded.size(0))]
+	spec_padded = torch.zeros(wav_padded.size(0), specs[0].size(0), int(captured["spec_lengths"].max()), dtype=torch.float32)
+	for i, spec in enumerate(specs):
+		spec_padded[i, :, :spec.size(1)] = spec
+	return wav_padded, captured["wav_lengths"], spec_padded, captured["spec_lengths"], captured["speaker_id"], captured["text_padded"], captured["text_lengths"]
+
+#capture_batchで記録した乱数の状態に戻す関数
+def restore_rng_state(captured, device):
+	torch.set_rng_state(captured["cpu_rng_state"])
+	if captured["cuda_rng_state"] is not None:
+		torch.cuda.set_rng_state(captured["cuda_rng_state"], torch.device(device))
+
+#記録したbatchのlistと、学習の設定(metadata)を1つのファイルに保存・読み込みする
+def save_captured_batches(path, batches, metadata):
+	torch.save({"metadata" : metadata, "batches" : batches}, path)
+
+def load_captured_batches(path):
+	captured = torch.load(path, map_location="cpu", weights_only=False)
+	return captured["batches"], captured["metadata"]
@@ -0,0 +1,167 @@
+#encoding:utf-8
+
+import json
+import multiprocessing
+import platform
+import resource
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+from torch.utils._python_dispatch import TorchDispatchMode
+
+#処理fnの実行時間[s]をn_repeats回計測して返す関数　最初のn_warmup回は計測しない
+#GPU上の処理は非同期に実行されるため、計測の前後で同期をとる
+def measure_time(fn, n_warmup=1, n_repeats=5, device="cpu"):
+	device = torch.device(device)
+	for _ in range(n_warmup):
+		fn()
+	elapsed_times = []
+	for _ in range(n_repeats):
+		_synchronize(device)
+		time_start = time.perf_counter()
+		fn()
+		_synchronize(device)
+		elapsed_times.append(time.perf_counter() - time_start)
+	return elapsed_times
+
+def _synchronize(device):
+	if device.type == "cuda":
+		torch.cuda.synchronize(device)
+
+#計測した時間[s]のlistから、中央値・最小値・percentile[ms]をまとめたdictを作る
+def summarize_times(elapsed_times, percentiles=(50, 90, 99)):
+	elapsed_times_ms = np.array(elapsed_times) * 1000
+	summary = {"median_ms" : float(np.median(elapsed_times_ms)), "min_ms" : float(np.min(elapsed_times_ms))}
+	for percentile in percentiles:
+		summary[f"p{percentile}_ms"] = float(np.percentile(elapsed_times_ms, percentile))
+	return summary
+
+#計測した環境(結果を比較する際に、環境が同じか確認するため)
+def environment_info(device="cpu"):
+	return {
+		"torch" : torch.__version__,
+		"python" : platform.python_version(),
+		"machine" : platform.machine(),
+		"processor" : platform.processor(),
+		"num_threads" : torch.get_num_threads(),
+		"device" : str(device),
+		"cuda_device" : torch.cuda.get_device_name(torch.device(device)) if torch.device(device).type == "cuda" else None,
+	}
+
+#ベンチマークの結果を{"environment" : 環境, "results" : {計測の名前 : {指標 : 値}}}の形でjsonファイルに保存・読み込みする
+def save_benchmark_results(path, results, environment):
+	with open(path, "w") as f:
+		json.dump({"environment" : environment, "results" : results}, f, indent=2, ensure_ascii=False)
+
+def load_benchmark_results(path):
+	with open(path, "r") as f:
+		return json.load(f)
+
+#結果を基準(baseline)と比較し、metricsに含まれる指標(値が小さいほど良いもの)が(1+threshold)倍を超えて悪化したものを列挙する
+#各計測について(名前, 指標, 基準の値, 今回の値, 今回の値/基準の値, 悪化したかどうか)を返す　片方にしかない計測は比較しない
+def compare_benchmark_results(results, baseline_results, metrics, threshold=0.1):
+	comparisons = []
+	for name, result in results.items():
+		if name not in baseline_results:
+			continue
+		for metric in metrics:
+			value, baseline_value = result.get(metric), baseline_results[name].get(metric)
+			if value is None or baseline_value is None or baseline_value <= 0:
+				continue
+			ratio = value / baseline_value
+			comparisons.append((name, metric, baseline_value, value, ratio, ratio > 1 + threshold))
+	return comparisons
+
+#compare_benchmark_resultsの結果を表示し、悪化した計測の数を返す
+def print_benchmark_comparison(comparisons, threshold=0.1):
+	for name, metric, baseline_value, value, ratio, regressed in comparisons:
+		mark = "REGRESSION" if regressed else ("improved" if ratio < 1 - threshold else "")
+		print(f"{name:<48} {metric:<20} {baseline_value:>10.2f} -> {value:>10.2f} ({(ratio - 1) * 100:+6.1f}%) {mark}")
+	n_regressions = sum(regressed for *_, regressed in comparisons)
+	print(f"regressions: {n_regressions} / {len(comparisons)} (threshold: {threshold * 100:.0f}%)")
+	return n_regressions
+
+#結果をbaseline_json_path(以前に保存した結果)と比較して表示し、悪化した計測の数を返す　baseline_json_pathがNoneの場合はその旨を表示してNoneを返す
+#environmentを指定した場合は、基準の結果を計測した環境と異なれば警告を表示する
+def compare_with_baseline(results, baseline_json_path, metrics, threshold=0.1, environment=None):
+	if baseline_json_path is None:
+		print("no baseline to compare with: set baseline_json_path to a previously saved result")
+		return None
+	baseline = load_benchmark_results(baseline_json_path)
+	if environment is not None and baseline["environment"] != environment:
+		print("warning: the baseline was measured in a different environment:", baseline["environment"])
+	return print_benchmark_comparison(compare_benchmark_results(results, baseline["results"], metrics, threshold=threshold), threshold=threshold)
+
+#このprocessでこれまでに使用したメモリの最大値(peak RSS)[MB]
+def peak_rss_mb():
+	#Linuxではru_maxrssの単位はKB
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+#fn(*args)をforkした子processで実行し、その返り値を返す関数
+#計測ごとにprocessを分けることで、設定(thread数など)ごとのpeak RSSを独立に計測する
+#fork時点で読み込み済みのモデルは子processと共有されるため、peak RSSには推論を行う1つのprocess全体の使用量が含まれる
+def run_in_subprocess(fn, *args):
+	context = multiprocessing.get_context("fork")
+	receiver, sender = context.Pipe(duplex=False)
+	def target():
+		try:
+			sender.send(("ok", fn(*args)))
+		except Exception as e:
+			sender.send(("error", repr(e)))
+	process = context.Process(target=target)
+	process.start()
+	status, value = receiver.recv()
+	process.join()
+	if status == "error":
+		raise RuntimeError(value)
+	return value
+
+#処理を段階ごとに分けて時間を計測するクラス
+#with timer("段階の名前"):で囲んだ処理の時間[s]を段階ごとに記録する　GPU上の処理は非同期に実行されるため、各段階の前後で同期をとる
+class PhaseTimer():
+	def __init__(self, device="cpu"):
+		self.device = torch.device(device)
+		self.times = {}
+
+	@contextmanager
+	def __call__(self, name):
+		_synchronize(self.device)
+		time_start = time.perf_counter()
+		yield
+		_synchronize(self.device)
+		self.times.setdefault(name, []).append(time.perf_counter() - time_start)
+
+	#これまでの記録を消す(warmupの後に呼ぶ)
+	def reset(self):
+		self.times = {}
+
+	#各段階について{"total_s" : 合計時間[s], "mean_ms" : 1回あたりの平均[ms], "ratio" : 全段階の合計に占める割合}をまとめたdictを作る
+	def summary(self):
+		total = sum(sum(times) for times in self.times.values())
+		return {name : {"total_s" : sum(times), "mean_ms" : sum(times) / len(times) * 1000, "ratio" : sum(times) / total} for name, times in self.times.items()}
+
+#fn()を1回実行し、その間に呼ばれたATenの演算の数・GPUで起動されたkernelの数・deviceからhostへの同期(.item()など)の数を数える関数
+#演算の数はviewを除き、逆伝搬(autogradのthread)で呼ばれたものも含む　GPUのkernelの数はdeviceがcudaの場合のみ数える(それ以外はNone)
+def count_launches(fn, device="cpu"):
+	device = torch.device(device)
+	counter = _OperatorCounter()
+	activities = [torch.profiler.ProfilerActivity.CPU, torch.profiler.ProfilerActivity.CUDA] if device.type == "cuda" else [torch.profiler.ProfilerActivity.CPU]
+	with torch.profiler.profile(activities=activities) as profiler:
+		with counter:
+			fn()
+		_synchronize(device)
+	cuda_kernels = sum(1 for event in profiler.events() if event.device_type == torch.autograd.DeviceType.CUDA) if device.type == "cuda" else None
+	return {"aten_ops" : sum(counter.counts.values()), "cuda_kernels" : cuda_kernels, "host_syncs" : counter.counts.get("aten._local_scalar_dense.default", 0)}
+
+class _OperatorCounter(TorchDispatchMode):
+	def __init__(self):
+		super().__init__()
+		self.counts = {}
+
+	def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+		#view(detach, select, reshapeなど)はkernelを起動しないため数えない
+		if not func.is_view:
+			self.counts[str(func)] = self.counts.get(str(func), 0) + 1
+		return func(*args, **(kwargs or {}))
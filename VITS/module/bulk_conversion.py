@@ -0,0 +1,141 @@
+#encoding:utf-8
+
+import os
+from collections import namedtuple
+
+import soundfile as sf
+import torch
+import torch.multiprocessing as mp
+import torchaudio
+
+from .audio_util import compute_spectrogram
+
+#1件の音声変換の指定　source_wav_pathの音声をsource_speaker_idからtarget_speaker_idの話者へ変換し、output_wav_pathへ書き出す
+VoiceConversionJob = namedtuple("VoiceConversionJob", ["source_wav_path", "source_speaker_id", "target_speaker_id", "output_wav_path"])
+
+#"wavファイルへのパス|変換元の話者id|変換先の話者id"の形式(学習用のtxtファイルと同じく|区切り)で1行に1件を記したファイルから変換の指定を読み込む
+#4列目に出力先のwavファイルへのパスを記した場合はそれを用い、なければoutput_dir/変換先の話者id/wavファイルの親ディレクトリ名/wavファイル名　とする
+#JVSでは話者ごとのディレクトリで同じファイル名が使われるため、親ディレクトリ名を含めて出力先が重ならないようにする
+def read_conversion_manifest(manifest_path, output_dir):
+	jobs = []
+	with open(manifest_path, "r") as f:
+		for line in f.readlines():
+			line = line.strip()
+			if line == "":
+				continue
+			columns = line.split("|")
+			if len(columns) not in (3, 4):
+				raise ValueError(f"manifest line must have 3 or 4 columns separated by \"|\" (got {line})")
+			source_wav_path, source_speaker_id, target_speaker_id = columns[:3]
+			if len(columns) == 4:
+				output_wav_path = columns[3]
+			else:
+				output_wav_path = os.path.join(output_dir, str(int(target_speaker_id)), os.path.basename(os.path.dirname(source_wav_path)), os.path.basename(source_wav_path))
+			jobs.append(VoiceConversionJob(source_wav_path, int(source_speaker_id), int(target_speaker_id), output_wav_path))
+	check_duplicate_outputs(jobs)
+	return jobs
+
+#出力先が同じ指定が複数あると互いの出力を上書きし、再開時には後の指定が出力済みとして飛ばされるため、そのような指定があればエラーとする
+def check_duplicate_outputs(jobs):
+	seen = {}
+	for job in jobs:
+		output_wav_path = os.path.normpath(job.output_wav_path)
+		if output_wav_path in seen:
+			raise ValueError(f"duplicate output path {job.output_wav_path} (sources: {seen[output_wav_path].source_wav_path}, {job.source_wav_path})")
+		seen[output_wav_path] = job
+
+#input_dir以下の全てのwavファイルを、target_speaker_idsの各話者へ変換する指定を作る
+#変換元の話者idは、source_speaker_id_mapにinput_dir直下のディレクトリ名(例えば"jvs099")が含まれていればその値、なければsource_speaker_idとする
+#出力先はoutput_dir/変換先の話者id/input_dirからの相対パス　とする
+def list_conversion_jobs(input_dir, output_dir, target_speaker_ids, source_speaker_id=0, source_speaker_id_map=None):
+	if source_speaker_id_map is None:
+		source_speaker_id_map = {}
+	jobs = []
+	for root, _, file_names in sorted(os.walk(input_dir)):
+		for file_name in sorted(file_names):
+			if not file_name.lower().endswith(".wav"):
+				continue
+			source_wav_path = os.path.join(root, file_name)
+			relative_path = os.path.relpath(source_wav_path, input_dir)
+			top_dir = relative_path.split(os.sep)[0]
+			for target_speaker_id in target_speaker_ids:
+				output_wav_path = os.path.join(output_dir, str(target_speaker_id), relative_path)
+				jobs.append(VoiceConversionJob(source_wav_path, source_speaker_id_map.get(top_dir, source_speaker_id), target_speaker_id, output_wav_path))
+	return jobs
+
+#出力先が既に存在する指定を除く(途中で中断したjobの再開に用いる)
+def remove_finished_jobs(jobs):
+	return [job for job in jobs if not os.path.exists(job.output_wav_path)]
+
+#音声の長さの近い指定同士をbatchにまとめる　1つのbatchは最大max_batch_size件、(batch内の最大サンプル数)×(件数)がmax_batch_samples以下となるようにする
+def bucket_jobs_by_length(jobs, max_batch_size=16, max_batch_samples=22050*60):
+	#ヘッダーのみを読み、音声の長さを取得する
+	lengths = {job.source_wav_path : sf.info(job.source_wav_path).frames for job in jobs}
+	#長さの近い発話同士をまとめることでpaddingを減らす　同じ変換元の指定は隣り合わせ、同じbatchで変換元側の処理を共有できるようにする
+	jobs = sorted(jobs, key=lambda job: (lengths[job.source_wav_path], job.source_wav_path, job.source_speaker_id))
+	batches = []
+	batch = []
+	for job in jobs:
+		#長さ順に並べているため、追加するjobの長さがbatch内の最大の長さとなる
+		if len(batch) > 0 and (len(batch) >= max_batch_size or lengths[job.source_wav_path] * (len(batch) + 1) > max_batch_samples):
+			batches.append(batch)
+			batch = []
+		batch.append(job)
+	if len(batch) > 0:
+		batches.append(batch)
+	return batches
+
+#1つのbatchの音声変換を実行し、各出力をpadding前の長さ(スペクトログラムのフレーム数×hop_length)に切り詰めて書き出す　書き出した件数を返す
+#同じ変換元(wavファイルと変換元の話者id)の指定はまとめ、変換元側の処理(PosteriorEncoderと順方向のFlow)は変換元ごとに1度だけ行う
+def convert_batch(netG, jobs, sampling_rate=22050, filter_length=1024, hop_length=256, win_length=1024):
+	device = netG.speaker_embedding.weight.device
+	sources = list(dict.fromkeys((job.source_wav_path, job.source_speaker_id) for job in jobs))
+	source_index = {source : i for i, source in enumerate(sources)}
+	wavs = [torchaudio.load(source_wav_path)[0] for source_wav_path, _ in sources]
+	specs = [compute_spectrogram(wav, filter_length, hop_length, win_length)[0] for wav in wavs]
+	#collate_fnと同様に、左詰めで0埋めしたbatchを作る　padding部分はspec_lengthsによるmaskで無視される
+	spec_padded = torch.zeros(len(sources), specs[0].size(0), max(spec.size(1) for spec in specs), dtype=torch.float32)
+	for i, spec in enumerate(specs):
+		spec_padded[i, :, :spec.size(1)] = spec
+	spec_lengths = torch.LongTensor([spec.size(1) for spec in specs])
+	source_speaker_id = torch.LongTensor([source_speaker_id for _, source_speaker_id in sources])
+	#各指定に対応する変換元のz_pを並べ、全ての指定を1つのbatchとして変換先の話者へ変換する
+	job_source_index = torch.LongTensor([source_index[(job.source_wav_path, job.source_speaker_id)] for job in jobs]).to(device)
+	target_speaker_id = torch.LongTensor([job.target_speaker_id for job in jobs])
+	with torch.no_grad():
+		z_p, spec_mask = netG.encode_source(spec_padded.to(device), spec_lengths.to(device), source_speaker_id.to(device))
+		output_wavs = netG.convert_source_latent(z_p.index_select(0, job_source_index), spec_mask.index_select(0, job_source_index), target_speaker_id.to(device)).data.cpu()
+	for job, output_wav in zip(jobs, output_wavs):
+		os.makedirs(os.path.dirname(job.output_wav_path), exist_ok=True)
+		#書き出しの途中で中断された場合に出力済みとみなされないよう、一時ファイルに書き出してから名前を変える
+		temporary_path = job.output_wav_path + ".tmp"
+		n_frames = specs[source_index[(job.source_wav_path, job.source_speaker_id)]].size(1)
+		sf.write(temporary_path, output_wav[0, :n_frames*hop_length].numpy(), sampling_rate, format="WAV", subtype="FLOAT")
+		os.replace(temporary_path, job.output_wav_path)
+	return len(jobs)
+
+#worker processで用いるGenerator
+_worker_netG = None
+
+def _init_worker(netG, n_threads):
+	global _worker_netG
+	_worker_netG = netG
+	torch.set_num_threads(n_threads)
+
+def _convert_batch_in_worker(args):
+	jobs, kwargs = args
+	return convert_batch(_worker_netG, jobs, **kwargs)
+
+#batchの列を順に変換し、変換を終えるたびに(変換した件数)を返すgenerator
+#n_workers > 1の場合はprocess poolで並列に変換する(CPUでの推論のみ)
+#forkで起動した各processはnetGのパラメーターを親processとページ単位で共有する　推論ではパラメーターを書き換えないため複製されず、share_memory()による共有メモリへのコピーも行わない
+#(load_generator_for_inferenceで読み込んだパラメーターはmemory-mapされたファイルのままとなる)
+#各スクリプトはif __name__ == "__main__"で処理を囲っていないため、スクリプトを再度importせずに済むfork(Linux)でprocessを起動する
+def run_conversion_batches(netG, batches, n_workers=1, **kwargs):
+	if n_workers <= 1:
+		for batch in batches:
+			yield convert_batch(netG, batch, **kwargs)
+		return
+	n_threads = max(torch.get_num_threads() // n_workers, 1)
+	with mp.get_context("fork").Pool(n_workers, initializer=_init_worker, initargs=(netG, n_threads)) as pool:
+		yield from pool.imap_unordered(_convert_batch_in_worker, [(batch, kwargs) for batch in batches])
@@ -0,0 +1,130 @@
+#encoding:utf-8
+
+import os
+
+import torch
+import torch.nn.functional as F
+
+from .vits_generator import VitsGenerator
+from .audio_util import compute_spectrogram, compute_mel_spectrogram
+
+#学習済みのGenerator(教師)から、Decoder(とFlow)を小さくしたGenerator(生徒)を蒸留するための関数群
+#教師のDecoderは推論の計算量の大半を占めるため、Decoderを小さくすることでCPUでの推論を速くする
+#生徒はDecoder(flow_configを指定した場合はFlowも)以外のパラメーターを教師からそのまま写すため、通常のVitsGeneratorとしてtext_to_speech・voice_conversionに用いることができる
+
+#教師からdecoder_config, flow_configの構成の生徒を作る関数
+#Decoder(flow_configがNoneでなければFlowも)は新しく初期化し、それ以外のパラメーターは教師の値を写す
+def make_student_generator(teacher, decoder_config, flow_config=None):
+	student = VitsGenerator(n_phoneme=teacher.n_phoneme, n_speakers=teacher.n_speakers, decoder_config=decoder_config, flow_config=teacher.flow_config if flow_config is None else flow_config)
+	distilled_prefixes = tuple(name + "." for name in distilled_module_names(distill_flow=flow_config is not None))
+	state_dict = {key : value for key, value in teacher.state_dict().items() if not key.startswith(distilled_prefixes)}
+	missing_keys, _ = student.load_state_dict(state_dict, strict=False)
+	assert all(key.startswith(distilled_prefixes) for key in missing_keys), missing_keys
+	return student
+
+#生徒のうち蒸留によって学習する(教師と構成の異なる)moduleの名前
+def distilled_module_names(distill_flow=False):
+	return ["decoder"] + (["flow"] if distill_flow else [])
+
+#教師の潜在変数と生成音声を発話ごとにcache_dirへ保存する関数
+#dataset : dataset_util.AudioSpeakerTextLoader
+#各発話について、PosteriorEncoderでサンプリングしたz、順方向のFlowで得たz_p、zから教師のDecoderが生成した波形を1つのファイルに保存する
+#zとz_pはfloat16、波形はint16で保存する　蒸留の各iterationで教師のDecoderを実行せずに済む
+#最後のn_eval_utterances個の発話は評価用とし、ファイルへのパス|話者id|フレーム数をcache_dir内のlatents_for_train.txtとlatents_for_eval.txtに書き出す
+def cache_teacher_latents(teacher, dataset, cache_dir, n_eval_utterances=20, device="cpu", seed=999):
+	os.makedirs(cache_dir, exist_ok=True)
+	torch.manual_seed(seed)
+	lines = []
+	for index in range(len(dataset)):
+		_, spec, speaker_id, _ = dataset[index]
+		spec = spec.unsqueeze(0).to(device)
+		spec_lengths = torch.LongTensor([spec.size(2)]).to(device)
+		with torch.no_grad():
+			speaker_id_embedded = teacher.embed_speaker(speaker_id.to(device))
+			z, _, _, spec_mask = teacher.posterior_encoder(spec, spec_lengths, speaker_id_embedded=speaker_id_embedded)
+			z_p = teacher.flow(z, spec_mask, speaker_id_embedded=speaker_id_embedded)
+			wav = teacher.decode(z, speaker_id_embedded)
+		path = os.path.join(cache_dir, f"{index:06d}.pt")
+		torch.save({
+			"z" : z[0].cpu().half(),
+			"z_p" : z_p[0].cpu().half(),
+			"wav" : torch.round(wav[0].cpu().clamp(-1, 1) * 32767).to(torch.int16),
+			"speaker_id" : int(speaker_id),
+		}, path)
+		lines.append(f"{path}|{int(speaker_id)}|{z.size(2)}\n")
+		if (index + 1) % 100 == 0:
+			print(f"cached {index + 1}/{len(dataset)}")
+	n_train = max(len(lines) - n_eval_utterances, 0)
+	with open(os.path.join(cache_dir, "latents_for_train.txt"), "w") as f:
+		f.writelines(lines[:n_train])
+	with open(os.path.join(cache_dir, "latents_for_eval.txt"), "w") as f:
+		f.writelines(lines[n_train:])
+
+#cache_teacher_latentsで書き出したtxtファイルを読み込み、(ファイルへのパス, 話者id, フレーム数)のlistを返す
+def read_latent_manifest(latents_txtfile_path):
+	with open(latents_txtfile_path, "r") as f:
+		entries = [line.strip().split("|") for line in f if line.strip() != ""]
+	return [(path, int(speaker_id), int(n_frames)) for path, speaker_id, n_frames in entries]
+
+#cacheした1発話を読み込み、float32に戻したz, z_p, 波形と話者idを返す
+def load_cached_latent(path):
+	cached = torch.load(path, map_location="cpu")
+	return cached["z"].float(), cached["z_p"].float(), cached["wav"].float() / 32767, cached["speaker_id"]
+
+#蒸留の学習用Dataset　各発話からsegment_framesフレーム分(波形はその256倍のサンプル)をランダムな位置で切り出す
+#segment_framesより短い発話は用いない
+class TeacherLatentDataset(torch.utils.data.Dataset):
+	def __init__(self, latents_txtfile_path, segment_frames=32, hop_length=256):
+		self.segment_frames = segment_frames
+		self.hop_length = hop_length
+		self.entries = [entry for entry in read_latent_manifest(latents_txtfile_path) if entry[2] >= segment_frames]
+
+	def __getitem__(self, index):
+		path, _, n_frames = self.entries[index]
+		z, z_p, wav, speaker_id = load_cached_latent(path)
+		#DataLoaderは各workerのtorchの乱数のシードを別々に設定するため、切り出し位置はworkerごとに異なる
+		start = int(torch.randint(0, n_frames - self.segment_frames + 1, (1,)))
+		end = start + self.segment_frames
+		return z[:, start:end], z_p[:, start:end], wav[:, start*self.hop_length:end*self.hop_length], speaker_id
+
+	def __len__(self):
+		return len(self.entries)
+
+#生徒と教師の音声の距離　複数の解像度((filter_length, hop_length, win_length, メルスペクトログラムの次元))で計算した対数メルスペクトログラムのL1距離の平均
+#教師の波形そのものではなく周波数ごとの大きさを近づけるため、位相の細かなずれには寛容となる
+def multi_resolution_mel_loss(wav_student, wav_teacher, sampling_rate=22050, resolutions=((512, 128, 512, 40), (1024, 256, 1024, 80), (2048, 512, 2048, 128))):
+	loss = 0
+	for filter_length, hop_length, win_length, n_mels in resolutions:
+		mel_student = compute_mel_spectrogram(wav_student, sampling_rate, n_mels, filter_length, hop_length, win_length)
+		mel_teacher = compute_mel_spectrogram(wav_teacher, sampling_rate, n_mels, filter_length, hop_length, win_length)
+		loss += F.l1_loss(torch.log(torch.clamp(mel_student, min=1e-5)), torch.log(torch.clamp(mel_teacher, min=1e-5)))
+	return loss / len(resolutions)
+
+#生徒のFlowが教師のFlowと同じ変換となるよう、順方向(z→z_p)と逆方向(z_p→z)の出力それぞれについて教師とのL1距離をとる
+#逆方向はText-to-Speech、順方向は音声変換の変換元の処理で用いる
+def flow_distillation_loss(student_flow, z, z_p, speaker_id_embedded):
+	mask = torch.ones_like(z[:, :1, :])
+	forward_loss = F.l1_loss(student_flow(z, mask, speaker_id_embedded=speaker_id_embedded), z_p)
+	reverse_loss = F.l1_loss(student_flow(z_p, mask, speaker_id_embedded=speaker_id_embedded, reverse=True), z)
+	return forward_loss + reverse_loss
+
+#生成音声wavと基準の音声wav_referenceの差を表す指標
+#log_mel_l1 : 対数メルスペクトログラムのL1距離, log_spectral_distance_db : 各フレームのパワースペクトルの差[dB]の二乗平均平方根の平均
+def spectral_distances(wav, wav_reference, sampling_rate=22050):
+	length = min(wav.size(-1), wav_reference.size(-1))
+	wav, wav_reference = wav[..., :length], wav_reference[..., :length]
+	log_mel = torch.log(torch.clamp(compute_mel_spectrogram(wav, sampling_rate), min=1e-5))
+	log_mel_reference = torch.log(torch.clamp(compute_mel_spectrogram(wav_reference, sampling_rate), min=1e-5))
+	power_db = 10 * torch.log10(torch.clamp(compute_spectrogram(wav), min=1e-10))
+	power_db_reference = 10 * torch.log10(torch.clamp(compute_spectrogram(wav_reference), min=1e-10))
+	return {
+		"log_mel_l1" : F.l1_loss(log_mel, log_mel_reference).item(),
+		"log_spectral_distance_db" : torch.sqrt(torch.mean((power_db - power_db_reference)**2, dim=-2)).mean().item(),
+	}
+
+#moduleのパラメーター数と大きさ[MB]
+def parameter_size(module):
+	return {
+		"parameters" : sum(p.numel() for p in module.parameters()),
+		"size_mb" : sum(p.numel() * p.element_size() for p in module.parameters()) / 1024**2,
+	}
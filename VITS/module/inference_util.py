@@ -0,0 +1,328 @@
+#encoding:utf-8
+
+import hashlib
+import itertools
+import os
+from collections import OrderedDict, namedtuple, deque
+
+import torch
+import torch.multiprocessing as mp
+import torchaudio
+
+from .audio_util import compute_spectrogram
+from .model_component.speaker_conditioning import SpeakerConditioning
+from .text_util import text_to_phoneme, phoneme_to_ids, pad_phoneme_ids
+
+#音声変換の変換元音声について、VitsGenerator.encode_sourceの結果(z_p, spec_mask)を保持するcache
+#(wavファイルの内容, 変換元の話者id)をkeyとし、同じ音声を複数の話者へ変換する場合に変換元側の処理を1度で済ませる
+#保持する数がmax_entriesを超えた場合は最も長く使われていないものから破棄する
+class SourceLatentCache():
+	def __init__(self, netG, max_entries=64, filter_length=1024, hop_length=256, win_length=1024):
+		self.netG = netG
+		self.max_entries = max_entries
+		self.filter_length = filter_length
+		self.hop_length = hop_length
+		self.win_length = win_length
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	#wavファイルを読み込み、(z_p, spec_mask, 読み込んだ波形)を返す
+	def encode(self, wav_file_path, source_speaker_id, device="cpu"):
+		with open(wav_file_path, "rb") as f:
+			wav_file_content = f.read()
+		key = (hashlib.sha1(wav_file_content).hexdigest(), int(source_speaker_id))
+		if key in self.entries:
+			self.hits += 1
+			self.entries.move_to_end(key)
+			return self.entries[key]
+		self.misses += 1
+
+		loaded_wav, _ = torchaudio.load(wav_file_path)
+		spec = compute_spectrogram(loaded_wav, self.filter_length, self.hop_length, self.win_length).to(device)
+		spec_lengths = torch.tensor([spec.size(2)], dtype=torch.long, device=device)
+		source_speaker_id = torch.tensor([int(source_speaker_id)], dtype=torch.long, device=device)
+		with torch.no_grad():
+			z_p, spec_mask = self.netG.encode_source(spec, spec_lengths, source_speaker_id)
+
+		self.entries[key] = (z_p, spec_mask, loaded_wav)
+		if len(self.entries) > self.max_entries:
+			self.entries.popitem(last=False)
+		return self.entries[key]
+
+	#保持している変換元音声の数、hit数、miss数、hit率
+	def stats(self):
+		n_requests = self.hits + self.misses
+		return {"entries" : len(self.entries), "hits" : self.hits, "misses" : self.misses, "hit_rate" : self.hits / n_requests if n_requests > 0 else 0.0}
+
+	def clear(self):
+		self.entries.clear()
+
+#話者ごとに、埋め込み済み話者idと各条件付け層(Decoder.cond, StochasticDurationPredictor.cond, Flow・PosteriorEncoder内のWN.condition_layer)の出力を前計算して保持するcache
+#話者idが同じであればこれらの値はリクエストによらず一定であるため、推論のたびに計算し直す処理を省く
+#netG.speaker_conditioning_cacheに設定すると、VitsGeneratorの推論用メソッド(text_to_speech, voice_conversionなど)で用いられる
+#保持する話者数がmax_speakersを超えた場合は最も長く使われていないものから破棄する(Noneならば上限なし)
+#netGのパラメーターを変更した場合はclear()を呼ぶ必要がある
+class SpeakerConditioningCache():
+	def __init__(self, netG, max_speakers=None):
+		self.netG = netG
+		self.max_speakers = max_speakers
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	#指定した話者(省略時は全話者、ただしmax_speakers人まで)の条件付けの特徴量を前もって計算しておく
+	def preload(self, speaker_ids=None, device="cpu"):
+		if speaker_ids is None:
+			speaker_ids = range(self.netG.n_speakers if self.max_speakers is None else min(self.netG.n_speakers, self.max_speakers))
+		for speaker_id in speaker_ids:
+			self._get_one(int(speaker_id), device)
+
+	#話者id torch.Size([batch_size])に対応する条件付けの特徴量を、batchにまとめたSpeakerConditioningとして返す
+	def get(self, speaker_id):
+		return SpeakerConditioning.cat([self._get_one(i, speaker_id.device) for i in speaker_id.tolist()])
+
+	def _get_one(self, speaker_id, device):
+		key = (speaker_id, str(device))
+		if key in self.entries:
+			self.hits += 1
+			self.entries.move_to_end(key)
+			return self.entries[key]
+		self.misses += 1
+		with torch.no_grad():
+			speaker_conditioning = self.netG.compute_speaker_conditioning(torch.tensor([speaker_id], dtype=torch.long, device=device))
+		self.entries[key] = speaker_conditioning
+		if self.max_speakers is not None and len(self.entries) > self.max_speakers:
+			self.entries.popitem(last=False)
+		return speaker_conditioning
+
+	def clear(self):
+		self.entries.clear()
+
+#メモリ上のLRUと、任意でディスク上の保存先(disk_dir)を持つ2段のcache　SynthesisCacheの各段階の結果を保持する
+#値はCPU上のtensor(またはそのtuple)とし、メモリ上に保持する量がmax_bytesを超えた場合は最も長く使われていないものから破棄する
+#disk_dirを指定した場合は追加した値をディスクにも書き出し、メモリ上にない値はディスクから読み込む(プロセスを再起動しても再利用できる)
+#書き出しは一時ファイルに保存してから置き換えるため、途中で中断しても壊れたファイルは残らない　読み込めないファイルはmissとして扱う
+class TieredLRUCache():
+	def __init__(self, max_bytes, disk_dir=None):
+		self.max_bytes = max_bytes
+		self.disk_dir = disk_dir
+		self.entries = OrderedDict()
+		self.bytes = 0
+		self.hits = 0
+		self.disk_hits = 0
+		self.misses = 0
+		if disk_dir is not None:
+			os.makedirs(disk_dir, exist_ok=True)
+
+	#keyに対応する値を返す　存在しない場合はNoneを返す
+	def get(self, key):
+		if key in self.entries:
+			self.hits += 1
+			self.entries.move_to_end(key)
+			return self.entries[key]
+		if self.disk_dir is not None and os.path.exists(self._disk_path(key)):
+			try:
+				value = torch.load(self._disk_path(key), weights_only=True)
+			except Exception:
+				value = None
+			if value is not None:
+				self.disk_hits += 1
+				self._put_memory(key, value)
+				return value
+		self.misses += 1
+		return None
+
+	def put(self, key, value):
+		self._put_memory(key, value)
+		if self.disk_dir is not None:
+			path = self._disk_path(key)
+			temporary_path = f"{path}.{os.getpid()}.tmp"
+			torch.save(value, temporary_path)
+			os.replace(temporary_path, path)
+
+	def _put_memory(self, key, value):
+		if key in self.entries:
+			self.bytes -= _nbytes(self.entries.pop(key))
+		self.entries[key] = value
+		self.bytes += _nbytes(value)
+		while self.bytes > self.max_bytes and len(self.entries) > 0:
+			self.bytes -= _nbytes(self.entries.popitem(last=False)[1])
+
+	#keyはstr, int, floatからなるtupleとし、そのreprのhashをファイル名とする
+	def _disk_path(self, key):
+		return os.path.join(self.disk_dir, hashlib.sha1(repr(key).encode("utf-8")).hexdigest() + ".pt")
+
+	def stats(self):
+		n_requests = self.hits + self.disk_hits + self.misses
+		return {"entries" : len(self.entries), "bytes" : self.bytes, "hits" : self.hits, "disk_hits" : self.disk_hits, "misses" : self.misses, "hit_rate" : (self.hits + self.disk_hits) / n_requests if n_requests > 0 else 0.0}
+
+	#メモリ上の値のみを破棄する(ディスク上の値は残す)
+	def clear(self):
+		self.entries.clear()
+		self.bytes = 0
+
+def _nbytes(value):
+	if torch.is_tensor(value):
+		return value.numel() * value.element_size()
+	return sum(_nbytes(v) for v in value)
+
+#同じ文章・話者・パラメーターでの音声合成を繰り返す場合に、途中の結果を段階ごとに保持して再利用するcache
+#各段階の結果は以下をkeyとして保持する(後の段階ほど計算量が大きい)
+# phoneme      : 文章 -> 音素id
+# text_encoder : 音素id -> TextEncoderの出力(text_encoded, m_p, logs_p, text_mask)
+# duration     : (音素id, 話者id, noise_scale_w, seed) -> StochasticDurationPredictorの出力(logw)
+# wav          : (音素id, 話者id, noise_scale, length_scale, noise_scale_w, seed) -> 生成された音声波形
+#例えばnoise_scaleのみを変えた場合はTextEncoderとStochasticDurationPredictorの結果を再利用し、Flowとdecoderのみを実行する
+#推論に用いる乱数は(seed, 音素列の長さ, フレーム数)のみから決まるため、cacheの有無や再利用の仕方によらず同じ入力に対して同じ音声が生成される
+#各段階のメモリ上の上限は*_max_bytesで指定し、disk_dirを指定した場合はその下にモデルのfingerprint(model_fingerprint)ごと・段階ごとに保存する
+#再学習したパラメーターや別の演算精度で作ったcacheは別のディレクトリとなるため、ディスク上の古い結果は用いられない
+#同じプロセス内でnetGのパラメーターや演算精度を変更した場合は、メモリ上の値を破棄するためclear()を呼ぶ必要がある
+class SynthesisCache():
+	levels = ["phoneme", "text_encoder", "duration", "wav"]
+
+	def __init__(self, netG, phoneme2index, disk_dir=None, phoneme_max_bytes=1<<20, text_encoder_max_bytes=64<<20, duration_max_bytes=1<<20, wav_max_bytes=256<<20):
+		self.netG = netG
+		self.phoneme2index = phoneme2index
+		max_bytes = {"phoneme" : phoneme_max_bytes, "text_encoder" : text_encoder_max_bytes, "duration" : duration_max_bytes, "wav" : wav_max_bytes}
+		self.fingerprint = None if disk_dir is None else model_fingerprint(netG)
+		self.caches = {level : TieredLRUCache(max_bytes[level], None if disk_dir is None else os.path.join(disk_dir, self.fingerprint, level)) for level in self.levels}
+
+	#文章を音声合成し、音声波形(torch.Size([length]), CPU上)を返す　文章の変換に失敗した場合はtext_to_phonemeと同じくValueErrorとなる
+	def synthesize(self, text, speaker_id, noise_scale=.667, length_scale=1, noise_scale_w=0.8, seed=0, decoder_chunk_frames=None):
+		device = self.netG.speaker_embedding.weight.device
+		phoneme_ids = self._cached("phoneme", (text,), lambda: torch.LongTensor(phoneme_to_ids(text_to_phoneme(text), self.phoneme2index)))
+		phoneme_key = tuple(phoneme_ids.tolist())
+		wav_key = (phoneme_key, int(speaker_id), float(noise_scale), float(length_scale), float(noise_scale_w), int(seed))
+		wav = self.caches["wav"].get(wav_key)
+		if wav is not None:
+			return wav
+
+		#乱数はseedから作るgeneratorで生成し、torch.manual_seedなどの状態に影響されないようにする
+		generator = torch.Generator().manual_seed(int(seed))
+		sdp_noise = torch.randn(1, 2, len(phoneme_key), generator=generator)
+		speaker_id = torch.tensor([int(speaker_id)], dtype=torch.long, device=device)
+		with torch.no_grad():
+			text_padded = phoneme_ids.unsqueeze(0).to(device)
+			text_lengths = torch.tensor([len(phoneme_key)], dtype=torch.long, device=device)
+			text_encoded, m_p, logs_p, text_mask = [x.to(device) for x in self._cached("text_encoder", phoneme_key, lambda: tuple(x.cpu() for x in self.netG.encode_text(text_padded, text_lengths)))]
+			speaker_id_embedded = self.netG.embed_speaker(speaker_id)
+			logw = self._cached("duration", (phoneme_key, wav_key[1], wav_key[4], wav_key[5]), lambda: self.netG.predict_log_duration(text_encoded, text_mask, speaker_id_embedded, noise_scale_w=noise_scale_w, sdp_noise=sdp_noise.to(device)).cpu()).to(device)
+			#z_pのサンプリングに用いる乱数は、生成されるフレーム数が決まってから生成する
+			_, y_lengths = self.netG.log_duration_to_spec_lengths(logw, text_mask, length_scale=length_scale)
+			latent_noise = torch.randn(1, m_p.size(1), int(y_lengths.max()), generator=generator).to(device)
+			z, spec_mask = self.netG.log_duration_to_latent(m_p, logs_p, text_mask, logw, speaker_id_embedded, noise_scale=noise_scale, length_scale=length_scale, latent_noise=latent_noise)
+			wav = self.netG.decode(z, speaker_id_embedded=speaker_id_embedded, chunk_frames=decoder_chunk_frames)[0, 0].cpu()
+		self.caches["wav"].put(wav_key, wav)
+		return wav
+
+	def _cached(self, level, key, compute):
+		value = self.caches[level].get(key)
+		if value is None:
+			value = compute()
+			self.caches[level].put(key, value)
+		return value
+
+	#段階ごとのhit数、miss数、hit率、メモリ上に保持している値の数と大きさ[byte]
+	def stats(self):
+		return {level : cache.stats() for level, cache in self.caches.items()}
+
+	def clear(self):
+		for cache in self.caches.values():
+			cache.clear()
+
+#netGの出力を決めるもの(state_dictの全ての値、decoder_config・flow_config、set_inference_precisionで指定した演算精度)のhash
+#SynthesisCacheのディスク上の保存先を、生成したモデルごとに分けるために用いる
+#int8_*で量子化した畳み込み層の重みはparameterやbufferに含まれないため、state_dictから量子化後の値とscale・zero pointを読む
+def model_fingerprint(netG):
+	fingerprint = hashlib.sha1()
+	fingerprint.update(repr((netG.decoder_config, netG.flow_config, netG.inference_precision, netG.requested_inference_precision)).encode("utf-8"))
+	for name, value in netG.state_dict().items():
+		fingerprint.update(name.encode("utf-8"))
+		fingerprint.update(_tensor_bytes(value) if torch.is_tensor(value) else repr(value).encode("utf-8"))
+	return fingerprint.hexdigest()
+
+def _tensor_bytes(tensor):
+	tensor = tensor.detach().cpu()
+	if not tensor.is_quantized:
+		return tensor.contiguous().view(-1).view(torch.uint8).numpy().tobytes()
+	if tensor.qscheme() in [torch.per_tensor_affine, torch.per_tensor_symmetric]:
+		qparams = repr((tensor.q_scale(), tensor.q_zero_point())).encode("utf-8")
+	else:
+		qparams = _tensor_bytes(tensor.q_per_channel_scales()) + _tensor_bytes(tensor.q_per_channel_zero_points())
+	return _tensor_bytes(tensor.int_repr()) + qparams
+
+#synthesize_batchに渡す1発話分の指定　(text, speaker_id)のみを指定した場合、残りは既定値となる
+SynthesisRequest = namedtuple("SynthesisRequest", ["text", "speaker_id", "noise_scale", "length_scale", "noise_scale_w"], defaults=[0.667, 1.0, 0.8])
+
+#複数の(文章, 話者id, noise_scale, length_scale, noise_scale_w)をまとめて音声合成する関数
+#音素列の長さ順に並べてmax_batch_size個ずつbatchにまとめて推論し、各発話の長さに切り詰めた音声波形(torch.Size([length]))を入力の順に返す
+def synthesize_batch(netG, requests, phoneme2index, device="cpu", max_batch_size=16, decoder_chunk_frames=None):
+	requests = [SynthesisRequest(*request) for request in requests]
+	phoneme_ids_list = [phoneme_to_ids(text_to_phoneme(request.text), phoneme2index) for request in requests]
+	return synthesize_phoneme_ids_batch(netG, phoneme_ids_list, requests, device=device, max_batch_size=max_batch_size, decoder_chunk_frames=decoder_chunk_frames)
+
+#synthesize_batchのうち、音素idへの変換が済んだ後の処理
+def synthesize_phoneme_ids_batch(netG, phoneme_ids_list, requests, device="cpu", max_batch_size=16, decoder_chunk_frames=None):
+	requests = [SynthesisRequest(*request) for request in requests]
+	output_wavs = [None] * len(requests)
+	#長さの近い発話同士をまとめることでpaddingを減らす
+	order = sorted(range(len(requests)), key=lambda i: len(phoneme_ids_list[i]))
+	for batch_start in range(0, len(order), max_batch_size):
+		batch_indices = order[batch_start:batch_start+max_batch_size]
+		batch_requests = [requests[i] for i in batch_indices]
+		text_padded, text_lengths = pad_phoneme_ids([phoneme_ids_list[i] for i in batch_indices])
+		speaker_id = torch.LongTensor([request.speaker_id for request in batch_requests])
+		noise_scale = torch.FloatTensor([request.noise_scale for request in batch_requests])
+		length_scale = torch.FloatTensor([request.length_scale for request in batch_requests])
+		noise_scale_w = torch.FloatTensor([request.noise_scale_w for request in batch_requests])
+		with torch.no_grad():
+			wav_fake, wav_lengths = netG.text_to_speech_batch(
+				text_padded.to(device), text_lengths.to(device), speaker_id.to(device),
+				noise_scale=noise_scale.to(device), length_scale=length_scale.to(device), noise_scale_w=noise_scale_w.to(device),
+				decoder_chunk_frames=decoder_chunk_frames
+			)
+		wav_fake, wav_lengths = wav_fake.data.cpu(), wav_lengths.cpu()
+		for k, i in enumerate(batch_indices):
+			output_wavs[i] = wav_fake[k, 0, :wav_lengths[k]]
+	return output_wavs
+
+#worker processで用いるGenerator
+_worker_netG = None
+
+def _init_synthesis_worker(netG, n_threads):
+	global _worker_netG
+	_worker_netG = netG
+	torch.set_num_threads(n_threads)
+
+def _synthesize_window_in_worker(args):
+	phoneme_ids_list, requests, seed, kwargs = args
+	return _synthesize_window(_worker_netG, phoneme_ids_list, requests, seed, kwargs)
+
+def _synthesize_window(netG, phoneme_ids_list, requests, seed, kwargs):
+	if seed is not None:
+		torch.manual_seed(seed)
+	return synthesize_phoneme_ids_batch(netG, phoneme_ids_list, requests, **kwargs)
+
+#(phoneme_ids_list, requests)の列を順にsynthesize_phoneme_ids_batchで音声合成し、それぞれの結果(音声波形のlist)を入力と同じ順に返すgenerator　空の組に対しては空のlistを返す
+#n_workers > 1の場合はprocess poolで複数の組を並列に合成する(CPUでの推論のみ)
+#forkで起動した各processはnetGのパラメーターを親processとページ単位で共有する　推論ではパラメーターを書き換えないため複製されず、share_memory()による共有メモリへのコピーも行わない
+#(load_generator_for_inferenceで読み込んだパラメーターはmemory-mapされたファイルのままとなる)
+#同時に処理中とする組は最大2*n_workers個までとし、書き出しを待つ音声を保持するメモリを制限する
+#seedを指定した場合はi番目の組の推論の前に乱数のシードをseed+iとするため、n_workersによらず同じ音声が生成される
+#各スクリプトはif __name__ == "__main__"で処理を囲っていないため、スクリプトを再度importせずに済むfork(Linux)でprocessを起動する
+def run_synthesis_windows(netG, windows, n_workers=1, seed=None, **kwargs):
+	window_seeds = itertools.count(seed) if seed is not None else itertools.repeat(None)
+	if n_workers <= 1:
+		for (phoneme_ids_list, requests), window_seed in zip(windows, window_seeds):
+			yield _synthesize_window(netG, phoneme_ids_list, requests, window_seed, kwargs)
+		return
+	n_threads = max(torch.get_num_threads() // n_workers, 1)
+	with mp.get_context("fork").Pool(n_workers, initializer=_init_synthesis_worker, initargs=(netG, n_threads)) as pool:
+		pending = deque()
+		for (phoneme_ids_list, requests), window_seed in zip(windows, window_seeds):
+			pending.append(pool.apply_async(_synthesize_window_in_worker, ((phoneme_ids_list, requests, window_seed, kwargs),)))
+			if len(pending) >= 2 * n_workers:
+				yield pending.popleft().get()
+		while len(pending) > 0:
+			yield pending.popleft().get()
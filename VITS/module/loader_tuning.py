@@ -0,0 +1,95 @@
+#encoding:utf-8
+
+import json
+import os
+import time
+from functools import partial
+
+import torch
+
+from .dataset_util import collate_fn
+
+#各worker processの乱数のシードを設定する関数　これがないと各workerにおいて乱数が似たような値を返してしまう
+#(lambdaはpickleできずspawnでprocessを起動する環境で使えないため、module直下の関数とする)
+def _seed_worker(worker_id, seed):
+	torch.manual_seed(seed + worker_id)
+
+#学習用のDataLoaderを作る関数　num_workers=0の場合はmain processでデータを読み込む
+#prefetch_factor : 各workerが先読みしておくbatchの数
+#persistent_workers : Trueならばepochの終わりにworker processを終了せず、次のepochで再利用する
+def make_train_loader(dataset, batch_size, num_workers, prefetch_factor=2, persistent_workers=False, pin_memory=True, seed=999):
+	kwargs = {}
+	#prefetch_factorとpersistent_workersはworker processを使う場合のみ指定できる
+	if num_workers > 0:
+		kwargs = {"prefetch_factor" : prefetch_factor, "persistent_workers" : persistent_workers}
+	return torch.utils.data.DataLoader(
+		dataset,
+		batch_size=batch_size,
+		collate_fn=collate_fn,
+		num_workers=num_workers,
+		shuffle=False,
+		pin_memory=pin_memory,
+		worker_init_fn=partial(_seed_worker, seed=seed),
+		**kwargs
+	)
+
+#loaderからn_epochs回、各epochで最大n_batches個のbatchを取り出し、1秒あたりに読み込めたサンプル数と、各epochの最初のbatchが得られるまでの時間[s]の平均を返す関数
+#persistent_workersの効果(2epoch目以降のworkerの起動時間の削減)を含めるため、複数epochにわたって計測する
+def measure_loader_throughput(loader, n_batches=20, n_epochs=2, step_fn=None):
+	n_samples = 0
+	first_batch_seconds = []
+	time_start = time.perf_counter()
+	for _ in range(n_epochs):
+		time_epoch_start = time.perf_counter()
+		for i, data in enumerate(loader):
+			if i == 0:
+				first_batch_seconds.append(time.perf_counter() - time_epoch_start)
+			#step_fnを指定した場合は、読み込んだbatchで学習の1stepを実行する(学習全体のthroughputの計測)
+			if step_fn is not None:
+				step_fn(data)
+			n_samples += data[0].size(0)
+			if i + 1 >= n_batches:
+				break
+	elapsed_time = time.perf_counter() - time_start
+	return {"samples_per_second" : n_samples / elapsed_time, "first_batch_seconds" : sum(first_batch_seconds) / len(first_batch_seconds)}
+
+#n_cores個のcoreを、DataLoaderのworker数とmain processのintra-op thread数に分ける候補を列挙する関数
+#worker数は0, 1, 2, 4, ...(n_cores未満)とし、残りのcoreを(少なくとも1つ)main processのthreadに割り当てる
+def candidate_core_splits(n_cores):
+	worker_counts = [0]
+	num_workers = 1
+	while num_workers < n_cores:
+		worker_counts.append(num_workers)
+		num_workers *= 2
+	return [(num_workers, max(n_cores - num_workers, 1)) for num_workers in worker_counts]
+
+#各(worker数, thread数)の分け方について、prefetch_factorとpersistent_workersの組のうちthroughputが最大の設定を1つずつ選ぶ関数
+#throughputs[i]はconfigs[i]のthroughput　分け方はconfigsに現れた順に並べて返す
+def best_config_per_core_split(configs, throughputs):
+	best = {}
+	for config, throughput in zip(configs, throughputs):
+		core_split = (config["num_workers"], config["torch_threads"])
+		if core_split not in best or throughput > best[core_split][1]:
+			best[core_split] = (config, throughput)
+	return [config for config, _ in best.values()]
+
+#DataLoaderとthread数の設定({"num_workers", "prefetch_factor", "persistent_workers", "torch_threads"})をjsonファイルに保存・読み込みする
+def save_loader_config(path, config):
+	with open(path, "w") as f:
+		json.dump(config, f, indent=2)
+
+def load_loader_config(path):
+	with open(path, "r") as f:
+		return json.load(f)
+
+#設定のthread数をこのprocessに適用し、make_train_loaderに渡す引数を返す関数
+#worker process内のthread数はDataLoaderによって1に設定されるため、ここでは設定しない
+def apply_loader_config(config):
+	torch.set_num_threads(config["torch_threads"])
+	return {key : config[key] for key in ["num_workers", "prefetch_factor", "persistent_workers"]}
+
+#path(vits_loader_tuner.pyで出力した設定)が存在すればその設定を、存在しなければ従来の設定(全てのcoreをworkerに使う)を返す関数
+def load_loader_config_or_default(path):
+	if path is not None and os.path.exists(path):
+		return load_loader_config(path)
+	return {"num_workers" : os.cpu_count(), "prefetch_factor" : 2, "persistent_workers" : False, "torch_threads" : torch.get_num_threads()}
@@ -19,6 +19,7 @@ from torch.autograd import Function
 import torch.nn.functional as F
 
 import torchaudio
+import functools
 
 def discriminator_adversarial_loss(discriminator_real_outputs, discriminator_fake_outputs):
 	loss = 0
@@ -64,4 +65,88 @@ def feature_loss(feature_map_real, feature_map_fake):
 			fmreal = fmreal.float().detach()
 			fmfake = fmfake.float()
 			loss += torch.mean(torch.abs(fmreal - fmfake))
-	return loss * 2 
+	return loss * 2
+
+#以下は上のadversarial loss, feature matching lossと同じ値を、discriminator・特徴量ごとのPythonのloopを使わずにまとめて計算する関数
+#元の関数はdiscriminatorの出力(6個)・特徴量(37個)ごとにfloatへの変換・差・平均・加算を行うため、1stepで数百回のkernelの起動が必要になる(.item()による同期も含む)
+#return_breakdown=Trueの場合は、discriminatorごとのlossをdevice上のtensor(要素数はdiscriminatorの数)として返す　値を取り出すまで同期は起きない
+#足し合わせる順序が異なるため、元の関数とは浮動小数点の丸め誤差の範囲で値・勾配が異なる
+
+#lengths個ずつの要素をそれぞれまとめる行列(要素数len(lengths)×sum(lengths))　weightsが"mean"ならば各要素は1/length、"sum"ならば1
+#discriminatorの出力・特徴量の大きさはbatch size・segment sizeが同じ間は変わらないため、作った行列を使い回す
+@functools.lru_cache(maxsize=16)
+def _segment_matrix(lengths, weights, device):
+	matrix = torch.zeros(len(lengths), sum(lengths))
+	start = 0
+	for i, length in enumerate(lengths):
+		matrix[i, start:start+length] = 1.0 / length if weights == "mean" else 1.0
+		start += length
+	return matrix.to(device)
+
+#各要素が1/lengthのtensor(要素数len(lengths))
+@functools.lru_cache(maxsize=16)
+def _reciprocal_lengths(lengths, device):
+	return (1.0 / torch.tensor(lengths, dtype=torch.float64)).float().to(device)
+
+#各tensorをfloatにして1次元につなげた1つのtensorと、各tensorの要素数のtupleを返す
+def _concatenate_outputs(outputs):
+	return torch.cat([output.reshape(-1) for output in outputs]).float(), tuple(output.numel() for output in outputs)
+
+def fused_discriminator_adversarial_loss(discriminator_real_outputs, discriminator_fake_outputs, return_breakdown=False):
+	real, lengths = _concatenate_outputs(discriminator_real_outputs)
+	fake, _ = _concatenate_outputs(discriminator_fake_outputs)
+	matrix = _segment_matrix(lengths, "mean", real.device)
+	#discriminatorごとの二乗誤差の平均(行列との積で一度に計算する)
+	real_losses = torch.mv(matrix, (1-real)**2)
+	fake_losses = torch.mv(matrix, fake**2)
+	loss = torch.sum(real_losses + fake_losses)
+	if return_breakdown:
+		return loss, real_losses, fake_losses
+	return loss
+
+def fused_generator_adversarial_loss(discriminator_fake_outputs, return_breakdown=False):
+	fake, lengths = _concatenate_outputs(discriminator_fake_outputs)
+	generator_losses = torch.mv(_segment_matrix(lengths, "mean", fake.device), (1-fake)**2)
+	loss = torch.sum(generator_losses)
+	if return_breakdown:
+		return loss, generator_losses
+	return loss
+
+#特徴量は合計で(batch size×約400万)要素と大きいため、1つにつなげるとその分のメモリを余分に使う
+#そこでtorch._foreach_*(optimizerやclip_grad_norm_が内部で用いる、tensorのlistに対する演算)で全ての特徴量の差と絶対値の和をまとめて計算する
+def fused_feature_loss(feature_map_real, feature_map_fake, return_breakdown=False):
+	fmaps_real = [fmreal.detach() for fmap_real in feature_map_real for fmreal in fmap_real]
+	fmaps_fake = [fmfake for fmap_fake in feature_map_fake for fmfake in fmap_fake]
+	#混合精度で学習する場合は元の関数と同様にfloatに変換してから差をとる
+	if any(fmap.dtype != torch.float32 for fmap in fmaps_real + fmaps_fake):
+		fmaps_real = [fmap.float() for fmap in fmaps_real]
+		fmaps_fake = [fmap.float() for fmap in fmaps_fake]
+	#各特徴量の差の絶対値の平均
+	lengths = tuple(fmap.numel() for fmap in fmaps_fake)
+	device = fmaps_fake[0].device
+	means = _ForeachL1Distance.apply(len(fmaps_real), *fmaps_real, *fmaps_fake) * _reciprocal_lengths(lengths, device)
+	loss = torch.sum(means) * 2
+	if return_breakdown:
+		#discriminatorごとに、その特徴量の平均を足し合わせる
+		discriminator_lengths = tuple(len(fmap_fake) for fmap_fake in feature_map_fake)
+		return loss, torch.mv(_segment_matrix(discriminator_lengths, "sum", device), means) * 2
+	return loss
+
+#tensorのlist 2つ(realとfake、それぞれn_tensors個)について、対応するtensorの差の絶対値の和をまとめたtensor(要素数n_tensors)を返す
+#autogradに任せると逆伝搬がtensorごとの演算(符号・積など)に分かれるため、逆伝搬も_foreach_*でまとめて計算する　勾配はfakeについてのみ求める
+class _ForeachL1Distance(Function):
+	@staticmethod
+	def forward(ctx, n_tensors, *tensors):
+		differences = torch._foreach_sub(tensors[n_tensors:], tensors[:n_tensors])
+		#floatでの和はCPUでは単純な逐次和で誤差が大きいため、doubleで足し合わせる
+		abs_sums = torch.stack(torch._foreach_norm(differences, 1, dtype=torch.float64)).float()
+		#逆伝搬には差の符号のみを用いる
+		torch._foreach_sign_(differences)
+		ctx.n_tensors = n_tensors
+		ctx.save_for_backward(*differences)
+		return abs_sums
+
+	@staticmethod
+	def backward(ctx, grad_abs_sums):
+		grads = torch._foreach_mul(ctx.saved_tensors, grad_abs_sums.unbind())
+		return (None,) + (None,) * ctx.n_tensors + tuple(grads)
@@ -0,0 +1,134 @@
+#encoding:utf-8
+
+from contextlib import contextmanager
+
+import torch
+import torch.nn as nn
+
+#学習の1stepについて、どのmoduleがどれだけメモリを使っているかを記録するクラス
+#modulesに指定した各module({名前 : module})にhookを登録し、順伝搬の間に以下を記録する(同じmoduleが複数回呼ばれた場合は合計する)
+# saved_activation_bytes : 逆伝搬のために保持されたtensor(activation)の大きさ[byte]　学習時のメモリ使用量の大部分を占める
+# output_bytes           : 出力されたtensorの大きさ[byte]
+# allocated_delta_bytes  : 順伝搬の前後でのGPUメモリの確保量の差[byte](GPUのみ)
+# peak_delta_bytes       : 順伝搬の間のGPUメモリの確保量の最大値と、順伝搬の前の確保量との差[byte](GPUのみ)
+#functionsに{名前 : (object, メソッド名)}を指定した場合は、そのメソッドの呼び出しも同様に記録する(MASなどmoduleでない処理に用いる)
+#moduleが入れ子になっている場合、外側のmoduleの値は内側のmoduleの値を含む
+class ModuleMemoryProfiler():
+	def __init__(self, modules, functions={}, device="cpu"):
+		self.device = torch.device(device)
+		self.use_cuda_stats = self.device.type == "cuda"
+		self.names = list(modules.keys()) + list(functions.keys())
+		self.handles = []
+		for name, module in modules.items():
+			self.handles.append(module.register_forward_pre_hook(lambda module, args, name=name: self._enter(name)))
+			self.handles.append(module.register_forward_hook(lambda module, args, output, name=name: self._exit(name, output)))
+		self.wrapped_functions = []
+		for name, (owner, method_name) in functions.items():
+			self._wrap_function(name, owner, method_name)
+		#現在順伝搬の途中にあるmoduleの記録(外側から順に並ぶ)
+		self.active_frames = []
+		self.records = None
+
+	#VitsGeneratorとVitsDiscriminatorについて、深さmax_depthまでの全てのsubmoduleとMASを記録の対象とするProfilerを作る
+	#ModuleListなどの入れ物は記録せず深さにも数えない(例えばnetD.discriminators.0は深さ1となる)
+	@classmethod
+	def for_vits(cls, netG, netD, max_depth=2, device="cpu"):
+		modules = {}
+		for prefix, network in [("netG", netG), ("netD", netD)]:
+			modules[prefix] = network
+			for name, module in _named_submodules(network, max_depth):
+				modules[f"{prefix}.{name}"] = module
+		return cls(modules, functions={"netG.search_alignment (MAS)" : (netG, "search_alignment")}, device=device)
+
+	#with profiler.step():の中で実行した処理を記録し、終了後にself.recordsに{名前 : 記録}を保存する
+	@contextmanager
+	def step(self):
+		self.records = {name : {"calls" : 0, "saved_activation_bytes" : 0, "output_bytes" : 0, "allocated_delta_bytes" : None, "peak_delta_bytes" : None} for name in self.names}
+		if self.use_cuda_stats:
+			torch.cuda.synchronize(self.device)
+			torch.cuda.reset_peak_memory_stats(self.device)
+		with torch.autograd.graph.saved_tensors_hooks(self._pack, lambda tensor: tensor):
+			yield self.records
+		if self.use_cuda_stats:
+			self.step_peak_bytes = torch.cuda.max_memory_allocated(self.device)
+
+	#記録を保持されたactivationの大きい順に並べたlist[(名前, 記録)]
+	def sorted_records(self, key="saved_activation_bytes"):
+		return sorted(self.records.items(), key=lambda item: item[1][key] or 0, reverse=True)
+
+	#登録したhookを取り除き、置き換えたメソッドを元に戻す
+	def remove(self):
+		for handle in self.handles:
+			handle.remove()
+		for owner, method_name in self.wrapped_functions:
+			delattr(owner, method_name)
+
+	def _wrap_function(self, name, owner, method_name):
+		function = getattr(owner, method_name)
+		def wrapped(*args, **kwargs):
+			self._enter(name)
+			output = function(*args, **kwargs)
+			self._exit(name, output)
+			return output
+		#インスタンスの属性として設定し、クラスのメソッドを上書きする(removeで属性を消すと元に戻る)
+		setattr(owner, method_name, wrapped)
+		self.wrapped_functions.append((owner, method_name))
+
+	def _enter(self, name):
+		if self.records is None:
+			return
+		#同じstorageを重複して数えないために、この呼び出しの間に保持されたstorageを記録する
+		#(逆伝搬を終えて解放されたstorageの番地は後の呼び出しで再利用されるため、呼び出しごとに記録する)
+		frame = {"name" : name, "saved_storages" : set()}
+		if self.use_cuda_stats:
+			#外側のmoduleの区間での最大値を記録してから、このmoduleの区間の最大値を測るためにリセットする
+			if len(self.active_frames) > 0:
+				self.active_frames[-1]["peak"] = max(self.active_frames[-1]["peak"], torch.cuda.max_memory_allocated(self.device))
+			torch.cuda.reset_peak_memory_stats(self.device)
+			frame["allocated_before"] = torch.cuda.memory_allocated(self.device)
+			frame["peak"] = frame["allocated_before"]
+		self.active_frames.append(frame)
+
+	def _exit(self, name, output):
+		if self.records is None or len(self.active_frames) == 0 or self.active_frames[-1]["name"] != name:
+			return
+		frame = self.active_frames.pop()
+		record = self.records[name]
+		record["calls"] += 1
+		record["output_bytes"] += _tensor_bytes(output)
+		if self.use_cuda_stats:
+			peak = max(frame["peak"], torch.cuda.max_memory_allocated(self.device))
+			record["allocated_delta_bytes"] = (record["allocated_delta_bytes"] or 0) + torch.cuda.memory_allocated(self.device) - frame["allocated_before"]
+			record["peak_delta_bytes"] = max(record["peak_delta_bytes"] or 0, peak - frame["allocated_before"])
+			#外側のmoduleの区間の最大値にこのmoduleの区間の最大値を含める
+			if len(self.active_frames) > 0:
+				self.active_frames[-1]["peak"] = max(self.active_frames[-1]["peak"], peak)
+			torch.cuda.reset_peak_memory_stats(self.device)
+
+	#逆伝搬のためにtensorが保持されるたびに呼ばれ、その大きさを順伝搬の途中にある全てのmoduleに加算する
+	#パラメーターそのものは除き、同じstorageを共有するtensorは1度だけ数える
+	def _pack(self, tensor):
+		if not (isinstance(tensor, nn.Parameter) or (tensor.is_leaf and tensor.requires_grad)):
+			storage = tensor.untyped_storage()
+			for frame in self.active_frames:
+				if storage.data_ptr() not in frame["saved_storages"]:
+					frame["saved_storages"].add(storage.data_ptr())
+					self.records[frame["name"]]["saved_activation_bytes"] += storage.nbytes()
+		return tensor
+
+#tensor(またはtensorを含むtuple, list)の大きさ[byte]
+def _tensor_bytes(output):
+	if torch.is_tensor(output):
+		return output.numel() * output.element_size()
+	if isinstance(output, (tuple, list)):
+		return sum(_tensor_bytes(x) for x in output)
+	return 0
+
+#moduleの深さmax_depthまでのsubmoduleを(名前, module)として列挙する　ModuleList・ModuleDict・Sequentialは列挙せず、その中身を同じ深さとして扱う
+def _named_submodules(module, max_depth, prefix="", depth=0):
+	for name, child in module.named_children():
+		if isinstance(child, (nn.ModuleList, nn.ModuleDict, nn.Sequential)):
+			yield from _named_submodules(child, max_depth, f"{prefix}{name}.", depth)
+		elif depth + 1 <= max_depth:
+			yield f"{prefix}{name}", child
+			yield from _named_submodules(child, max_depth, f"{prefix}{name}.", depth + 1)
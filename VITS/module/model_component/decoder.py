@@ -2,16 +2,15 @@
 
 import random
 import numpy as np
+import math
 
 import torch
 import torch.nn as nn
-import torch.optim as optim
-import torch.utils.data as data
-import torchvision
-from torchvision import models,transforms
-from torch.autograd import Function
 import torch.nn.functional as F
 
+from .speaker_conditioning import apply_condition_layer
+from .pqmf import PQMF
+
 def init_weights(m, mean=0.0, std=0.01):
   classname = m.__class__.__name__
   if classname.find("Conv") != -1:
@@ -82,6 +81,8 @@ class Decoder(torch.nn.Module):
 
         #Deconv1d層をいくつ生成するか
         self.num_deconvs = len(self.deconv_strides)
+        #入力zの1フレームあたりの出力波形のサンプル数
+        self.upsample_rate = int(np.prod(self.deconv_strides))
         #Deconv1d層1つにつき、self.num_resnet_blocks個resnetblockを生成する
         self.num_resnet_blocks = len(self.resblock_kernel_sizes)
 
@@ -107,25 +108,200 @@ class Decoder(torch.nn.Module):
         self.conv1d_post = nn.Conv1d(resnet_blocks_channels, 1, 7, 1, padding=3, bias=False)
         self.ups.apply(init_weights)
 
-    def forward(self, z, speaker_id_embedded):
+    #z_mask(torch.Size([batch_size, 1, length]))を指定した場合は、各層の入力のうちpadding部分を0とする
+    #長さの異なる発話をまとめたbatchでも、各発話を1つずつdecodeした場合と同じ出力が得られる
+    def forward(self, z, speaker_id_embedded, z_mask=None):
+        x = self.upsample(z, speaker_id_embedded, z_mask)
+        #出力音声はchannel数1
+        x = self.conv1d_post(x)
+        wav_fake = torch.tanh(x)
+        #生成された音声の出力
+        return wav_fake
+
+    #conv1d_preから各Deconv1d層・ResnetBlockまでを適用し、conv1d_postに入力する特徴量を返す
+    def upsample(self, z, speaker_id_embedded, z_mask=None):
+        if z_mask is not None:
+            z = z * z_mask
         #z, speaker_id_embedded両者のchannel数をconv1dによって揃える
-        x = self.conv1d_pre(z) + self.cond(speaker_id_embedded)
+        x = self.conv1d_pre(z) + apply_condition_layer(self.cond, speaker_id_embedded)
+        if z_mask is not None:
+            x = x * z_mask
+        x_mask = z_mask
         #各Deconv1d層の適用
         for i in range(self.num_deconvs):
             x = F.leaky_relu(x, 0.1)
             #各Deconv1d層の適用
             x = self.ups[i](x)
+            if x_mask is not None:
+                #maskもDeconv1d層の出力と同じ長さに引き伸ばす
+                x_mask = torch.repeat_interleave(x_mask, self.deconv_strides[i], dim=2)
+                x = x * x_mask
             #ResnetBlockをself.num_resnet_blocks個ずつ適用、（出力の総和/self.num_resnet_blocks）をxsとする
             xs = None
             for j in range(self.num_resnet_blocks):
                 if xs is None:
-                    xs = self.resblocks[i*self.num_resnet_blocks+j](x)
+                    xs = self.resblocks[i*self.num_resnet_blocks+j](x, x_mask)
                 else:
-                    xs += self.resblocks[i*self.num_resnet_blocks+j](x)
+                    xs += self.resblocks[i*self.num_resnet_blocks+j](x, x_mask)
             x = xs / self.num_resnet_blocks
         x = F.leaky_relu(x)
-        #出力音声はchannel数1
+        return x
+
+
+    #出力波形の1サンプルが、入力zの左右それぞれ何フレーム先までに依存するか(受容野)を計算する
+    def receptive_field_frames(self):
+        #conv1d_preのカーネルサイズ7による依存
+        receptive_field = (self.conv1d_pre.kernel_size[0] - 1) / 2
+        upsample_rate = 1
+        for i, (stride, kernel) in enumerate(zip(self.deconv_strides, self.deconv_kernel_sizes)):
+            #Deconv1d層の出力1サンプルは、入力のceil(kernel/stride)サンプルに依存する
+            receptive_field += math.ceil(kernel / stride) / upsample_rate
+            upsample_rate *= stride
+            #ResnetBlockのうち最も受容野の広いものによる依存
+            resblock_receptive_field = max(
+                sum(get_padding(kernel_size, d) + get_padding(kernel_size, 1) for d in dilation)
+                for kernel_size, dilation in zip(self.resblock_kernel_sizes, self.resblock_dilation_sizes))
+            receptive_field += resblock_receptive_field / upsample_rate
+        #conv1d_postのカーネルサイズ7による依存
+        receptive_field += (self.conv1d_post.kernel_size[0] - 1) / 2 / upsample_rate
+        return math.ceil(receptive_field)
+
+    #zを時間方向に分割し、窓ごとにdecodeした結果を順に返すgenerator
+    #各窓には左右にcontext_frames分の文脈を付け足してdecodeし、文脈部分に対応する出力は捨てることで継ぎ目のない波形を得る
+    #chunk_batch_size個の窓をまとめてbatchとしてdecodeする
+    #z_maskを指定した場合は窓ごとに同じ範囲を切り出して用いる　長さの異なる発話をまとめたbatchでも、各発話を1つずつdecodeした場合と同じ出力が得られる
+    def iter_chunks(self, z, speaker_id_embedded, chunk_frames=64, context_frames=None, chunk_batch_size=1, z_mask=None):
+        if context_frames is None:
+            context_frames = self.receptive_field_frames()
+        length = z.size(2)
+        #各窓について(zの切り出し開始位置, 切り出し終了位置, 出力として使う範囲の開始位置, 終了位置)を列挙
+        windows = []
+        for start in range(0, length, chunk_frames):
+            end = min(start + chunk_frames, length)
+            left = max(start - context_frames, 0)
+            right = min(end + context_frames, length)
+            windows.append((left, right, start - left, end - left))
+        #長さの等しい窓をchunk_batch_size個ずつまとめてdecodeする
+        pending_windows = []
+        for window in windows:
+            if len(pending_windows) > 0:
+                same_width = (window[1] - window[0]) == (pending_windows[0][1] - pending_windows[0][0])
+                if (not same_width) or len(pending_windows) >= chunk_batch_size:
+                    yield from self._decode_windows(z, speaker_id_embedded, pending_windows, z_mask)
+                    pending_windows = []
+            pending_windows.append(window)
+        if len(pending_windows) > 0:
+            yield from self._decode_windows(z, speaker_id_embedded, pending_windows, z_mask)
+
+    def _decode_windows(self, z, speaker_id_embedded, windows, z_mask=None):
+        batch_size = z.size(0)
+        upsample_rate = self.upsample_rate
+        #各窓をbatchの次元に沿って結合してまとめてdecode
+        z_windows = torch.cat([z[:, :, left:right] for left, right, _, _ in windows], dim=0)
+        speaker_id_embedded_windows = speaker_id_embedded.repeat(len(windows), 1, 1)
+        z_mask_windows = None if z_mask is None else torch.cat([z_mask[:, :, left:right] for left, right, _, _ in windows], dim=0)
+        wav_windows = self(z_windows, speaker_id_embedded_windows, z_mask_windows)
+        #文脈部分を取り除き、各窓の中心部分のみを返す
+        for i, (_, _, use_start, use_end) in enumerate(windows):
+            yield wav_windows[i*batch_size:(i+1)*batch_size, :, use_start*upsample_rate:use_end*upsample_rate]
+
+    #zを窓ごとに分割してdecodeする　ピークメモリが発話の長さではなく窓の大きさで決まる
+    def forward_chunked(self, z, speaker_id_embedded, chunk_frames=64, context_frames=None, chunk_batch_size=1, z_mask=None):
+        wav_chunks = list(self.iter_chunks(z, speaker_id_embedded, chunk_frames=chunk_frames, context_frames=context_frames, chunk_batch_size=chunk_batch_size, z_mask=z_mask))
+        return torch.cat(wav_chunks, dim=2)
+
+#Decoderの最後のDeconv1d層・ResnetBlockを省き、粗い時間解像度で各フレームの振幅と位相を予測して逆STFTで波形を合成するDecoder(iSTFTNet)
+#n_bands>1の場合は、n_bands個の帯域の波形をそれぞれ逆STFTで合成し、PQMFで1つの波形にまとめる(Multi-band iSTFT)
+#最もサンプル数の多い段階のDeconv1d層・ResnetBlockを計算しないため、Decoderより計算量が少ない
+#出力はDecoderと同じtorch.Size([batch_size, 1, length*upsample_rate])で、vits_train.pyでそのまま学習できる
+class ISTFTDecoder(Decoder):
+    def __init__(self,
+        speaker_id_embedding_dim,#話者idの埋め込み先のベクトルの大きさ
+        in_z_channel = 192,#入力するzのchannel数
+        upsample_initial_channel = 512,#入力されたzと埋め込み済み話者idの両者のチャネル数を、まず最初にconvを適用させることによってupsample_initial_channelに揃える
+        deconv_strides = [8, 8],#各Deconv1d層のstride
+        deconv_kernel_sizes = [16, 16],#各Deconv1d層のカーネルサイズ
+        resblock_kernel_sizes = [3, 7, 11],#各ResnetBlockのカーネルサイズ
+        resblock_dilation_sizes = [[1, 3, 5], [1, 3, 5], [1, 3, 5]],#各ResnetBlockのdilation
+        n_fft = 16,#逆STFTの窓の大きさ
+        istft_hop_length = 4,#逆STFTのホップ数
+        n_bands = 1):#帯域の数　1より大きければPQMFで合成する
+        super(ISTFTDecoder, self).__init__(speaker_id_embedding_dim, in_z_channel, upsample_initial_channel, deconv_strides, deconv_kernel_sizes, resblock_kernel_sizes, resblock_dilation_sizes)
+        self.n_fft = n_fft#逆STFTの窓の大きさ
+        self.istft_hop_length = istft_hop_length#逆STFTのホップ数
+        self.n_bands = n_bands#帯域の数
+        self.n_freqs = n_fft // 2 + 1#逆STFTに入力する周波数の数
+        #入力zの1フレームあたりの出力波形のサンプル数
+        self.upsample_rate = int(np.prod(self.deconv_strides)) * self.istft_hop_length * self.n_bands
+
+        #conv1d_postは波形の代わりに、各帯域の振幅(対数)と位相をそれぞれn_freqs個ずつ出力する
+        resnet_blocks_channels = self.upsample_initial_channel//(2**self.num_deconvs)
+        self.conv1d_post = nn.Conv1d(resnet_blocks_channels, self.n_bands * self.n_freqs * 2, 7, 1, padding=3)
+        self.conv1d_post.apply(init_weights)
+        #persistent=Falseのbufferは学習済みパラメーターに含まれないため、meta device上で構築する場合(module/model_loader.py参照)にも値を持つようdeviceを指定して作る
+        self.register_buffer("window", torch.hann_window(self.n_fft, device="cpu"), persistent=False)
+        self.pqmf = PQMF(self.n_bands) if self.n_bands > 1 else None
+
+    #z_maskを指定した場合は、padding部分のフレームを逆STFTの重ね合わせと窓の正規化から除き、各帯域の波形のpadding部分を0としてからPQMFで合成する
+    #Decoderと同様に、長さの異なる発話をまとめたbatchでも各発話を1つずつdecodeした場合と同じ出力が得られる
+    def forward(self, z, speaker_id_embedded, z_mask=None):
+        x = self.upsample(z, speaker_id_embedded, z_mask)
+        #振幅(対数)と位相の予測
         x = self.conv1d_post(x)
-        wav_fake = torch.tanh(x)
-        #生成された音声の出力
-        return wav_fake
+        batch_size, _, n_frames = x.size()
+        #逆STFTはbfloat16に対応していないためfloat32で計算する
+        x = x.float().view(batch_size * self.n_bands, self.n_freqs * 2, n_frames)
+        magnitude = torch.exp(x[:, :self.n_freqs])
+        phase = math.pi * torch.sin(x[:, self.n_freqs:])
+        #maskを振幅・位相のフレーム(長さn_frames)に合わせ、各帯域に複製する
+        frame_mask = None
+        if z_mask is not None:
+            frame_mask = torch.repeat_interleave(z_mask.float(), n_frames // z_mask.size(2), dim=2).repeat_interleave(self.n_bands, dim=0)
+        wav = self._istft(torch.polar(magnitude, phase), frame_mask)
+        if frame_mask is not None:
+            wav = wav * torch.repeat_interleave(frame_mask, self.istft_hop_length, dim=2)
+        wav = wav.view(batch_size, self.n_bands, -1)
+        if self.pqmf is not None:
+            wav = self.pqmf.synthesis(wav)
+        return wav
+
+    #torch.istft(center=True, length=n_frames*istft_hop_length)と同じ逆STFT
+    #spectrum : torch.Size([batch_size, n_freqs, n_frames])(複素数) -> torch.Size([batch_size, 1, n_frames*istft_hop_length])
+    #frame_maskを指定した場合は、mask=0のフレームを重ね合わせにも窓の二乗和(正規化)にも含めない
+    def _istft(self, spectrum, frame_mask=None):
+        n_frames = spectrum.size(2)
+        frames = torch.fft.irfft(spectrum, n=self.n_fft, dim=1) * self.window[None, :, None]
+        window_envelope = (self.window ** 2)[None, :, None].expand(frames.size(0), -1, n_frames)
+        if frame_mask is not None:
+            frames = frames * frame_mask
+            window_envelope = window_envelope * frame_mask
+        #各フレームをistft_hop_lengthずつずらして足し合わせる(overlap-add)
+        output_size = (1, (n_frames - 1) * self.istft_hop_length + self.n_fft)
+        wav = F.fold(frames, output_size, kernel_size=(1, self.n_fft), stride=(1, self.istft_hop_length))
+        window_envelope = F.fold(window_envelope, output_size, kernel_size=(1, self.n_fft), stride=(1, self.istft_hop_length))
+        #center=Trueで付け足された両端のn_fft//2サンプルを取り除く
+        start, end = self.n_fft // 2, self.n_fft // 2 + n_frames * self.istft_hop_length
+        wav, window_envelope = wav[:, 0, :, start:end], window_envelope[:, 0, :, start:end]
+        #どのフレームにも含まれないサンプル(padding部分)は0のままとする
+        return wav / torch.where(window_envelope > 1e-11, window_envelope, torch.ones_like(window_envelope))
+
+    def receptive_field_frames(self):
+        #conv1d_postまでの受容野に加え、逆STFTの窓とPQMFのfilterの長さによる依存
+        spectrum_rate = int(np.prod(self.deconv_strides))
+        receptive_field = (self.n_fft / 2 / self.istft_hop_length) / spectrum_rate
+        if self.pqmf is not None:
+            receptive_field += self.pqmf.taps / 2 / self.n_bands / self.istft_hop_length / spectrum_rate
+        return super(ISTFTDecoder, self).receptive_field_frames() + math.ceil(receptive_field)
+
+#decoder_typeで指定した種類のDecoderを作る関数　それ以外の引数は各Decoderに渡す
+#"default" : Deconv1d層で波形までupsampleするDecoder
+#"istft" : 逆STFTで波形を合成するISTFTDecoder
+#"multiband_istft" : 4つの帯域の波形を逆STFTで合成しPQMFでまとめるISTFTDecoder(Deconv1d層はstride 4を2つ)
+def build_decoder(decoder_type="default", **kwargs):
+    if decoder_type == "default":
+        return Decoder(**kwargs)
+    if decoder_type == "istft":
+        return ISTFTDecoder(**kwargs)
+    if decoder_type == "multiband_istft":
+        return ISTFTDecoder(**{"deconv_strides" : [4, 4], "deconv_kernel_sizes" : [16, 16], "n_bands" : 4, **kwargs})
+    raise ValueError(f"unknown decoder_type: {decoder_type}")
@@ -5,11 +5,6 @@ import numpy as np
 
 import torch
 import torch.nn as nn
-import torch.optim as optim
-import torch.utils.data as data
-import torchvision
-from torchvision import models,transforms
-from torch.autograd import Function
 import torch.nn.functional as F
 
 from .wn import WN
@@ -115,4 +110,8 @@ class Flow(nn.Module):
         else:
             for flow in reversed(self.flows):
                 z_p = flow(z_p, z_p_mask, speaker_id_embedded=speaker_id_embedded, reverse=reverse)
-        return z_p
\ No newline at end of file
+        return z_p
+
+    #出力の1フレームが、入力の左右それぞれ何フレーム先までに依存するか(受容野)を計算する　順方向・逆方向ともに同じ
+    def receptive_field_frames(self):
+        return sum(flow.wn.receptive_field_frames() for flow in self.flows if isinstance(flow, ResidualCouplingLayer))
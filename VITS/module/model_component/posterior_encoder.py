@@ -5,11 +5,6 @@ import numpy as np
 
 import torch
 import torch.nn as nn
-import torch.optim as optim
-import torch.utils.data as data
-import torchvision
-from torchvision import models,transforms
-from torch.autograd import Function
 import torch.nn.functional as F
 
 from .wn import WN
@@ -42,7 +37,8 @@ class PosteriorEncoder(nn.Module):
         #ガウス分布の平均と分散を生成するネットワーク
         self.projection = nn.Conv1d(self.phoneme_embedding_dim, self.out_z_channels * 2, 1)
 
-    def forward(self, spectrogram, spectrogram_lengths, speaker_id_embedded):
+    #noise(torch.Size([batch_size, out_z_channels, length]))を指定した場合は、zのサンプリングに乱数の代わりに用いる
+    def forward(self, spectrogram, spectrogram_lengths, speaker_id_embedded, noise=None):
         #maskの生成
         max_length = spectrogram.size(2)
         progression = torch.arange(max_length, dtype=spectrogram_lengths.dtype, device=spectrogram_lengths.device)
@@ -56,5 +52,11 @@ class PosteriorEncoder(nn.Module):
         statistics = self.projection(x) * spectrogram_mask
         gauss_mean, gauss_log_variance = torch.split(statistics, self.out_z_channels, dim=1)
         #平均gauss_mean, 分散exp(gauss_log_variance)の正規分布から値をサンプリング
-        z = (gauss_mean + torch.randn_like(gauss_mean) * torch.exp(gauss_log_variance)) * spectrogram_mask
-        return z, gauss_mean, gauss_log_variance, spectrogram_mask
\ No newline at end of file
+        if noise is None:
+            noise = torch.randn_like(gauss_mean)
+        z = (gauss_mean + noise * torch.exp(gauss_log_variance)) * spectrogram_mask
+        return z, gauss_mean, gauss_log_variance, spectrogram_mask
+
+    #出力の1フレームが、入力の左右それぞれ何フレーム先までに依存するか(受容野)を計算する　preprocess, projectionはカーネルサイズ1のため依存しない
+    def receptive_field_frames(self):
+        return self.wn.receptive_field_frames()
@@ -0,0 +1,55 @@
+#encoding:utf-8
+
+import numpy as np
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+#PQMF(Pseudo Quadrature Mirror Filter)のprototype filter(Kaiser窓をかけたsinc関数)を作る関数
+#taps : filterの長さ-1, cutoff_ratio : 遮断周波数(ナイキスト周波数に対する比), beta : Kaiser窓のパラメーター
+def design_prototype_filter(taps=62, cutoff_ratio=0.142, beta=9.0):
+    assert taps % 2 == 0, "taps should be even"
+    omega_c = np.pi * cutoff_ratio
+    n = np.arange(taps + 1) - 0.5 * taps
+    with np.errstate(invalid="ignore"):
+        h = np.sin(omega_c * n) / (np.pi * n)
+    #中心(n=0)は極限値をとる
+    h[taps // 2] = cutoff_ratio
+    return h * np.kaiser(taps + 1, beta)
+
+#波形をn_bands個の帯域に分割(analysis)・帯域ごとの波形から元の波形を合成(synthesis)するPQMF filter bank
+#分割した各帯域の波形のサンプリングレートは元の1/n_bandsとなる　filterは固定で学習しない
+class PQMF(nn.Module):
+    def __init__(self, n_bands=4, taps=62, cutoff_ratio=0.142, beta=9.0):
+        super().__init__()
+        self.n_bands = n_bands
+        self.taps = taps
+        prototype = design_prototype_filter(taps, cutoff_ratio, beta)
+        analysis_filter = np.zeros((n_bands, taps + 1))
+        synthesis_filter = np.zeros((n_bands, taps + 1))
+        n = np.arange(taps + 1) - taps / 2
+        for k in range(n_bands):
+            phase = (2 * k + 1) * (np.pi / (2 * n_bands)) * n
+            analysis_filter[k] = 2 * prototype * np.cos(phase + (-1) ** k * np.pi / 4)
+            synthesis_filter[k] = 2 * prototype * np.cos(phase - (-1) ** k * np.pi / 4)
+        #analysis : torch.Size([n_bands, 1, taps+1]), synthesis : torch.Size([1, n_bands, taps+1])
+        self.register_buffer("analysis_filter", torch.from_numpy(analysis_filter).float().unsqueeze(1), persistent=False)
+        self.register_buffer("synthesis_filter", torch.from_numpy(synthesis_filter).float().unsqueeze(0), persistent=False)
+        #帯域ごとのdownsample・upsampleに用いるfilter(各帯域についてn_bandsサンプルに1つを取り出す・0を挿入する)
+        #persistent=Falseのbufferは学習済みパラメーターに含まれないため、meta device上で構築する場合(module/model_loader.py参照)にも値を持つようdeviceを指定して作る
+        updown_filter = torch.zeros(n_bands, n_bands, n_bands, device="cpu")
+        for k in range(n_bands):
+            updown_filter[k, k, 0] = 1.0
+        self.register_buffer("updown_filter", updown_filter, persistent=False)
+
+    #x : torch.Size([batch_size, 1, length]) -> torch.Size([batch_size, n_bands, length//n_bands])
+    def analysis(self, x):
+        x = F.conv1d(F.pad(x, (self.taps // 2, self.taps // 2)), self.analysis_filter)
+        return F.conv1d(x, self.updown_filter, stride=self.n_bands)
+
+    #x : torch.Size([batch_size, n_bands, length]) -> torch.Size([batch_size, 1, length*n_bands])
+    def synthesis(self, x):
+        #0を挿入してupsampleした分だけ振幅が1/n_bandsになるため、n_bands倍して戻す
+        x = F.conv_transpose1d(x, self.updown_filter * self.n_bands, stride=self.n_bands)
+        return F.conv1d(F.pad(x, (self.taps // 2, self.taps // 2)), self.synthesis_filter)
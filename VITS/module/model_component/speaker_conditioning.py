@@ -0,0 +1,39 @@
+#encoding:utf-8
+
+import torch
+
+#埋め込み済み話者idと、それを入力とする各条件付け層(Decoder.cond, WN.condition_layerなど)の出力をまとめて保持するクラス
+#話者idが同じであればこれらの値はリクエストによらず一定であるため、推論時に前計算したものを埋め込み済み話者idの代わりに各モジュールへ渡す
+#各モジュール内ではapply_condition_layerを通して条件付け層を適用することで、前計算した値がそのまま用いられる
+class SpeakerConditioning():
+    def __init__(self, speaker_id_embedded, features):
+        self.speaker_id_embedded = speaker_id_embedded#埋め込み済み話者id torch.Size([batch_size, speaker_id_embedding_dim, 1])
+        self.features = features#条件付け層 : その層の出力 torch.Size([batch_size, 出力channel数, 1]) のdict
+
+    #複数のSpeakerConditioningをbatchの次元に沿って結合する
+    @staticmethod
+    def cat(speaker_conditionings):
+        if len(speaker_conditionings) == 1:
+            return speaker_conditionings[0]
+        speaker_id_embedded = torch.cat([c.speaker_id_embedded for c in speaker_conditionings], dim=0)
+        features = {layer : torch.cat([c.features[layer] for c in speaker_conditionings], dim=0) for layer in speaker_conditionings[0].features}
+        return SpeakerConditioning(speaker_id_embedded, features)
+
+    #以下はtorch.Tensorと同じように扱えるようにするためのメソッド
+    def size(self, dim=None):
+        return self.speaker_id_embedded.size(dim) if dim is not None else self.speaker_id_embedded.size()
+
+    def repeat(self, *sizes):
+        return SpeakerConditioning(self.speaker_id_embedded.repeat(*sizes), {layer : feature.repeat(*sizes) for layer, feature in self.features.items()})
+
+    def detach(self):
+        return SpeakerConditioning(self.speaker_id_embedded.detach(), {layer : feature.detach() for layer, feature in self.features.items()})
+
+    def to(self, *args, **kwargs):
+        return SpeakerConditioning(self.speaker_id_embedded.to(*args, **kwargs), {layer : feature.to(*args, **kwargs) for layer, feature in self.features.items()})
+
+#埋め込み済み話者idに条件付け層を適用する関数　前計算済みの値があればそれを返す
+def apply_condition_layer(condition_layer, speaker_id_embedded):
+    if isinstance(speaker_id_embedded, SpeakerConditioning):
+        return speaker_id_embedded.features[condition_layer]
+    return condition_layer(speaker_id_embedded)
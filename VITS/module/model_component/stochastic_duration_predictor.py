@@ -6,13 +6,10 @@ import math
 
 import torch
 import torch.nn as nn
-import torch.optim as optim
-import torch.utils.data as data
-import torchvision
-from torchvision import models,transforms
-from torch.autograd import Function
 import torch.nn.functional as F
 
+from .speaker_conditioning import apply_condition_layer
+
 DEFAULT_MIN_BIN_WIDTH = 1e-3
 DEFAULT_MIN_BIN_HEIGHT = 1e-3
 DEFAULT_MIN_DERIVATIVE = 1e-3
@@ -52,14 +49,6 @@ def piecewise_rational_quadratic_transform(inputs,
     return outputs, logabsdet
 
 
-def searchsorted(bin_locations, inputs, eps=1e-6):
-    bin_locations[..., -1] += eps
-    return torch.sum(
-        inputs[..., None] >= bin_locations,
-        dim=-1
-    ) - 1
-
-
 def unconstrained_rational_quadratic_spline(inputs,
                                             unnormalized_widths,
                                             unnormalized_heights,
@@ -70,34 +59,31 @@ def unconstrained_rational_quadratic_spline(inputs,
                                             min_bin_width=DEFAULT_MIN_BIN_WIDTH,
                                             min_bin_height=DEFAULT_MIN_BIN_HEIGHT,
                                             min_derivative=DEFAULT_MIN_DERIVATIVE):
-    inside_interval_mask = (inputs >= -tail_bound) & (inputs <= tail_bound)
-    outside_interval_mask = ~inside_interval_mask
-
-    outputs = torch.zeros_like(inputs)
-    logabsdet = torch.zeros_like(inputs)
-
-    if tails == 'linear':
-        unnormalized_derivatives = F.pad(unnormalized_derivatives, pad=(1, 1))
-        constant = np.log(np.exp(1 - min_derivative) - 1)
-        unnormalized_derivatives[..., 0] = constant
-        unnormalized_derivatives[..., -1] = constant
-
-        outputs[outside_interval_mask] = inputs[outside_interval_mask]
-        logabsdet[outside_interval_mask] = 0
-    else:
+    if tails != 'linear':
         raise RuntimeError('{} tails are not implemented.'.format(tails))
 
-    outputs[inside_interval_mask], logabsdet[inside_interval_mask] = rational_quadratic_spline(
-        inputs=inputs[inside_interval_mask],
-        unnormalized_widths=unnormalized_widths[inside_interval_mask, :],
-        unnormalized_heights=unnormalized_heights[inside_interval_mask, :],
-        unnormalized_derivatives=unnormalized_derivatives[inside_interval_mask, :],
+    #[-tail_bound, tail_bound]の外側の要素は恒等変換となる
+    #boolean maskによる要素の抽出と書き戻しを行わず、全要素についてsplineを計算してからtorch.whereで選択する
+    #外側の要素はsplineの定義域内の値(0)に置き換えて計算する　clampを用いると境界(±tail_bound)上の入力の勾配が0になるため、内側の要素は入力をそのまま渡す
+    inside_interval_mask = (inputs >= -tail_bound) & (inputs <= tail_bound)
+    constant = float(np.log(np.exp(1 - min_derivative) - 1))
+    unnormalized_derivatives = F.pad(unnormalized_derivatives, pad=(1, 1), value=constant)
+
+    outputs, logabsdet = _rational_quadratic_spline(
+        inputs=torch.where(inside_interval_mask, inputs, torch.zeros_like(inputs)),
+        #ONNXへの書き出し時のみ、searchsortedを用いずにbinを探索する
+        comparison_bin_search=torch.onnx.is_in_onnx_export(),
+        unnormalized_widths=unnormalized_widths,
+        unnormalized_heights=unnormalized_heights,
+        unnormalized_derivatives=unnormalized_derivatives,
         inverse=inverse,
         left=-tail_bound, right=tail_bound, bottom=-tail_bound, top=tail_bound,
         min_bin_width=min_bin_width,
         min_bin_height=min_bin_height,
         min_derivative=min_derivative
     )
+    outputs = torch.where(inside_interval_mask, outputs, inputs)
+    logabsdet = torch.where(inside_interval_mask, logabsdet, torch.zeros_like(logabsdet))
 
     return outputs, logabsdet
 
@@ -120,10 +106,29 @@ def rational_quadratic_spline(inputs,
     if min_bin_height * num_bins > 1.0:
         raise ValueError('Minimal bin height too large for the number of bins')
 
+    return _rational_quadratic_spline(inputs, unnormalized_widths, unnormalized_heights, unnormalized_derivatives,
+                                      inverse=inverse, left=left, right=right, bottom=bottom, top=top,
+                                      min_bin_width=min_bin_width, min_bin_height=min_bin_height, min_derivative=min_derivative)
+
+#rational_quadratic_splineの本体　入力が定義域内にあることを前提とし、bin探索・gather・有理二次式の計算をTorchScriptによりまとめて実行する
+#値域のチェック等のGPU-CPU間の同期を伴う処理は行わない
+@torch.jit.script
+def _rational_quadratic_spline(inputs,
+                               unnormalized_widths,
+                               unnormalized_heights,
+                               unnormalized_derivatives,
+                               inverse: bool = False,
+                               left: float = 0., right: float = 1., bottom: float = 0., top: float = 1.,
+                               min_bin_width: float = 1e-3,
+                               min_bin_height: float = 1e-3,
+                               min_derivative: float = 1e-3,
+                               comparison_bin_search: bool = False):
+    num_bins = unnormalized_widths.shape[-1]
+
     widths = F.softmax(unnormalized_widths, dim=-1)
     widths = min_bin_width + (1 - min_bin_width * num_bins) * widths
     cumwidths = torch.cumsum(widths, dim=-1)
-    cumwidths = F.pad(cumwidths, pad=(1, 0), mode='constant', value=0.0)
+    cumwidths = F.pad(cumwidths, pad=[1, 0], mode='constant', value=0.0)
     cumwidths = (right - left) * cumwidths + left
     cumwidths[..., 0] = left
     cumwidths[..., -1] = right
@@ -134,16 +139,23 @@ def rational_quadratic_spline(inputs,
     heights = F.softmax(unnormalized_heights, dim=-1)
     heights = min_bin_height + (1 - min_bin_height * num_bins) * heights
     cumheights = torch.cumsum(heights, dim=-1)
-    cumheights = F.pad(cumheights, pad=(1, 0), mode='constant', value=0.0)
+    cumheights = F.pad(cumheights, pad=[1, 0], mode='constant', value=0.0)
     cumheights = (top - bottom) * cumheights + bottom
     cumheights[..., 0] = bottom
     cumheights[..., -1] = top
     heights = cumheights[..., 1:] - cumheights[..., :-1]
 
+    #入力がどのbinに属するかを探索する　右端のbinに入力の上限値が含まれるよう、探索時のみ右端を1e-6だけ広げる
     if inverse:
-        bin_idx = searchsorted(cumheights, inputs)[..., None]
+        bin_locations = cumheights
+    else:
+        bin_locations = cumwidths
+    bin_locations = torch.cat([bin_locations[..., :-1], bin_locations[..., -1:] + 1e-6], dim=-1).detach()
+    if comparison_bin_search:
+        #ONNXにはsearchsortedに相当する演算がないため、代わりに境界との比較の数を数える(binの数は少ないため結果は同じ)
+        bin_idx = torch.sum((inputs[..., None] >= bin_locations).long(), dim=-1, keepdim=True) - 1
     else:
-        bin_idx = searchsorted(cumwidths, inputs)[..., None]
+        bin_idx = torch.searchsorted(bin_locations, inputs[..., None], right=True) - 1
 
     input_cumwidths = cumwidths.gather(-1, bin_idx)[..., 0]
     input_bin_widths = widths.gather(-1, bin_idx)[..., 0]
@@ -169,7 +181,6 @@ def rational_quadratic_spline(inputs,
         c = - input_delta * (inputs - input_cumheights)
 
         discriminant = b.pow(2) - 4 * a * c
-        assert (discriminant >= 0).all()
 
         root = (2 * c) / (-b - torch.sqrt(discriminant))
         outputs = root * input_bin_widths + input_cumwidths
@@ -361,13 +372,14 @@ class StochasticDurationPredictor(nn.Module):
         self.convs = DDSConv(filter_channels, kernel_size, n_layers=3, p_dropout=p_dropout)
         self.cond = nn.Conv1d(speaker_id_embedding_dim, filter_channels, 1)
 
-    def forward(self, text_encoded, text_mask, duration_of_each_phoneme=None, speaker_id_embedded=None, reverse=False, noise_scale=1.0):
+    #推論時にnoise(torch.Size([batch_size, 2, length]))を指定した場合は、乱数の代わりに用いる
+    def forward(self, text_encoded, text_mask, duration_of_each_phoneme=None, speaker_id_embedded=None, reverse=False, noise_scale=1.0, noise=None):
         #入力text_encodedと埋め込み済み話者idに対し畳み込みを実行
         x = torch.detach(text_encoded)
         x = self.pre(x)
         if speaker_id_embedded is not None:
-            speaker_id_embedded = torch.detach(speaker_id_embedded)
-            x = x + self.cond(speaker_id_embedded)
+            speaker_id_embedded = speaker_id_embedded.detach()
+            x = x + apply_condition_layer(self.cond, speaker_id_embedded)
         x = self.convs(x, text_mask)
         x = self.proj(x) * text_mask
         #順伝搬(学習)時
@@ -407,7 +419,9 @@ class StochasticDurationPredictor(nn.Module):
         else:
             flows = list(reversed(self.flows))
             flows = flows[:-2] + [flows[-1]] # remove a useless vflow
-            z = torch.randn(x.size(0), 2, x.size(2)).to(device=x.device, dtype=x.dtype) * noise_scale
+            if noise is None:
+                noise = torch.randn(x.size(0), 2, x.size(2)).to(device=x.device, dtype=x.dtype)
+            z = noise * noise_scale
             for flow in flows:
                 z = flow(z, text_mask, g=x, reverse=True)
             z0, z1 = torch.split(z, [1, 1], 1)
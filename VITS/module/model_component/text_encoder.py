@@ -6,11 +6,6 @@ import math
 
 import torch
 import torch.nn as nn
-import torch.optim as optim
-import torch.utils.data as data
-import torchvision
-from torchvision import models,transforms
-from torch.autograd import Function
 import torch.nn.functional as F
 
 def convert_pad_shape(pad_shape):
@@ -19,7 +14,7 @@ def convert_pad_shape(pad_shape):
     return pad_shape
 
 class MultiHeadAttention(nn.Module):
-    def __init__(self, channels, out_channels, n_heads, p_dropout=0., window_size=None, heads_share=True, block_length=None, proximal_bias=False, proximal_init=False):
+    def __init__(self, channels, out_channels, n_heads, p_dropout=0., window_size=None, heads_share=True, block_length=None, proximal_bias=False, proximal_init=False, query_chunk_size=256):
         super().__init__()
         assert channels % n_heads == 0
 
@@ -32,6 +27,9 @@ class MultiHeadAttention(nn.Module):
         self.block_length = block_length
         self.proximal_bias = proximal_bias
         self.proximal_init = proximal_init
+        #queryをこの長さごとに区切ってattentionを計算する　scoresなどの中間tensorは[b, n_h, query_chunk_size, t_s]までとなり、入力長に対して線形のメモリで済む
+        #Noneならば区切らない
+        self.query_chunk_size = query_chunk_size
         self.attn = None
 
         self.k_channels = channels // n_heads
@@ -72,30 +70,50 @@ class MultiHeadAttention(nn.Module):
         key = key.view(b, self.n_heads, self.k_channels, t_s).transpose(2, 3)
         value = value.view(b, self.n_heads, self.k_channels, t_s).transpose(2, 3)
 
+        #ONNXへの書き出し時は入力長によって分岐しないよう、区切らずに計算する
+        chunk_size = self.query_chunk_size
+        if chunk_size is None or chunk_size >= t_t or torch.jit.is_tracing():
+            output, p_attn = self._attention_rows(query, key, value, mask, 0)
+        else:
+            #区切った各部分のattentionの重みは保持しない(保持すると[b, n_h, t_t, t_s]のメモリが必要となるため)
+            output = torch.cat([self._attention_rows(query[:, :, row_start:row_start+chunk_size], key, value, mask, row_start)[0] for row_start in range(0, t_t, chunk_size)], dim=2)
+            p_attn = None
+        output = output.transpose(2, 3).contiguous().view(b, d, t_t) # [b, n_h, t_t, d_k] -> [b, d, t_t]
+        return output, p_attn
+
+    def _attention_rows(self, query, key, value, mask, row_start):
+        """
+        query: [b, h, l_q, d] (queryのrow_start行目からl_q行分)
+        key, value: [b, h, l, d]
+        mask: [b, 1, l, l] または [b, 1, 1, l]
+        ret: [b, h, l_q, d], [b, h, l_q, l]
+        """
+        t_q, t_s = query.size(2), key.size(2)
         scores = torch.matmul(query / math.sqrt(self.k_channels), key.transpose(-2, -1))
         if self.window_size is not None:
-            assert t_s == t_t, "Relative attention is only available for self-attention."
-            key_relative_embeddings = self._get_relative_embeddings(self.emb_rel_k, t_s)
-            rel_logits = self._matmul_with_relative_keys(query /math.sqrt(self.k_channels), key_relative_embeddings)
-            scores_local = self._relative_position_to_absolute_position(rel_logits)
-            scores = scores + scores_local
+            assert row_start + t_q <= t_s, "Relative attention is only available for self-attention."
+            #相対位置埋め込みは-window_size~window_sizeの範囲にしか値を持たないため、
+            #[b, n_h, t, 2*t-1]の中間tensorを作らずに[b, n_h, t, 2*window_size+1]の帯として計算し、scoresの対角成分に直接加算する
+            rel_logits = self._matmul_with_relative_keys(query / math.sqrt(self.k_channels), self.emb_rel_k)
+            scores = self._add_relative_band(scores, rel_logits, row_start)
         if self.proximal_bias:
-            assert t_s == t_t, "Proximal bias is only available for self-attention."
-            scores = scores + self._attention_bias_proximal(t_s).to(device=scores.device, dtype=scores.dtype)
+            assert row_start + t_q <= t_s, "Proximal bias is only available for self-attention."
+            scores = scores + self._attention_bias_proximal(t_s, row_start, row_start + t_q).to(device=scores.device, dtype=scores.dtype)
         if mask is not None:
+            if mask.size(-2) > 1:
+                mask = mask[..., row_start:row_start+t_q, :]
             scores = scores.masked_fill(mask == 0, -1e4)
             if self.block_length is not None:
-                assert t_s == t_t, "Local attention is only available for self-attention."
-                block_mask = torch.ones_like(scores).triu(-self.block_length).tril(self.block_length)
+                assert row_start + t_q <= t_s, "Local attention is only available for self-attention."
+                block_mask = torch.ones_like(scores).triu(row_start - self.block_length).tril(row_start + self.block_length)
                 scores = scores.masked_fill(block_mask == 0, -1e4)
-        p_attn = F.softmax(scores, dim=-1) # [b, n_h, t_t, t_s]
+        p_attn = F.softmax(scores, dim=-1) # [b, n_h, t_q, t_s]
         p_attn = self.drop(p_attn)
         output = torch.matmul(p_attn, value)
         if self.window_size is not None:
-            relative_weights = self._absolute_position_to_relative_position(p_attn)
-            value_relative_embeddings = self._get_relative_embeddings(self.emb_rel_v, t_s)
-            output = output + self._matmul_with_relative_values(relative_weights, value_relative_embeddings)
-        output = output.transpose(2, 3).contiguous().view(b, d, t_t) # [b, n_h, t_t, d_k] -> [b, d, t_t]
+            #p_attnのうち相対位置埋め込みが存在する帯の部分のみを取り出してから埋め込みと掛け合わせる
+            relative_weights = self._gather_relative_band(p_attn, row_start)
+            output = output + self._matmul_with_relative_values(relative_weights, self.emb_rel_v)
         return output, p_attn
 
     def _matmul_with_relative_values(self, x, y):
@@ -116,61 +134,60 @@ class MultiHeadAttention(nn.Module):
         ret = torch.matmul(x, y.unsqueeze(0).transpose(-2, -1))
         return ret
 
-    def _get_relative_embeddings(self, relative_embeddings, length):
-        max_relative_position = 2 * self.window_size + 1
-        # Pad first before slice to avoid using cond ops.
-        pad_length = max(length - (self.window_size + 1), 0)
-        slice_start_position = max((self.window_size + 1) - length, 0)
-        slice_end_position = slice_start_position + 2 * length - 1
-        if pad_length > 0:
-            padded_relative_embeddings = F.pad(
-                relative_embeddings,
-                convert_pad_shape([[0, 0], [pad_length, pad_length], [0, 0]]))
-        else:
-            padded_relative_embeddings = relative_embeddings
-        used_relative_embeddings = padded_relative_embeddings[:,slice_start_position:slice_end_position]
-        return used_relative_embeddings
-
-    def _relative_position_to_absolute_position(self, x):
+    def _add_relative_band(self, scores, rel_logits, row_start=0):
         """
-        x: [b, h, l, 2*l-1]
-        ret: [b, h, l, l]
+        scores: [b, h, l_q, l] (row_start行目からl_q行分)
+        rel_logits: [b, h, l_q, 2*window_size+1]
+        ret: [b, h, l_q, l] (scoresに直接加算する)
         """
-        batch, heads, length, _ = x.size()
-        # Concat columns of pad to shift from relative to absolute indexing.
-        x = F.pad(x, convert_pad_shape([[0,0],[0,0],[0,0],[0,1]]))
-
-        # Concat extra elements so to add up to shape (len+1, 2*len-1).
-        x_flat = x.view([batch, heads, length * 2 * length])
-        x_flat = F.pad(x_flat, convert_pad_shape([[0,0],[0,0],[0,length-1]]))
-
-        # Reshape and slice out the padded elements.
-        x_final = x_flat.view([batch, heads, length+1, 2*length-1])[:, :, :length, length-1:]
-        return x_final
-
-    def _absolute_position_to_relative_position(self, x):
+        for offset in range(-self.window_size, self.window_size + 1):
+            rows = self._band_rows(scores, row_start, offset)
+            if rows is None:
+                continue
+            scores.diagonal(offset=row_start + offset, dim1=-2, dim2=-1).add_(rel_logits[..., rows[0]:rows[1], offset + self.window_size])
+        return scores
+
+    def _gather_relative_band(self, x, row_start=0):
+        """
+        x: [b, h, l_q, l] (row_start行目からl_q行分)
+        ret: [b, h, l_q, 2*window_size+1]
+        """
+        batch, heads, n_rows, _ = x.size()
+        bands = []
+        for offset in range(-self.window_size, self.window_size + 1):
+            rows = self._band_rows(x, row_start, offset)
+            if rows is None:
+                bands.append(x.new_zeros(batch, heads, n_rows))
+                continue
+            # 対角成分を取り出し、行の位置が揃うように足りない分を0で埋める
+            diagonal = x.diagonal(offset=row_start + offset, dim1=-2, dim2=-1)
+            bands.append(F.pad(diagonal, (rows[0], n_rows - rows[1])))
+        return torch.stack(bands, dim=-1)
+
+    def _band_rows(self, x, row_start, offset):
         """
-        x: [b, h, l, l]
-        ret: [b, h, l, 2*l-1]
+        x: [b, h, l_q, l] (row_start行目からl_q行分)
+        ret: 相対位置offsetの要素(i, i+offset)が存在する行の範囲(x内の行の位置で[start, end))　存在しなければNone
         """
-        batch, heads, length, _ = x.size()
-        # padd along column
-        x = F.pad(x, convert_pad_shape([[0, 0], [0, 0], [0, 0], [0, length-1]]))
-        x_flat = x.view([batch, heads, length**2 + length*(length -1)])
-        # add 0's in the beginning that will skew the elements after reshape
-        x_flat = F.pad(x_flat, convert_pad_shape([[0, 0], [0, 0], [length, 0]]))
-        x_final = x_flat.view([batch, heads, length, 2*length])[:,:,:,1:]
-        return x_final
-
-    def _attention_bias_proximal(self, length):
+        n_rows, length = x.size(-2), x.size(-1)
+        start = max(0, -(row_start + offset))
+        end = min(n_rows, length - (row_start + offset))
+        if end <= start:
+            return None
+        return start, end
+
+    def _attention_bias_proximal(self, length, row_start=0, row_end=None):
         """Bias for self-attention to encourage attention to close positions.
         Args:
         length: an integer scalar.
+        row_start, row_end: the range of query positions (all positions if row_end is None).
         Returns:
-        a Tensor with shape [1, 1, length, length]
+        a Tensor with shape [1, 1, row_end - row_start, length]
         """
+        row_end = length if row_end is None else row_end
         r = torch.arange(length, dtype=torch.float32)
-        diff = torch.unsqueeze(r, 0) - torch.unsqueeze(r, 1)
+        rows = torch.arange(row_start, row_end, dtype=torch.float32)
+        diff = torch.unsqueeze(r, 0) - torch.unsqueeze(rows, 1)
         return torch.unsqueeze(torch.unsqueeze(-torch.log1p(torch.abs(diff)), 0), 0)
 
 
@@ -231,7 +248,8 @@ class Encoder(nn.Module):
             self.norm_layers_2.append(torch.nn.LayerNorm(phoneme_embedding_dim))
 
     def forward(self, x, x_mask):
-        attn_mask = x_mask.unsqueeze(2) * x_mask.unsqueeze(-1)
+        #keyの側のみをmaskする([b, 1, 1, t])　[b, 1, t, t]のmaskを作らずに済み、0埋めした位置のqueryの出力は最後にx_maskで0となるため結果は変わらない
+        attn_mask = x_mask.unsqueeze(2)
         x = x * x_mask
         for i in range(self.n_layers):
             y = self.attention_layers[i](x, x, attn_mask)
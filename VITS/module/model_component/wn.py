@@ -5,13 +5,10 @@ import numpy as np
 
 import torch
 import torch.nn as nn
-import torch.optim as optim
-import torch.utils.data as data
-import torchvision
-from torchvision import models,transforms
-from torch.autograd import Function
 import torch.nn.functional as F
 
+from .speaker_conditioning import apply_condition_layer
+
 @torch.jit.script
 def gated_activation_unit(input_a, input_b, n_channels):
     n_channels_int = n_channels[0]#hidden_channels
@@ -63,7 +60,7 @@ class WN(nn.Module):
         output = torch.zeros_like(x)
         n_channels_tensor = torch.IntTensor([self.hidden_channels])
         #embed済み話者idを入力にとり、条件付けを行うための特徴量を出力するネットワークを適用
-        speaker_fmap = self.condition_layer(speaker_id_embedded)
+        speaker_fmap = apply_condition_layer(self.condition_layer, speaker_id_embedded)
 
         #n_resblocks個のResidualBlockに通す
         for i in range(self.n_resblocks):
@@ -84,4 +81,8 @@ class WN(nn.Module):
             else:
                 output = output + res_skip_acts
         return output * x_mask
-        
\ No newline at end of file
+        
+
+    #出力の1フレームが、入力の左右それぞれ何フレーム先までに依存するか(受容野)を計算する
+    def receptive_field_frames(self):
+        return sum(layer.dilation[0] * (layer.kernel_size[0] - 1) // 2 for layer in self.in_resblocks)
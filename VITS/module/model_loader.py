@@ -0,0 +1,103 @@
+#encoding:utf-8
+
+import json
+import time
+import inspect
+import importlib
+from contextlib import contextmanager
+
+import torch
+import torch.nn as nn
+
+from .vits_generator import VitsGenerator
+
+#torch.nn.utils.weight_normは同名の関数で隠れているため、moduleそのものを取得する
+weight_norm_module = importlib.import_module("torch.nn.utils.weight_norm")
+
+#推論用にGeneratorを構築し、学習済みパラメーターを読み込む関数
+#Generatorはmeta device上で構築し(パラメーターの確保と乱数による初期化を行わない)、memory-mapで開いた学習済みパラメーターをコピーせずにそのままモデルのパラメーターとして割り当てる
+#これにより初期化の時間と、読み込んだパラメーターのモデルへのコピー(パラメーターの二重確保)を省く
+#PyTorchのバージョンが古くこれらの機能が使えない場合は、通常の方法(torch.load + load_state_dict)で読み込む
+#model_config_pathを指定した場合は、save_model_configで保存した構成(蒸留した小さなDecoder・Flowなど)でGeneratorを構築する
+#読み込んだモデルと、各処理にかかった時間[s]を記録したdictを返す
+def load_generator_for_inference(trained_weight_path, n_phoneme, n_speakers, device="cpu", model_config_path=None):
+	startup_time = {}
+	#torch.load(mmap=True)とload_state_dict(assign=True)はPyTorch 2.1以降で使用可能
+	use_mmap = ("mmap" in inspect.signature(torch.load).parameters) and ("assign" in inspect.signature(nn.Module.load_state_dict).parameters)
+
+	time_start = time.perf_counter()
+	if use_mmap:
+		state_dict = torch.load(trained_weight_path, map_location="cpu", mmap=True, weights_only=True)
+	else:
+		state_dict = torch.load(trained_weight_path, map_location="cpu")
+	startup_time["load_weight"] = time.perf_counter() - time_start
+
+	time_start = time.perf_counter()
+	if use_mmap:
+		with torch.device("meta"), _shape_only_weight_norm():
+			netG = VitsGenerator(n_phoneme=n_phoneme, n_speakers=n_speakers, **load_model_config(model_config_path))
+	else:
+		netG = VitsGenerator(n_phoneme=n_phoneme, n_speakers=n_speakers, **load_model_config(model_config_path))
+	startup_time["build_model"] = time.perf_counter() - time_start
+
+	time_start = time.perf_counter()
+	if use_mmap:
+		netG.load_state_dict(state_dict, assign=True)
+		#学習済みパラメーターに含まれず、meta device上に残ったもの(persistent=Falseのbufferを構築時にdeviceを指定せず作った場合など)がないか確認する
+		meta_tensors = [name for name, tensor in list(netG.named_parameters()) + list(netG.named_buffers()) if tensor.is_meta]
+		if len(meta_tensors) > 0:
+			raise RuntimeError(f"tensors left on the meta device after loading {trained_weight_path}: {meta_tensors}")
+	else:
+		netG.load_state_dict(state_dict)
+	startup_time["assign_weight"] = time.perf_counter() - time_start
+
+	time_start = time.perf_counter()
+	#ネットワークをデバイスに移動
+	netG = netG.to(device)
+	#weight_normを適用した層の重みはforwardの直前に計算されるが、それまではmeta device上のままであるため、ここで学習済みパラメーターから計算しておく
+	if use_mmap:
+		_recompute_weight_norm(netG)
+	#ネットワークを推論モードにする
+	netG.eval()
+	startup_time["to_device"] = time.perf_counter() - time_start
+	return netG, startup_time
+
+#meta device上での構築時に、weight_normの適用で行われる重みのノルムと正規化した重みの計算を、形だけを持つtensorを返す処理に置き換える
+#(meta device上でのこれらの演算は1層ごとに時間がかかり、構築全体が通常の構築より遅くなるため　値は学習済みパラメーターの割り当て後に計算し直す)
+@contextmanager
+def _shape_only_weight_norm():
+	norm_except_dim, _weight_norm = weight_norm_module.norm_except_dim, weight_norm_module._weight_norm
+	def shape_only_norm_except_dim(v, pow=2, dim=0):
+		if dim == -1:
+			return torch.empty((), dtype=v.dtype, device=v.device)
+		return torch.empty([v.size(i) if i == dim else 1 for i in range(v.dim())], dtype=v.dtype, device=v.device)
+	def shape_only_weight_norm(v, g, dim=0):
+		return torch.empty_like(v)
+	weight_norm_module.norm_except_dim, weight_norm_module._weight_norm = shape_only_norm_except_dim, shape_only_weight_norm
+	try:
+		yield
+	finally:
+		weight_norm_module.norm_except_dim, weight_norm_module._weight_norm = norm_except_dim, _weight_norm
+
+#weight_normを適用した各層の重みを、weight_gとweight_vから計算し直す関数
+def _recompute_weight_norm(netG):
+	for module in netG.modules():
+		for hook in module._forward_pre_hooks.values():
+			if isinstance(hook, weight_norm_module.WeightNorm):
+				setattr(module, hook.name, hook.compute_weight(module))
+
+#起動にかかった時間の内訳を出力する関数
+def print_startup_time(startup_time):
+	print(f"startup time: {sum(startup_time.values())*1000:.1f} ms (" + ", ".join(f"{key}: {value*1000:.1f} ms" for key, value in startup_time.items()) + ")")
+
+#Generatorの構成のうち既定値から変更したもの(VitsGeneratorのdecoder_config, flow_config)をjsonファイルに保存・読み込みする
+#pathがNoneの場合は既定の構成(空のdict)を返す
+def save_model_config(path, netG):
+	with open(path, "w") as f:
+		json.dump({"decoder_config" : netG.decoder_config, "flow_config" : netG.flow_config}, f, indent=2)
+
+def load_model_config(path):
+	if path is None:
+		return {}
+	with open(path, "r") as f:
+		return json.load(f)
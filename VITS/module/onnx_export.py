@@ -0,0 +1,112 @@
+#encoding:utf-8
+
+import time
+
+import numpy as np
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from .precision_util import remove_weight_norm
+
+#Text-to-Speechの推論をONNX形式で書き出すためのモジュール
+#推論に用いる乱数(sdp_noise, latent_noise)は入力として受け取るため、同じ入力に対して常に同じ出力が得られる
+class TextToSpeechGraph(nn.Module):
+	def __init__(self, netG):
+		super().__init__()
+		self.netG = netG
+		#TextEncoderの相対位置attentionの窓の大きさ
+		self.window_size = netG.text_encoder.encoder.attention_layers[0].window_size
+
+	def forward(self, text_padded, text_lengths, speaker_id, sdp_noise, latent_noise, noise_scale, length_scale, noise_scale_w):
+		#音素列が相対位置attentionの窓より短い場合にも同じグラフで扱えるよう、末尾を常にwindow_size分0埋めする
+		#0埋めした部分はtext_lengthsによりmaskされるため、出力は変わらない
+		text_padded = F.pad(text_padded, (0, self.window_size))
+		sdp_noise = F.pad(sdp_noise, (0, self.window_size))
+		return self.netG.text_to_speech(text_padded, text_lengths, speaker_id, noise_scale=noise_scale, length_scale=length_scale, noise_scale_w=noise_scale_w, sdp_noise=sdp_noise, latent_noise=latent_noise)
+
+#音声変換の推論をONNX形式で書き出すためのモジュール　PosteriorEncoderで用いる乱数(posterior_noise)は入力として受け取る
+class VoiceConversionGraph(nn.Module):
+	def __init__(self, netG):
+		super().__init__()
+		self.netG = netG
+
+	def forward(self, spec_padded, spec_lengths, source_speaker_id, target_speaker_id, posterior_noise):
+		return self.netG.voice_conversion(spec_padded, spec_lengths, source_speaker_id, target_speaker_id, posterior_noise=posterior_noise)
+
+#各グラフの入力名と、長さが可変な軸
+tts_input_names = ["text_padded", "text_lengths", "speaker_id", "sdp_noise", "latent_noise", "noise_scale", "length_scale", "noise_scale_w"]
+tts_dynamic_axes = {"text_padded" : {1 : "text_length"}, "sdp_noise" : {2 : "text_length"}, "latent_noise" : {2 : "max_frames"}, "wav" : {2 : "wav_length"}}
+vc_input_names = ["spec_padded", "spec_lengths", "source_speaker_id", "target_speaker_id", "posterior_noise"]
+vc_dynamic_axes = {"spec_padded" : {2 : "spec_length"}, "posterior_noise" : {2 : "spec_length"}, "wav" : {2 : "wav_length"}}
+
+#Text-to-Speechのグラフへの入力を作成する関数(batch_size=1)
+#latent_noiseの長さmax_framesは生成される音声のフレーム数(1フレーム=256サンプル)以上である必要があり、超えた分は使われない
+def make_tts_inputs(phoneme_ids, speaker_id, noise_scale=.667, length_scale=1, noise_scale_w=0.8, max_frames=2048, z_channels=192):
+	return (
+		torch.LongTensor(phoneme_ids).unsqueeze(0),
+		torch.tensor([len(phoneme_ids)], dtype=torch.long),
+		torch.tensor([speaker_id], dtype=torch.long),
+		torch.randn(1, 2, len(phoneme_ids)),
+		torch.randn(1, z_channels, max_frames),
+		torch.tensor([noise_scale], dtype=torch.float32),
+		torch.tensor([length_scale], dtype=torch.float32),
+		torch.tensor([noise_scale_w], dtype=torch.float32),
+	)
+
+#音声変換のグラフへの入力を作成する関数(batch_size=1)　specはtorch.Size([1, spec_channels, length])
+def make_vc_inputs(spec, source_speaker_id, target_speaker_id, z_channels=192):
+	return (
+		spec,
+		torch.tensor([spec.size(2)], dtype=torch.long),
+		torch.tensor([source_speaker_id], dtype=torch.long),
+		torch.tensor([target_speaker_id], dtype=torch.long),
+		torch.randn(1, z_channels, spec.size(2)),
+	)
+
+#Generatorの推論をONNX形式で書き出すための準備　weight_normを取り除き、推論用の設定(fp32, cacheなし)にする
+def prepare_generator_for_export(netG):
+	remove_weight_norm(netG)
+	netG.speaker_conditioning_cache = None
+	netG.inference_precision = "fp32"
+	return netG.cpu().eval()
+
+#Text-to-Speech, 音声変換の推論をそれぞれONNX形式で書き出す関数　example_inputsはmake_tts_inputs, make_vc_inputsで作成する
+def export_text_to_speech(netG, output_path, example_inputs, opset_version=17):
+	torch.onnx.export(TextToSpeechGraph(netG).eval(), example_inputs, output_path, input_names=tts_input_names, output_names=["wav"], dynamic_axes=tts_dynamic_axes, opset_version=opset_version, dynamo=False)
+
+def export_voice_conversion(netG, output_path, example_inputs, opset_version=17):
+	torch.onnx.export(VoiceConversionGraph(netG).eval(), example_inputs, output_path, input_names=vc_input_names, output_names=["wav"], dynamic_axes=vc_dynamic_axes, opset_version=opset_version, dynamo=False)
+
+#グラフと同じ入力でGeneratorの推論をPyTorch(eager)のまま実行する関数　validate_graphでの比較に用いる
+def eager_text_to_speech(netG, text_padded, text_lengths, speaker_id, sdp_noise, latent_noise, noise_scale, length_scale, noise_scale_w):
+	return netG.text_to_speech(text_padded, text_lengths, speaker_id, noise_scale=noise_scale, length_scale=length_scale, noise_scale_w=noise_scale_w, sdp_noise=sdp_noise, latent_noise=latent_noise)
+
+def eager_voice_conversion(netG, spec_padded, spec_lengths, source_speaker_id, target_speaker_id, posterior_noise):
+	return netG.voice_conversion(spec_padded, spec_lengths, source_speaker_id, target_speaker_id, posterior_noise=posterior_noise)
+
+#書き出したグラフをonnxruntimeで実行し、同じ入力に対するPyTorch(eager)の出力(eager_function(netG, *inputs))と比較する関数
+#inputs_listの各入力について、出力の最大誤差と1回の推論にかかった時間[s](n_repeats回のうち最短のもの)を返す
+def validate_graph(netG, eager_function, onnx_path, input_names, inputs_list, n_repeats=3):
+	#onnxruntimeはグラフの検証にのみ用いる
+	import onnxruntime
+	session = onnxruntime.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+	results = []
+	for inputs in inputs_list:
+		feed = {name : value.numpy() for name, value in zip(input_names, inputs)}
+		eager_times, graph_times = [], []
+		for _ in range(n_repeats):
+			time_start = time.perf_counter()
+			with torch.no_grad():
+				eager_output = eager_function(netG, *inputs).numpy()
+			eager_times.append(time.perf_counter() - time_start)
+			time_start = time.perf_counter()
+			graph_output = session.run(["wav"], feed)[0]
+			graph_times.append(time.perf_counter() - time_start)
+		if eager_output.shape != graph_output.shape:
+			max_abs_error = float("inf")
+		else:
+			max_abs_error = float(np.max(np.abs(eager_output - graph_output)))
+		results.append({"output_length" : eager_output.shape[-1], "max_abs_error" : max_abs_error, "eager_time" : min(eager_times), "graph_time" : min(graph_times)})
+	return results
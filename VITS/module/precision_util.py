@@ -0,0 +1,86 @@
+#encoding:utf-8
+
+import torch
+import torch.nn as nn
+import torch.ao.quantization as quantization
+import torch.ao.nn.quantized.dynamic as nnqd
+
+from .model_component.wn import WN
+from .model_component.text_encoder import MultiHeadAttention, FeedForwardNetwork
+
+#推論時に選択できる演算精度
+# fp32         : 通常の推論
+# int8_dynamic : Decoder, WN, TextEncoder(attentionとFFN)の畳み込み層の重みをint8に量子化する　入力の量子化のscaleは推論のたびに決める(calibration不要)
+# int8_static  : 上と同じ畳み込み層の重みと入力をint8に量子化する　入力の量子化のscaleはcalibrationで代表的な入力を流して決める
+# bf16         : TextEncoder, PosteriorEncoder, decoderをbfloat16で実行する　StochasticDurationPredictor(spline)とFlowはfloat32のまま実行する
+inference_precisions = ["fp32", "int8_dynamic", "int8_static", "bf16"]
+
+#静的量子化した畳み込み層の前後で、入力の量子化と出力の逆量子化を行うモジュール
+class StaticQuantizedConv(nn.Module):
+	def __init__(self, conv):
+		super().__init__()
+		self.quant = quantization.QuantStub()
+		self.conv = conv
+		self.dequant = quantization.DeQuantStub()
+
+	def forward(self, x):
+		return self.dequant(self.conv(self.quant(x.contiguous())))
+
+#Generatorの推論時の演算精度を設定する関数
+#int8_*ではnetGの畳み込み層を量子化したものに置き換える(元には戻せない)ため、読み込み直後のnetGに対して1度だけ呼ぶ
+#int8_staticの場合はcalibrateに、netGを引数にとり代表的な入力で推論を行う関数を指定する
+#話者に依存する条件付け層(Decoder.cond, WN.condition_layerなど)は入力の長さが1で計算量が小さいため量子化しない
+def set_inference_precision(netG, precision, calibrate=None):
+	if precision not in inference_precisions:
+		raise ValueError(f"precision must be one of {inference_precisions} (got {precision})")
+	if precision == "int8_static" and calibrate is None:
+		raise ValueError("calibrate is required for int8_static")
+	if precision in ["int8_dynamic", "int8_static"] and netG.speaker_embedding.weight.device.type != "cpu":
+		raise ValueError(f"{precision} is only supported on CPU")
+
+	if precision in ["int8_dynamic", "int8_static"]:
+		#x86のCPUではfbgemmを用いる　既定のx86 engineでは入力の長さが変わるたびに初回の畳み込みが非常に遅くなり、発話ごとに長さの異なる推論に向かない
+		if "fbgemm" in torch.backends.quantized.supported_engines:
+			torch.backends.quantized.engine = "fbgemm"
+		condition_layers = netG.speaker_condition_layers()
+		target_modules = [netG.decoder] + [module for module in netG.modules() if isinstance(module, (WN, MultiHeadAttention, FeedForwardNetwork))]
+		for target_module in target_modules:
+			remove_weight_norm(target_module)
+			_quantize_convs(target_module, precision, condition_layers)
+		if precision == "int8_static":
+			#各層の入力の範囲を計測するobserverを挿入し、calibrationを行った上で量子化した層に置き換える
+			quantization.prepare(netG, inplace=True)
+			with torch.no_grad():
+				calibrate(netG)
+			quantization.convert(netG, inplace=True)
+
+	netG.inference_precision = "bf16" if precision == "bf16" else "fp32"
+	netG.requested_inference_precision = precision
+	return netG
+
+#weight_normによる重みの再計算を取り除いて通常の畳み込み層に戻す(量子化やONNX形式での書き出しの前に用いる)
+def remove_weight_norm(module):
+	for m in module.modules():
+		if hasattr(m, "weight_g"):
+			nn.utils.remove_weight_norm(m)
+
+#moduleに含まれる畳み込み層(condition_layersを除く)を量子化したものに置き換える
+def _quantize_convs(module, precision, condition_layers):
+	for name, child in module.named_children():
+		if not isinstance(child, (nn.Conv1d, nn.ConvTranspose1d)):
+			_quantize_convs(child, precision, condition_layers)
+			continue
+		if any(child is condition_layer for condition_layer in condition_layers):
+			continue
+		if precision == "int8_dynamic":
+			child.qconfig = quantization.default_dynamic_qconfig
+			quantized_conv = nnqd.Conv1d.from_float(child) if isinstance(child, nn.Conv1d) else nnqd.ConvTranspose1d.from_float(child)
+		else:
+			quantized_conv = StaticQuantizedConv(child)
+			if isinstance(child, nn.Conv1d):
+				#重みはchannelごとにscaleを決めて量子化する
+				quantized_conv.qconfig = quantization.get_default_qconfig(torch.backends.quantized.engine)
+			else:
+				#ConvTranspose1dはchannelごとの重みの量子化に対応していないため、全体で1つのscaleを用いる
+				quantized_conv.qconfig = quantization.QConfig(activation=quantization.HistogramObserver.with_args(reduce_range=True), weight=quantization.default_weight_observer)
+		setattr(module, name, quantized_conv)
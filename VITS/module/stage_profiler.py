@@ -0,0 +1,100 @@
+#encoding:utf-8
+
+import collections
+import threading
+import time
+from contextlib import nullcontext
+
+import torch
+from torch.utils.flop_counter import FlopCounterMode
+
+#推論の各段階(TextEncoder, StochasticDurationPredictor, pathの生成, Flow, Decoderなど)の時間・入出力のフレーム数・FLOP数を記録するクラス
+#VitsGeneratorのstage_profilerに設定すると、推論時に各段階がwith profiler.stage(...):で囲まれて実行される(設定しなければ何も記録しない)
+#count_flops=Trueの場合はtorch.utils.flop_counterで行列積・畳み込みのFLOP数を数える　数える処理の分だけ推論が遅くなるため、時間のみを記録する場合はFalseとする
+#直近max_records件の記録と、段階ごとの累計を保持する　推論のthreadとmetricsを読み出すthreadが異なる場合のためにlockをとる
+class InferenceStageProfiler():
+	def __init__(self, device="cpu", count_flops=True, max_records=1000):
+		self.device = torch.device(device)
+		self.count_flops = count_flops
+		self.records = collections.deque(maxlen=max_records)
+		self.totals = collections.OrderedDict()
+		self.lock = threading.Lock()
+
+	#段階nameの処理を囲むcontext manager　input_framesは入力のフレーム数(batch size×長さ)
+	#出力のフレーム数はwithで受け取ったdictのoutput_framesに設定する
+	def stage(self, name, input_frames):
+		return _Stage(self, name, input_frames)
+
+	def _add(self, record):
+		with self.lock:
+			self.records.append(record)
+			total = self.totals.setdefault(record["stage"], {"calls" : 0, "seconds" : 0.0, "input_frames" : 0, "output_frames" : 0, "flops" : 0})
+			total["calls"] += 1
+			for key in ["seconds", "input_frames", "output_frames", "flops"]:
+				total[key] += record[key] or 0
+
+	#直近の記録(新しいものが最後)
+	def recent_records(self):
+		with self.lock:
+			return list(self.records)
+
+	#段階ごとの累計に、1回あたりの時間[ms]・全段階の合計時間に占める割合・1秒あたりのFLOP数・出力1フレームあたりの時間[ms]を加えたdict
+	def summary(self):
+		with self.lock:
+			totals = {name : dict(total) for name, total in self.totals.items()}
+		total_seconds = sum(total["seconds"] for total in totals.values())
+		for total in totals.values():
+			total["mean_ms"] = total["seconds"] / total["calls"] * 1000
+			total["ratio"] = total["seconds"] / total_seconds if total_seconds > 0 else 0.0
+			total["flops_per_second"] = total["flops"] / total["seconds"] if total["seconds"] > 0 else 0.0
+			total["ms_per_output_frame"] = total["seconds"] * 1000 / total["output_frames"] if total["output_frames"] > 0 else None
+		return totals
+
+	def reset(self):
+		with self.lock:
+			self.records.clear()
+			self.totals.clear()
+
+	#段階ごとの累計をPrometheusのtext形式で出力する(推論サーバーの/metricsで用いる)
+	def to_prometheus(self, prefix="vits_inference_stage"):
+		lines = []
+		summary = self.summary()
+		for key, metric_type, help_text in [
+			("calls", "counter", "number of calls"),
+			("seconds", "counter", "total elapsed time in seconds"),
+			("input_frames", "counter", "total input frames (batch size x length)"),
+			("output_frames", "counter", "total output frames (batch size x length)"),
+			("flops", "counter", "total estimated FLOPs"),
+		]:
+			metric_name = f"{prefix}_{key}_total"
+			lines.append(f"# HELP {metric_name} {help_text}")
+			lines.append(f"# TYPE {metric_name} {metric_type}")
+			for name, total in summary.items():
+				lines.append(f'{metric_name}{{stage="{name}"}} {total[key]}')
+		return "\n".join(lines) + "\n"
+
+class _Stage():
+	def __init__(self, profiler, name, input_frames):
+		self.profiler = profiler
+		self.record = {"stage" : name, "seconds" : None, "input_frames" : int(input_frames), "output_frames" : None, "flops" : None}
+		self.flop_counter = FlopCounterMode(display=False) if profiler.count_flops else nullcontext()
+
+	def __enter__(self):
+		_synchronize(self.profiler.device)
+		self.flop_counter.__enter__()
+		self.time_start = time.perf_counter()
+		return self.record
+
+	def __exit__(self, *exc_info):
+		_synchronize(self.profiler.device)
+		self.record["seconds"] = time.perf_counter() - self.time_start
+		self.flop_counter.__exit__(*exc_info)
+		if self.profiler.count_flops:
+			self.record["flops"] = self.flop_counter.get_total_flops()
+		if exc_info[0] is None:
+			self.profiler._add(self.record)
+		return False
+
+def _synchronize(device):
+	if device.type == "cuda":
+		torch.cuda.synchronize(device)
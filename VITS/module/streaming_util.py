@@ -0,0 +1,122 @@
+#encoding:utf-8
+
+import torch
+
+from .audio_util import StreamingSpectrogram
+
+#時間方向の受容野が有限な処理fnを、入力を少しずつ受け取りながら窓ごとに実行するクラス
+#各窓には左右にcontext_frames分の文脈を付け足して処理し、文脈部分に対応する出力は捨てる(Decoder.iter_chunksと同様)
+#右側の文脈が揃ったフレームからchunk_frames単位で出力するため、保持する入力は(chunk_frames + 2*context_frames)フレーム程度に限られる
+#fnは入力torch.Size([1, channels, length])から出力torch.Size([1, channels, length*upsample_rate])を返す関数
+class StreamingStage():
+	def __init__(self, fn, context_frames, chunk_frames, upsample_rate=1):
+		self.fn = fn
+		self.context_frames = context_frames
+		self.chunk_frames = chunk_frames
+		self.upsample_rate = upsample_rate
+		#受け取った入力のうち、まだ必要なもの(左側の文脈と未処理のフレーム)
+		self.buffer = None
+		#bufferの先頭が入力全体の何フレーム目にあたるか
+		self.buffer_start = 0
+		self.n_received = 0
+		self.n_emitted = 0
+
+	#x : torch.Size([1, channels, length])　出力できるようになった部分を返す(なければNone)
+	def push(self, x):
+		if x is None or x.size(2) == 0:
+			return None
+		self.buffer = x if self.buffer is None else torch.cat([self.buffer, x], dim=2)
+		self.n_received += x.size(2)
+		outputs = []
+		while self.n_received - self.context_frames - self.n_emitted >= self.chunk_frames:
+			end = self.n_emitted + self.chunk_frames
+			outputs.append(self._process(end, end + self.context_frames))
+		return torch.cat(outputs, dim=2) if len(outputs) > 0 else None
+
+	#入力の終端に達した場合に、残りのフレームを出力する
+	def finish(self):
+		if self.n_received == self.n_emitted:
+			return None
+		return self._process(self.n_received, self.n_received)
+
+	#入力全体での[n_emitted, end)フレームに対応する出力を、[n_emitted - context_frames, right)フレームの窓を処理して得る
+	def _process(self, end, right):
+		left = max(self.n_emitted - self.context_frames, 0)
+		y = self.fn(self.buffer[:, :, left-self.buffer_start:right-self.buffer_start])
+		output = y[:, :, (self.n_emitted-left)*self.upsample_rate:(end-left)*self.upsample_rate]
+		self.n_emitted = end
+		#次の窓の左側の文脈より前の入力は捨てる
+		new_start = max(self.n_emitted - self.context_frames, 0)
+		self.buffer = self.buffer[:, :, new_start-self.buffer_start:]
+		self.buffer_start = new_start
+		return output
+
+#音声を少しずつ受け取りながら音声変換を行うクラス(batch_size=1)
+#スペクトログラムをフレームごとに計算し、PosteriorEncoderと順方向のFlow、逆方向のFlow、decoderをそれぞれの受容野の分だけ文脈を付け足した窓ごとに実行する
+#context_framesを指定しない場合、各段階の文脈は受容野全体となり、出力はvoice_conversionで音声全体を一度に変換した場合と一致する
+#context_framesを指定した場合は各段階の文脈をその値までに制限する　先読みが減り遅延は小さくなるが、窓の継ぎ目で出力が近似となる
+class StreamingVoiceConverter():
+	def __init__(self, netG, source_speaker_id, target_speaker_id, chunk_frames=32, context_frames=None, filter_length=1024, hop_length=256, win_length=1024):
+		self.netG = netG
+		self.chunk_frames = chunk_frames
+		self.hop_length = hop_length
+		self.device = netG.speaker_embedding.weight.device
+		self.source_speaker_id = torch.tensor([source_speaker_id], dtype=torch.long, device=self.device)
+		self.target_speaker_id = torch.tensor([target_speaker_id], dtype=torch.long, device=self.device)
+		self.spectrogram = StreamingSpectrogram(filter_length, hop_length, win_length)
+		self.spec_channels = filter_length//2 + 1
+		with torch.no_grad():
+			self.emb_target = netG.embed_speaker(self.target_speaker_id)
+		receptive_fields = [
+			netG.posterior_encoder.receptive_field_frames() + netG.flow.receptive_field_frames(),
+			netG.flow.receptive_field_frames(),
+			netG.decoder.receptive_field_frames(),
+		]
+		self.context_frames = [receptive_field if context_frames is None else min(receptive_field, context_frames) for receptive_field in receptive_fields]
+		upsample_rate = netG.decoder.upsample_rate
+		self.stages = [
+			StreamingStage(self._encode_source, self.context_frames[0], chunk_frames),
+			StreamingStage(self._reverse_flow, self.context_frames[1], chunk_frames),
+			StreamingStage(self._decode, self.context_frames[2], chunk_frames, upsample_rate=upsample_rate),
+		]
+
+	#入力の先読みによる遅延[サンプル]　最初のフレームのreflect padding分、各段階の右側の文脈、chunk_frames分の入力を待つ時間の和
+	def algorithmic_latency_samples(self):
+		return self.spectrogram.pad_size + (sum(self.context_frames) + self.chunk_frames) * self.hop_length
+
+	#wav : torch.Size([length])　変換できた部分の音声波形torch.Size([length])を返す(なければ長さ0)
+	def push(self, wav):
+		with torch.no_grad():
+			return self._run(self.spectrogram.push(wav), finish=False)
+
+	#入力の終端に達した場合に、残りの音声波形を返す
+	def finish(self):
+		with torch.no_grad():
+			return self._run(self.spectrogram.finish(), finish=True)
+
+	def _run(self, spec, finish):
+		x = None
+		if spec.size(2) > 0:
+			spec = spec.to(self.device)
+			#PosteriorEncoderでのサンプリングに用いる乱数はフレームごとに1度だけ生成し、窓が重なる部分でも同じ値を用いる
+			posterior_noise = torch.randn(1, self.netG.z_channels, spec.size(2), device=self.device)
+			x = torch.cat([spec, posterior_noise], dim=1)
+		for stage in self.stages:
+			x = stage.push(x)
+			if finish:
+				x_rest = stage.finish()
+				x = x_rest if x is None else (x if x_rest is None else torch.cat([x, x_rest], dim=2))
+		return torch.zeros(0) if x is None else x[0, 0].cpu()
+
+	def _encode_source(self, x):
+		spec, posterior_noise = torch.split(x, [self.spec_channels, self.netG.z_channels], dim=1)
+		spec_lengths = torch.tensor([spec.size(2)], dtype=torch.long, device=self.device)
+		z_p, _ = self.netG.encode_source(spec, spec_lengths, self.source_speaker_id, posterior_noise=posterior_noise)
+		return z_p
+
+	def _reverse_flow(self, z_p):
+		z_mask = torch.ones(1, 1, z_p.size(2), device=self.device)
+		return self.netG.flow(z_p, z_mask, speaker_id_embedded=self.emb_target, reverse=True)
+
+	def _decode(self, z):
+		return self.netG.decode(z, speaker_id_embedded=self.emb_target)
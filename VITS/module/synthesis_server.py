@@ -0,0 +1,270 @@
+#encoding:utf-8
+
+import io
+import json
+import time
+import queue
+import threading
+import collections
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import soundfile as sf
+
+import torch
+
+from .text_util import text_to_phoneme, phoneme_to_ids
+from .audio_util import compute_spectrogram
+from .inference_util import SynthesisRequest, synthesize_phoneme_ids_batch
+
+#サーバーが受け付けた1件の推論要求
+class SynthesisJob():
+	def __init__(self, kind, inputs, n_frames, serial=False):
+		self.kind = kind#"tts"(Text-to-Speech)または"vc"(音声変換)
+		self.inputs = inputs#推論に必要な入力
+		self.n_frames = n_frames#入力の長さ　batchの大きさを制限するのに用いる(ttsでは音素列の長さ、vcではスペクトログラムのフレーム数)
+		self.serial = serial#Trueならば他の要求とまとめず1件だけで推論する(batch化しない場合との比較に用いる)
+		self.enqueued_time = time.perf_counter()
+		self.done = threading.Event()
+		self.result = None
+		self.error = None
+
+#同時に届いた推論要求をまとめてbatchとして推論するためのクラス
+#最初の要求が届いてからmax_wait_ms[ms]待つ間に届いた要求を、max_batch_size個、かつ(要求数)*(最大の入力長)がフレーム数の上限を超えない範囲でまとめる
+#serial=Trueの要求は待たずに1件だけで推論する　全ての推論は1つのworker threadで行うため、Generatorとそのcache・profilerを複数のthreadから同時に使うことはない
+class MicroBatcher():
+	def __init__(self, netG, device, max_wait_ms=10, max_batch_size=16, max_batch_text_length=4096, max_batch_spec_frames=8192, filter_length=1024, hop_length=256, win_length=1024, latency_window=1000):
+		self.netG = netG
+		self.device = device
+		self.max_wait = max_wait_ms / 1000
+		self.max_batch_size = max_batch_size
+		self.max_batch_text_length = max_batch_text_length
+		self.max_batch_spec_frames = max_batch_spec_frames
+		self.filter_length = filter_length
+		self.hop_length = hop_length
+		self.win_length = win_length
+
+		self.queue = queue.Queue()
+		#フレーム数の上限を超えたため、次のbatchへ持ち越した要求
+		self.carried_over_jobs = []
+		#serialでない要求とserialの要求のそれぞれについて、直近latency_window件の受付から推論完了までの時間[s]と、処理件数を記録する
+		self.latencies = {serial : collections.deque(maxlen=latency_window) for serial in [False, True]}
+		self.n_jobs = {False : 0, True : 0}
+		self.n_batches = {False : 0, True : 0}
+		self.stats_lock = threading.Lock()
+		self.worker = threading.Thread(target=self._run, daemon=True)
+
+	def start(self):
+		self.worker.start()
+
+	#推論要求を登録し、結果が得られるまで待つ
+	def submit(self, job):
+		self.queue.put(job)
+		job.done.wait()
+		if job.error is not None:
+			raise job.error
+		return job.result
+
+	#serial=Trueならばserialの要求についての統計を返す(queue_depthは両方の要求の合計)
+	def stats(self, serial=False):
+		with self.stats_lock:
+			latencies = np.array(self.latencies[serial]) * 1000
+			stats = {
+				"queue_depth" : self.queue.qsize() + len(self.carried_over_jobs),
+				"n_jobs" : self.n_jobs[serial],
+				"n_batches" : self.n_batches[serial],
+				"mean_batch_size" : self.n_jobs[serial] / max(self.n_batches[serial], 1),
+			}
+		for percentile in [50, 90, 99]:
+			stats[f"latency_p{percentile}_ms"] = float(np.percentile(latencies, percentile)) if len(latencies) > 0 else None
+		return stats
+
+	def _fits(self, jobs, job):
+		if job.serial or jobs[0].serial:
+			return False
+		same_kind_jobs = [j for j in jobs if j.kind == job.kind] + [job]
+		max_batch_frames = self.max_batch_text_length if job.kind == "tts" else self.max_batch_spec_frames
+		padded_frames = len(same_kind_jobs) * max(j.n_frames for j in same_kind_jobs)
+		#上限を超える長さの要求であっても、1件だけならば推論する
+		return len(same_kind_jobs) == 1 or (len(same_kind_jobs) <= self.max_batch_size and padded_frames <= max_batch_frames)
+
+	#batchとしてまとめる要求を集める
+	def _collect(self):
+		if len(self.carried_over_jobs) > 0:
+			jobs = [self.carried_over_jobs.pop(0)]
+		else:
+			jobs = [self.queue.get()]
+		if jobs[0].serial:
+			return jobs
+		deadline = jobs[0].enqueued_time + self.max_wait
+		while True:
+			if len(self.carried_over_jobs) > 0:
+				job = self.carried_over_jobs.pop(0)
+			else:
+				#既に届いている要求は待たずに取り出し、届いていなければ最初の要求からmax_wait_ms経つまで待つ
+				try:
+					job = self.queue.get_nowait()
+				except queue.Empty:
+					remaining = deadline - time.perf_counter()
+					if remaining <= 0:
+						break
+					try:
+						job = self.queue.get(timeout=remaining)
+					except queue.Empty:
+						break
+			if not self._fits(jobs, job):
+				self.carried_over_jobs.insert(0, job)
+				break
+			jobs.append(job)
+		return jobs
+
+	def _run(self):
+		while True:
+			jobs = self._collect()
+			#ttsとvcはそれぞれ別のbatchとして推論する
+			for kind, run_batch in [("tts", self._run_tts), ("vc", self._run_vc)]:
+				kind_jobs = [job for job in jobs if job.kind == kind]
+				if len(kind_jobs) == 0:
+					continue
+				self._run_jobs(run_batch, kind_jobs)
+				finished_time = time.perf_counter()
+				serial = kind_jobs[0].serial
+				with self.stats_lock:
+					self.n_batches[serial] += 1
+					self.n_jobs[serial] += len(kind_jobs)
+					self.latencies[serial].extend([finished_time - job.enqueued_time for job in kind_jobs])
+				for job in kind_jobs:
+					job.done.set()
+
+	#要求をまとめて推論する　batchの推論に失敗した場合は、原因となった要求にのみエラーを返すため1件ずつ推論し直す
+	def _run_jobs(self, run_batch, jobs):
+		try:
+			results = run_batch(jobs)
+			for job, result in zip(jobs, results):
+				job.result = result
+		except Exception as e:
+			if len(jobs) == 1:
+				jobs[0].error = e
+				return
+			for job in jobs:
+				self._run_jobs(run_batch, [job])
+
+	#話者idを整数に変換し、学習に使用した話者の範囲内か確認する
+	def check_speaker_id(self, speaker_id):
+		speaker_id = int(speaker_id)
+		if not 0 <= speaker_id < self.netG.n_speakers:
+			raise ValueError(f"speaker id must be in [0, {self.netG.n_speakers}) (got {speaker_id})")
+		return speaker_id
+
+	def _run_tts(self, jobs):
+		phoneme_ids_list = [job.inputs[0] for job in jobs]
+		requests = [job.inputs[1] for job in jobs]
+		output_wavs = synthesize_phoneme_ids_batch(self.netG, phoneme_ids_list, requests, device=self.device, max_batch_size=len(jobs))
+		return [output_wav.numpy() for output_wav in output_wavs]
+
+	def _run_vc(self, jobs):
+		#各スペクトログラムを0埋めして1つのbatchにまとめる
+		specs = [job.inputs[0] for job in jobs]
+		spec_lengths = torch.LongTensor([spec.size(1) for spec in specs])
+		spec_padded = torch.zeros(len(specs), specs[0].size(0), int(spec_lengths.max()), dtype=torch.float32)
+		for i, spec in enumerate(specs):
+			spec_padded[i, :, :spec.size(1)] = spec
+		source_speaker_id = torch.LongTensor([job.inputs[1] for job in jobs])
+		target_speaker_id = torch.LongTensor([job.inputs[2] for job in jobs])
+		with torch.no_grad():
+			output_wavs = self.netG.voice_conversion(spec_padded.to(self.device), spec_lengths.to(self.device), source_speaker_id.to(self.device), target_speaker_id.to(self.device)).data.cpu()
+		#各音声を元の長さに切り詰める
+		return [output_wavs[i, 0, :spec_lengths[i]*self.hop_length].numpy() for i in range(len(jobs))]
+
+	#wavファイルの中身(bytes)からvcの推論要求を作成する
+	def make_vc_job(self, wav_bytes, source_speaker_id, target_speaker_id, sampling_rate):
+		source_speaker_id = self.check_speaker_id(source_speaker_id)
+		target_speaker_id = self.check_speaker_id(target_speaker_id)
+		wav, wav_sampling_rate = sf.read(io.BytesIO(wav_bytes), dtype="float32", always_2d=True)
+		if wav_sampling_rate != sampling_rate:
+			raise ValueError(f"sampling rate must be {sampling_rate}Hz (got {wav_sampling_rate}Hz)")
+		wav = torch.from_numpy(wav.T[:1].copy())
+		spec = compute_spectrogram(wav, self.filter_length, self.hop_length, self.win_length).squeeze(0)
+		return SynthesisJob("vc", (spec, source_speaker_id, target_speaker_id), n_frames=spec.size(1))
+
+#推論結果の波形をwav形式のbytesへ変換する
+def wav_to_bytes(wav, sampling_rate):
+	buffer = io.BytesIO()
+	sf.write(buffer, wav, sampling_rate, format="WAV", subtype="FLOAT")
+	return buffer.getvalue()
+
+#HTTPリクエストを処理するクラスを作成する関数
+# POST /tts   : {"text": 文章, "speaker_id": 話者id, "noise_scale", "length_scale", "noise_scale_w"(省略可)}のjsonを受け取り、wavを返す
+# POST /vc?source_speaker_id=変換元の話者id&target_speaker_id=変換先の話者id : 本文としてwavファイルを受け取り、変換結果のwavを返す
+# GET /stats  : 待ち行列の長さ、処理件数、latencyのpercentileをjsonで返す
+# GET /metrics : netG.stage_profilerが設定されている場合に、推論の段階ごとの時間・フレーム数・FLOP数の累計をPrometheusのtext形式で返す
+#POST /tts, POST /vcにmode=serialを付けた要求は他の要求とまとめず1件ずつ処理し、GET /stats?mode=serialはその統計を返す(batch化しない場合との比較に用いる)
+def make_request_handler(batcher, phoneme2index, sampling_rate):
+	#要求のqueryのmodeから、他の要求とまとめずに処理するかどうかを返す
+	def is_serial(query):
+		mode = query.get("mode", ["batched"])[0]
+		if mode not in ["batched", "serial"]:
+			raise ValueError(f"mode must be batched or serial (got {mode})")
+		return mode == "serial"
+
+	class SynthesisRequestHandler(BaseHTTPRequestHandler):
+		def do_GET(self):
+			url = urlparse(self.path)
+			path = url.path
+			if path == "/stats":
+				try:
+					stats = batcher.stats(serial=is_serial(parse_qs(url.query)))
+				except ValueError as e:
+					self._send(400, "text/plain", str(e).encode("utf-8"))
+					return
+				self._send(200, "application/json", json.dumps(stats).encode("utf-8"))
+			elif path == "/metrics" and batcher.netG.stage_profiler is not None:
+				self._send(200, "text/plain; version=0.0.4", batcher.netG.stage_profiler.to_prometheus().encode("utf-8"))
+			else:
+				self._send(404, "text/plain", b"not found")
+
+		def do_POST(self):
+			url = urlparse(self.path)
+			query = parse_qs(url.query)
+			try:
+				body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+				serial = is_serial(query)
+				if url.path == "/tts":
+					request = json.loads(body.decode("utf-8"))
+					phoneme_ids = phoneme_to_ids(text_to_phoneme(request["text"]), phoneme2index)
+					synthesis_request = SynthesisRequest(request["text"], batcher.check_speaker_id(request["speaker_id"]), float(request.get("noise_scale", 0.667)), float(request.get("length_scale", 1.0)), float(request.get("noise_scale_w", 0.8)))
+					job = SynthesisJob("tts", (phoneme_ids, synthesis_request), n_frames=len(phoneme_ids), serial=serial)
+				elif url.path == "/vc":
+					job = batcher.make_vc_job(body, query["source_speaker_id"][0], query["target_speaker_id"][0], sampling_rate)
+					job.serial = serial
+				else:
+					self._send(404, "text/plain", b"not found")
+					return
+			#不正な要求(jsonの型の誤りや範囲外の話者idなどを含む)はbatchに入れずに400を返す
+			except Exception as e:
+				self._send(400, "text/plain", str(e).encode("utf-8"))
+				return
+			try:
+				output_wav = batcher.submit(job)
+			except Exception as e:
+				self._send(500, "text/plain", str(e).encode("utf-8"))
+				return
+			self._send(200, "audio/wav", wav_to_bytes(output_wav, sampling_rate))
+
+		def _send(self, status, content_type, body):
+			self.send_response(status)
+			self.send_header("Content-Type", content_type)
+			self.send_header("Content-Length", str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		#リクエストごとのログ出力は行わない
+		def log_message(self, format, *args):
+			pass
+
+	return SynthesisRequestHandler
+
+#推論用のHTTPサーバーを作成する関数
+def make_server(batcher, phoneme2index, sampling_rate, host="127.0.0.1", port=8000):
+	return ThreadingHTTPServer((host, port), make_request_handler(batcher, phoneme2index, sampling_rate))
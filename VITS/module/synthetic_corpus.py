@@ -0,0 +1,69 @@
+#encoding:utf-8
+
+import math
+import os
+
+import numpy as np
+import soundfile as sf
+
+#前処理済みのデータセットのtxtファイル(wavファイルへのパス|話者id|音素列)から、各発話の(音声の長さ[s], 音素数)を読み込む関数
+#合成するデータセットの長さの分布を実際のデータセットに合わせるために用いる
+def read_utterance_shapes(dataset_txtfile_path):
+	shapes = []
+	with open(dataset_txtfile_path, "r") as f:
+		for line in f.readlines():
+			wavfile_path, _, text = line.rstrip("\n").split("|")
+			shapes.append((sf.info(wavfile_path).duration, len(text.split(","))))
+	return shapes
+
+#n個の発話の(音声の長さ[s], 音素数)を決める関数
+#reference_shapesを指定した場合はその中から復元抽出し、指定しない場合は音声の長さを対数正規分布から、音素数を長さ×phonemes_per_secondとして決める
+#既定値はJVS corpus(nonpara30, parallel100)の発話のおおよその分布(中央値約5秒、1秒あたり約12音素)
+def sample_utterance_shapes(n, rng, reference_shapes=None, median_seconds=5.0, log_std=0.4, min_seconds=2.0, max_seconds=15.0, phonemes_per_second=12.0):
+	if reference_shapes is not None:
+		return [reference_shapes[i] for i in rng.integers(0, len(reference_shapes), n)]
+	seconds = np.clip(rng.lognormal(math.log(median_seconds), log_std, n), min_seconds, max_seconds)
+	return [(float(s), max(int(s * phonemes_per_second), 1)) for s in seconds]
+
+#n_phonemes個の音素をphoneme_listからランダムに選び、前処理済みのデータセットと同じ形式(カンマ区切り、句読点の位置は","の間に" ")の文字列にする関数
+def random_phoneme_text(n_phonemes, phoneme_list, rng, pause_probability=0.05):
+	phonemes = [p for p in phoneme_list if p != " "]
+	text = []
+	for i in range(n_phonemes):
+		text.append(phonemes[rng.integers(0, len(phonemes))])
+		#文頭と文末以外には一定の確率で区切り(" ")を入れる
+		if 0 < i < n_phonemes - 1 and rng.random() < pause_probability:
+			text.append(" ")
+	return ",".join(text)
+
+#n_samplesサンプルの音声波形(基本周波数が緩やかに変化する倍音とノイズの和に、音節程度の周期の振幅の変化をかけたもの)を作る関数
+#内容は学習に意味を持たないが、値の範囲とスペクトログラムの大まかな形を実際の音声に近づける
+def synthesize_waveform(n_samples, sampling_rate, rng, n_harmonics=10):
+	t = np.arange(n_samples) / sampling_rate
+	f0 = rng.uniform(100, 250) * (1 + 0.1 * np.sin(2 * np.pi * rng.uniform(0.2, 1.0) * t + rng.uniform(0, 2 * np.pi)))
+	phase = 2 * np.pi * np.cumsum(f0) / sampling_rate
+	wav = sum(np.sin(k * phase) / k for k in range(1, n_harmonics + 1) if k * f0.max() < sampling_rate / 2)
+	wav = wav + 0.1 * rng.standard_normal(n_samples)
+	envelope = 0.5 + 0.5 * np.abs(np.sin(2 * np.pi * rng.uniform(3, 6) * t))
+	wav = wav * envelope
+	return (0.3 * wav / np.abs(wav).max()).astype(np.float32)
+
+#合成したデータセットをoutput_dirに書き出し、学習用のtxtファイルへのパスを返す関数
+#wavファイル(16bit)はoutput_dir/wav/話者id/以下に、txtファイルはjvs_preprocessor.pyと同じ形式(wavファイルへのパス|話者id|音素列)で書き出す
+#reference_txtfile_pathを指定した場合は、そのデータセットの長さの分布に合わせる
+def write_synthetic_corpus(output_dir, n_utterances, n_speakers, phoneme_list, validation_file_number=10, sampling_rate=22050, seed=999, reference_txtfile_path=None):
+	rng = np.random.default_rng(seed)
+	reference_shapes = read_utterance_shapes(reference_txtfile_path) if reference_txtfile_path is not None else None
+	lines = []
+	for index, (seconds, n_phonemes) in enumerate(sample_utterance_shapes(n_utterances, rng, reference_shapes)):
+		speaker_id = int(rng.integers(0, n_speakers))
+		wavfile_path = os.path.join(output_dir, "wav", f"{speaker_id:03}", f"{index:06}.wav")
+		os.makedirs(os.path.dirname(wavfile_path), exist_ok=True)
+		sf.write(wavfile_path, synthesize_waveform(int(seconds * sampling_rate), sampling_rate, rng), samplerate=sampling_rate, subtype="PCM_16")
+		lines.append(f"{wavfile_path}|{speaker_id}|{random_phoneme_text(n_phonemes, phoneme_list, rng)}\n")
+	train_txtfile_path = os.path.join(output_dir, "synthetic_for_train.txt")
+	with open(train_txtfile_path, "w") as f:
+		f.writelines(lines[validation_file_number:])
+	with open(os.path.join(output_dir, "synthetic_for_validation.txt"), "w") as f:
+		f.writelines(lines[:validation_file_number])
+	return train_txtfile_path
@@ -0,0 +1,49 @@
+#encoding:utf-8
+
+import re
+import pyopenjtalk
+
+import torch
+
+#学習に使用した音素を列挙
+phoneme_list = [' ', 'I', 'N', 'U', 'a', 'b', 'by', 'ch', 'cl', 'd', 'dy', 'e', 'f', 'g', 'gy', 'h', 'hy', 'i', 'j', 'k', 'ky', 'm', 'my', 'n', 'ny', 'o', 'p', 'py', 'r', 'ry', 's', 'sh', 't', 'ts', 'ty', 'u', 'v', 'w', 'y', 'z']
+
+#文章を音素列(カンマ区切りの文字列)に変換する関数　jvs_preprocessor.pyと同じ規則で前処理を行う
+def text_to_phoneme(text):
+	text = text.strip()#改行コードを削除
+	text = re.sub('・|・|「|」|』', '', text)#発音とは無関係な記号を削除
+	text = re.split('、|,|，|。|『', text)#句読点、もしくは『で分割
+	#分割した各文字列について音素列への変換を実行
+	phoneme = [pyopenjtalk.g2p(element) for element in text if(not element=="")]
+	#分割した各文字列についてスペースをカンマに変換
+	phoneme = [element.replace(" ",",") for element in phoneme]
+	#各発話(音素列)をスペース区切りで接合
+	phoneme = ', ,'.join(phoneme)
+	#文字列にpauが含まれている(解釈に失敗した記号)が含まれていれば変換できない
+	if("pau" in phoneme):
+		raise ValueError(f"\"pau\" is included:{phoneme}")
+	return phoneme
+
+#音素列(カンマ区切りの文字列)を、モデルに入力する音素idのlistへ変換する関数
+def phoneme_to_ids(phoneme, phoneme2index):
+	phoneme = phoneme.replace("\n", "").split(",")
+	phoneme_converted_into_index = [phoneme2index[p] for p in phoneme]
+	#各音素の間に0を挿入する
+	text_norm = [0] * (len(phoneme_converted_into_index) * 2 + 1)
+	text_norm[1::2] = phoneme_converted_into_index
+	return text_norm
+
+#複数の音素idのlistを0埋めして1つのbatchにまとめる関数
+def pad_phoneme_ids(phoneme_ids_list):
+	text_lengths = torch.LongTensor([len(phoneme_ids) for phoneme_ids in phoneme_ids_list])
+	text_padded = torch.zeros(len(phoneme_ids_list), int(text_lengths.max()), dtype=torch.long)
+	for i, phoneme_ids in enumerate(phoneme_ids_list):
+		text_padded[i, :len(phoneme_ids)] = torch.LongTensor(phoneme_ids)
+	return text_padded, text_lengths
+
+#長い文章を文単位に分割する関数　句点・感嘆符・疑問符・改行を文の区切りとする
+#読点などによる文中の区切りはtext_to_phonemeによって無音の音素として扱われる
+def split_sentences(document):
+	sentences = re.split('。|！|？|!|[?]|\n', document)
+	sentences = [sentence.strip() for sentence in sentences]
+	return [sentence for sentence in sentences if(not sentence=="")]
@@ -0,0 +1,120 @@
+#encoding:utf-8
+
+from contextlib import nullcontext
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torchaudio
+
+from .dataset_util import slice_segments
+from .loss_function import fused_discriminator_adversarial_loss, fused_generator_adversarial_loss, kl_divergence_loss, fused_feature_loss
+
+#学習の1iteration(Generatorによる生成、Discriminatorの学習、Generatorの学習)を行い、各lossの値を返す関数
+#data : collate_fnによって作られたbatch
+#phase_timer : 指定した場合、各段階をwith phase_timer(段階の名前):で囲んで実行する(benchmark_util.PhaseTimer参照)
+#optimizerG, optimizerDにNoneを指定した場合は、勾配の計算までを行いパラメーターを更新しない(vits_memory_profile.pyなどの計測用)
+def train_step(netG, netD, optimizerG, optimizerD, data, device, segment_size=8192, sampling_rate=22050, filter_length=1024, hop_length=256, win_length=1024, melspec_freq_dim=80, phase_timer=None):
+	phase = phase_timer if phase_timer is not None else (lambda name: nullcontext())
+
+	with phase("to_device"):
+		#各データをdeviceに転送
+		wav_real, wav_real_length = data[0].to(device), data[1].to(device)
+		spec_real, spec_real_length = data[2].to(device), data[3].to(device)
+		speaker_id = data[4].to(device)
+		text, text_length = data[5].to(device), data[6].to(device)
+
+	###Generatorによる生成###
+	with phase("generator_forward"):
+		wav_fake, stochastic_duration_predictor_loss, attn, id_slice, x_mask, z_mask, (z, z_p, m_p, logs_p, m_q, logs_q) = netG(text, text_length, spec_real, spec_real_length, speaker_id)
+
+	with phase("mel_spectrogram"):
+		#データセット中のスペクトログラムからメルスペクトログラムを計算
+		fbanks = torchaudio.functional.melscale_fbanks(n_freqs=filter_length//2 + 1, f_min=0, f_max=sampling_rate//2, n_mels=melspec_freq_dim, sample_rate=sampling_rate).to(device)
+		mel_spec_real = torch.matmul(spec_real.clone().transpose(-1, -2), fbanks).transpose(-1, -2)
+		#batch内の各メルスペクトログラム(上で計算したもの)について、id_sliceで指定されたindexから時間軸に沿って(segment_size//hop_length)サンプル分取り出す
+		mel_spec_real = slice_segments(input_tensor=mel_spec_real, start_indices=id_slice, segment_size=segment_size//hop_length)
+
+		#Generatorによって生成された波形からメルスペクトログラムを計算
+		pad_size = int((filter_length-hop_length)/2)
+		wav_fake_padded = torch.nn.functional.pad(wav_fake, (pad_size, pad_size), mode='reflect')
+		spec_fake = torchaudio.functional.spectrogram(
+									waveform=wav_fake_padded,
+									pad=0,#torchaudio.functional.spectrogram内で使われているtorch.nn.functional.padはmode='constant'となっているが、今回はmode='reflect'としたいため手動でpaddingする
+									window=torch.hann_window(win_length).to(device),
+									n_fft=filter_length,
+									hop_length=hop_length,
+									win_length=win_length,
+									power=2,
+									normalized=False,
+									center=False
+								).squeeze(1)
+		mel_spec_fake = torch.matmul(spec_fake.clone().transpose(-1, -2), fbanks).transpose(-1, -2)
+
+		#データセット中の波形「wav_real」について、batch内の各波形について、id_slice*hop_lengthで指定されたindexから時間軸に沿ってsegment_sizeサンプル分取り出す
+		wav_real = slice_segments(input_tensor=wav_real, start_indices=id_slice*hop_length, segment_size=segment_size)
+
+	#####Discriminatorの学習#####
+	# wav_real : 本物波形
+	# wav_fake : 生成された波形
+	with phase("discriminator_step"):
+		authenticity_real, _ = netD(wav_real)
+		authenticity_fake, _ = netD(wav_fake.detach())
+
+		#lossを計算
+		adversarial_loss_D = fused_discriminator_adversarial_loss(authenticity_real, authenticity_fake)#adversarial loss
+
+		#Discriminatorのlossの総計
+		lossD = adversarial_loss_D
+
+		#勾配をリセット
+		_zero_grad(netD, optimizerD)
+		#勾配を計算
+		lossD.backward()
+		#gradient explosionを避けるため勾配を制限
+		nn.utils.clip_grad_norm_(netD.parameters(), max_norm=1.0, norm_type=2.0)
+		#パラメーターの更新
+		if optimizerD is not None:
+			optimizerD.step()
+
+	#####Generatorの学習#####
+	with phase("generator_loss"):
+		authenticity_real, d_feature_map_real = netD(wav_real)
+		authenticity_fake, d_feature_map_fake = netD(wav_fake)
+
+		#lossを計算
+		duration_loss = torch.sum(stochastic_duration_predictor_loss.float())#duration loss
+		mel_reconstruction_loss = F.l1_loss(mel_spec_real, mel_spec_fake)*45#reconstruction loss
+		kl_loss = kl_divergence_loss(z_p, logs_q, m_p, logs_p, z_mask)#KL divergence
+		feature_matching_loss = fused_feature_loss(d_feature_map_real, d_feature_map_fake)#feature matching loss(Discriminatorの中間層の出力分布の統計量を, realとfakeの場合それぞれにおいて互いの分布間で近づける)
+		adversarial_loss_G = fused_generator_adversarial_loss(authenticity_fake)#adversarial loss
+
+		#Generatorのlossの総計
+		lossG = duration_loss + mel_reconstruction_loss + kl_loss + feature_matching_loss + adversarial_loss_G
+
+	with phase("generator_step"):
+		#勾配をリセット
+		_zero_grad(netG, optimizerG)
+		#勾配を計算
+		lossG.backward()
+		#gradient explosionを避けるため勾配を制限
+		nn.utils.clip_grad_norm_(netG.parameters(), max_norm=1.0, norm_type=2.0)
+		#パラメーターの更新
+		if optimizerG is not None:
+			optimizerG.step()
+
+	return {
+		"adversarial_loss/D" : adversarial_loss_D.item(),
+		"adversarial_loss/G" : adversarial_loss_G.item(),
+		"duration_loss/G" : duration_loss.item(),
+		"mel_reconstruction_loss/G" : mel_reconstruction_loss.item(),
+		"kl_loss/G" : kl_loss.item(),
+		"feature_matching_loss/G" : feature_matching_loss.item()
+	}
+
+#optimizerがNoneの場合はmoduleの勾配を直接リセットする
+def _zero_grad(module, optimizer):
+	if optimizer is not None:
+		optimizer.zero_grad()
+	else:
+		module.zero_grad(set_to_none=True)
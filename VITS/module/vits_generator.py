@@ -3,23 +3,21 @@
 import random
 import numpy as np
 import math
+from contextlib import nullcontext
 
 import torch
 import torch.nn as nn
-import torch.optim as optim
-import torch.utils.data as data
-import torchvision
-from torchvision import models,transforms
-from torch.autograd import Function
 import torch.nn.functional as F
 
 #学習用モデルを構成するための各部品
 from .model_component import monotonic_align
-from .model_component.decoder import Decoder
+from .model_component.decoder import build_decoder
 from .model_component.flow import Flow
 from .model_component.posterior_encoder import PosteriorEncoder
 from .model_component.stochastic_duration_predictor import StochasticDurationPredictor
 from .model_component.text_encoder import TextEncoder
+from .model_component.wn import WN
+from .model_component.speaker_conditioning import SpeakerConditioning
 
 def slice_segments(x, ids_str, segment_size):
     ret = torch.zeros_like(x[:, :, :segment_size])
@@ -65,7 +63,9 @@ def generate_path(duration, mask):
 
 #モデルの学習を行うためのクラス
 class VitsGenerator(nn.Module):
-  def __init__(self, n_phoneme, n_speakers):
+  #decoder_config, flow_configを指定した場合は、その値でDecoder, Flowの構成(channel数・層の数など)を既定値から変更する(蒸留した小さなモデルなどで用いる)
+  #decoder_configの"decoder_type"でDecoderの種類("default", "istft", "multiband_istft")を選ぶ(model_component/decoder.pyのbuild_decoder参照)
+  def __init__(self, n_phoneme, n_speakers, decoder_config=None, flow_config=None):
     super().__init__()
     self.n_phoneme = n_phoneme#入力する音素の種類数
     self.phoneme_embedding_dim = 192#各音素の埋め込み先のベクトルの大きさ
@@ -75,6 +75,8 @@ class VitsGenerator(nn.Module):
     self.segment_size = 32#decoderによる音声の生成時、潜在変数zから何要素切り出してdecodeするか
     self.n_speakers = n_speakers#話者の種類数
     self.speaker_id_embedding_dim = 256#話者idの埋め込み先のベクトルの大きさ
+    self.decoder_config = dict(decoder_config or {})#Decoderの構成のうち既定値から変更するもの
+    self.flow_config = dict(flow_config or {})#Flowの構成のうち既定値から変更するもの
 
     #transformerに似た構造のモジュールを用い、音素の列をencodeするネットワーク
     self.text_encoder = TextEncoder(
@@ -99,19 +101,21 @@ class VitsGenerator(nn.Module):
                     )
 
     #z, speaker_id_embeddedを入力にとり音声を生成するネットワーク
-    self.decoder = Decoder(
+    self.decoder = build_decoder(
                       speaker_id_embedding_dim=self.speaker_id_embedding_dim,#話者idの埋め込み先のベクトルの大きさ
-                      in_z_channel=self.z_channels#入力するzのchannel数
+                      in_z_channel=self.z_channels,#入力するzのchannel数
+                      **self.decoder_config
                     )
     
     #Flowとは入出力が可逆なネットワーク
     #zと埋め込み済み話者idを入力にとり、Monotonic Alignment Searchで用いる変数z_pを出力するネットワーク　逆も可能
     #音声変換時は、話者間の変換を実行する役割を果たす
-    self.flow = Flow(
-                      speaker_id_embedding_dim=self.speaker_id_embedding_dim,#話者idの埋め込み先のベクトルの大きさ
-                      in_z_channels=self.z_channels,#入力するzのchannel数
-                      phoneme_embedding_dim=self.phoneme_embedding_dim,#TextEncoderで作成した、埋め込み済み音素のベクトルの大きさ
-                    )
+    self.flow = Flow(**{
+                      "speaker_id_embedding_dim" : self.speaker_id_embedding_dim,#話者idの埋め込み先のベクトルの大きさ
+                      "in_z_channels" : self.z_channels,#入力するzのchannel数
+                      "phoneme_embedding_dim" : self.phoneme_embedding_dim,#TextEncoderで作成した、埋め込み済み音素のベクトルの大きさ(WN内のchannel数)
+                      **self.flow_config
+                    })
 
     #Text-to-Speechの推論時にはAlignmentを自前で作る必要があるため、StochasticDurationPredictorを用いて音素列の情報から音素継続長を予測する必要がある。
     #音声変換の推論時には用いない
@@ -123,6 +127,15 @@ class VitsGenerator(nn.Module):
                       p_dropout=0.5,
                       n_flows=4
                     )
+
+    #推論時に用いる、話者ごとの条件付けの特徴量のcache(inference_util.SpeakerConditioningCache)　Noneならば毎回計算する
+    self.speaker_conditioning_cache = None
+    #推論時の演算精度　"bf16"の場合はTextEncoder, PosteriorEncoder, decoderをbfloat16で実行する(precision_util.set_inference_precision参照)
+    self.inference_precision = "fp32"
+    #set_inference_precisionで指定された演算精度(int8_*ではinference_precisionは"fp32"のままとなる)
+    self.requested_inference_precision = "fp32"
+    #推論の各段階の時間・入出力のフレーム数・FLOP数を記録するprofiler(stage_profiler.InferenceStageProfiler)　Noneならば記録しない
+    self.stage_profiler = None
                     
   def forward(self, text_padded, text_lengths, spec_padded, spec_lengths, speaker_id):
     #text(音素)の内容をTextEncoderに通す
@@ -136,18 +149,7 @@ class VitsGenerator(nn.Module):
     z_p = self.flow(z, spec_mask, speaker_id_embedded=speaker_id_embedded)
 
     #Monotonic Alignment Search(MAS)の実行　音素の情報と音声の情報を関連付ける役割を果たす
-    #MASによって、尤度を最大にするようなpathを求める
-    with torch.no_grad():
-        #DPで用いる、各ノードの尤度を前計算しておく
-        s_p_sq_r = torch.exp(-2 * logs_p)
-        neg_cent1 = torch.sum(-0.5 * math.log(2 * math.pi) - logs_p, [1], keepdim=True)
-        neg_cent2 = torch.matmul(-0.5 * (z_p ** 2).transpose(1, 2), s_p_sq_r)
-        neg_cent3 = torch.matmul(z_p.transpose(1, 2), (m_p * s_p_sq_r))
-        neg_cent4 = torch.sum(-0.5 * (m_p ** 2) * s_p_sq_r, [1], keepdim=True)
-        neg_cent = neg_cent1 + neg_cent2 + neg_cent3 + neg_cent4
-        #不要なノードにマスクをかけた上でDPを実行
-        MAS_node_mask = torch.unsqueeze(text_mask, 2) * torch.unsqueeze(spec_mask, -1)
-        MAS_path = monotonic_align.maximum_path(neg_cent, MAS_node_mask.squeeze(1)).unsqueeze(1).detach()
+    MAS_path = self.search_alignment(z_p, m_p, logs_p, text_mask, spec_mask)
 
     #text(音素)の各要素ごとに、音素長を計算(各音素長は整数)
     duration_of_each_phoneme = MAS_path.sum(2)
@@ -165,33 +167,198 @@ class VitsGenerator(nn.Module):
 
     return wav_fake, stochastic_duration_predictor_loss, MAS_path, ids_slice, text_mask, spec_mask, (z, z_p, m_p, logs_p, m_q, logs_q)
 
-  def text_to_speech(self, text_padded, text_lengths, speaker_id, noise_scale=.667, length_scale=1, noise_scale_w=0.8, max_len=None):
-    text_encoded, m_p, logs_p, text_mask = self.text_encoder(text_padded, text_lengths)
-    speaker_id_embedded = self.speaker_embedding(speaker_id).unsqueeze(-1) #話者埋め込み用ネットワーク
+  #MASによって、尤度を最大にするようなpathを求める
+  def search_alignment(self, z_p, m_p, logs_p, text_mask, spec_mask):
+    with torch.no_grad():
+        #DPで用いる、各ノードの尤度を前計算しておく
+        s_p_sq_r = torch.exp(-2 * logs_p)
+        neg_cent1 = torch.sum(-0.5 * math.log(2 * math.pi) - logs_p, [1], keepdim=True)
+        neg_cent2 = torch.matmul(-0.5 * (z_p ** 2).transpose(1, 2), s_p_sq_r)
+        neg_cent3 = torch.matmul(z_p.transpose(1, 2), (m_p * s_p_sq_r))
+        neg_cent4 = torch.sum(-0.5 * (m_p ** 2) * s_p_sq_r, [1], keepdim=True)
+        neg_cent = neg_cent1 + neg_cent2 + neg_cent3 + neg_cent4
+        #不要なノードにマスクをかけた上でDPを実行
+        MAS_node_mask = torch.unsqueeze(text_mask, 2) * torch.unsqueeze(spec_mask, -1)
+        MAS_path = monotonic_align.maximum_path(neg_cent, MAS_node_mask.squeeze(1)).unsqueeze(1).detach()
+    return MAS_path
+
+  #decoder_chunk_framesを指定した場合、zをdecoder_chunk_frames単位の窓に分割してdecodeする　長い文章でもdecoderのピークメモリが一定に保たれる
+  #sdp_noise, latent_noiseを指定した場合は推論に用いる乱数の代わりに用いる(text_to_latent参照)
+  def text_to_speech(self, text_padded, text_lengths, speaker_id, noise_scale=.667, length_scale=1, noise_scale_w=0.8, max_len=None, decoder_chunk_frames=None, sdp_noise=None, latent_noise=None):
+    z, spec_mask, speaker_id_embedded = self.text_to_latent(text_padded, text_lengths, speaker_id, noise_scale=noise_scale, length_scale=length_scale, noise_scale_w=noise_scale_w, sdp_noise=sdp_noise, latent_noise=latent_noise)
+    wav_fake = self.decode(z[:,:,:max_len], speaker_id_embedded=speaker_id_embedded, chunk_frames=decoder_chunk_frames)
+    return wav_fake
+
+  #text_to_speechをchunk単位で逐次的に実行するgenerator
+  #TextEncoder, StochasticDurationPredictor, Flowは一度だけ実行し、decoderの出力はchunk_frames分のzが処理され次第順に返す
+  #返される各chunkはtorch.Size([batch_size, 1, chunk_frames*256])(最後のchunkのみ短い)　batch_size=1での利用を想定している
+  def text_to_speech_stream(self, text_padded, text_lengths, speaker_id, noise_scale=.667, length_scale=1, noise_scale_w=0.8, chunk_frames=32):
+    z, spec_mask, speaker_id_embedded = self.text_to_latent(text_padded, text_lengths, speaker_id, noise_scale=noise_scale, length_scale=length_scale, noise_scale_w=noise_scale_w)
+    wav_chunks = self.decoder.iter_chunks(z, speaker_id_embedded, chunk_frames=chunk_frames)
+    while True:
+      #各chunkの計算のみを指定した演算精度で実行する
+      with self._autocast():
+        wav_chunk = next(wav_chunks, None)
+      if wav_chunk is None:
+        break
+      yield wav_chunk.float()
+
+  #複数の発話をまとめて推論するText-to-Speech
+  #noise_scale, length_scale, noise_scale_wにtorch.Size([batch_size])のtensorを指定することで、発話ごとに異なる値を用いることができる
+  #生成された音声とあわせて、各発話の有効な音声の長さ(サンプル数)を返す
+  def text_to_speech_batch(self, text_padded, text_lengths, speaker_id, noise_scale=.667, length_scale=1, noise_scale_w=0.8, decoder_chunk_frames=None):
+    z, spec_mask, speaker_id_embedded = self.text_to_latent(text_padded, text_lengths, speaker_id, noise_scale=noise_scale, length_scale=length_scale, noise_scale_w=noise_scale_w)
+    wav_fake = self.decode(z, speaker_id_embedded=speaker_id_embedded, chunk_frames=decoder_chunk_frames, z_mask=spec_mask)
+    upsample_rate = wav_fake.size(2) // z.size(2)
+    wav_lengths = torch.sum(spec_mask, [1, 2]).long() * upsample_rate
+    return wav_fake, wav_lengths
+
+  #Text-to-Speechの推論のうち、decoderに入力するzを生成するまでの処理
+  #sdp_noise(torch.Size([batch_size, 2, 音素列の長さ]))はStochasticDurationPredictorに、latent_noise(torch.Size([batch_size, z_channels, 生成されるフレーム数以上]))はz_pのサンプリングに、乱数の代わりに用いる
+  def text_to_latent(self, text_padded, text_lengths, speaker_id, noise_scale=.667, length_scale=1, noise_scale_w=0.8, sdp_noise=None, latent_noise=None):
+    #発話ごとに値が指定された場合はtorch.Size([batch_size, 1, 1])へと変形しておく
+    noise_scale, length_scale, noise_scale_w = [scale.view(-1, 1, 1) if torch.is_tensor(scale) else scale for scale in (noise_scale, length_scale, noise_scale_w)]
+    text_encoded, m_p, logs_p, text_mask = self.encode_text(text_padded, text_lengths)
+    speaker_id_embedded = self.embed_speaker(speaker_id) #話者埋め込み用ネットワーク
+    logw = self.predict_log_duration(text_encoded, text_mask, speaker_id_embedded, noise_scale_w=noise_scale_w, sdp_noise=sdp_noise)
+    z, spec_mask = self.log_duration_to_latent(m_p, logs_p, text_mask, logw, speaker_id_embedded, noise_scale=noise_scale, length_scale=length_scale, latent_noise=latent_noise)
+    return z, spec_mask, speaker_id_embedded
+
+  #以下はtext_to_latentの各段階の処理　途中の結果を再利用する場合(inference_util.SynthesisCache)は個別に呼び出す
+  #音素列をTextEncoderに通す　話者によらない
+  def encode_text(self, text_padded, text_lengths):
+    with self._stage("text_encoder", text_padded.numel()) as record, self._autocast():
+      text_encoded, m_p, logs_p, text_mask = self.text_encoder(text_padded, text_lengths)
+      if record is not None:
+        record["output_frames"] = text_padded.numel()
+    #StochasticDurationPredictor(spline)とFlowはfloat32で実行する
+    return text_encoded.float(), m_p.float(), logs_p.float(), text_mask.float()
 
-    logw = self.stochastic_duration_predictor(text_encoded, text_mask, speaker_id_embedded=speaker_id_embedded, reverse=True, noise_scale=noise_scale_w)
+  #StochasticDurationPredictorにより各音素の継続長(対数)を予測する
+  def predict_log_duration(self, text_encoded, text_mask, speaker_id_embedded, noise_scale_w=0.8, sdp_noise=None):
+    n_text_frames = text_mask.size(0) * text_mask.size(2)
+    with self._stage("sdp_reverse", n_text_frames) as record:
+      logw = self.stochastic_duration_predictor(text_encoded, text_mask, speaker_id_embedded=speaker_id_embedded, reverse=True, noise_scale=noise_scale_w, noise=sdp_noise)
+      if record is not None:
+        record["output_frames"] = n_text_frames
+    return logw
 
+  #予測した音素継続長(対数)から、各音素のフレーム数と生成される音声のフレーム数を求める
+  def log_duration_to_spec_lengths(self, logw, text_mask, length_scale=1):
     w = torch.exp(logw) * text_mask * length_scale
     w_ceil = torch.ceil(w)
     y_lengths = torch.clamp_min(torch.sum(w_ceil, [1, 2]), 1).long()
-    spec_mask = torch.unsqueeze(sequence_mask(y_lengths, None), 1).to(text_mask.dtype)
-    MAS_node_mask = torch.unsqueeze(text_mask, 2) * torch.unsqueeze(spec_mask, -1)
-    MAS_path = generate_path(w_ceil, MAS_node_mask)
+    return w_ceil, y_lengths
 
-    m_p = torch.matmul(MAS_path.squeeze(1), m_p.transpose(1, 2)).transpose(1, 2)
-    logs_p = torch.matmul(MAS_path.squeeze(1), logs_p.transpose(1, 2)).transpose(1, 2)
+  #予測した音素継続長に従ってTextEncoderの出力を引き伸ばし、逆方向のFlowによりdecoderに入力するzを生成する
+  def log_duration_to_latent(self, m_p, logs_p, text_mask, logw, speaker_id_embedded, noise_scale=.667, length_scale=1, latent_noise=None):
+    with self._stage("path_generation", text_mask.size(0) * text_mask.size(2)) as record:
+      w_ceil, y_lengths = self.log_duration_to_spec_lengths(logw, text_mask, length_scale=length_scale)
+      spec_mask = torch.unsqueeze(sequence_mask(y_lengths, None), 1).to(text_mask.dtype)
+      MAS_node_mask = torch.unsqueeze(text_mask, 2) * torch.unsqueeze(spec_mask, -1)
+      MAS_path = generate_path(w_ceil, MAS_node_mask)
 
-    z_p = m_p + torch.randn_like(m_p) * torch.exp(logs_p) * noise_scale
-    z = self.flow(z_p, spec_mask, speaker_id_embedded=speaker_id_embedded, reverse=True)
-    wav_fake = self.decoder((z * spec_mask)[:,:,:max_len], speaker_id_embedded=speaker_id_embedded)
-    return wav_fake
+      m_p = torch.matmul(MAS_path.squeeze(1), m_p.transpose(1, 2)).transpose(1, 2)
+      logs_p = torch.matmul(MAS_path.squeeze(1), logs_p.transpose(1, 2)).transpose(1, 2)
 
-  def voice_conversion(self, spec_padded, spec_lengths, source_speaker_id, target_speaker_id):
+      if latent_noise is None:
+        latent_noise = torch.randn_like(m_p)
+      else:
+        latent_noise = latent_noise[:, :, :m_p.size(2)]
+      z_p = m_p + latent_noise * torch.exp(logs_p) * noise_scale
+      if record is not None:
+        record["output_frames"] = spec_mask.size(0) * spec_mask.size(2)
+    z = self.reverse_flow(z_p, spec_mask, speaker_id_embedded)
+    return z * spec_mask, spec_mask
+
+  #逆方向のFlowを適用する
+  def reverse_flow(self, z_p, spec_mask, speaker_id_embedded):
+    n_spec_frames = spec_mask.size(0) * spec_mask.size(2)
+    with self._stage("flow_reverse", n_spec_frames) as record:
+      z = self.flow(z_p, spec_mask, speaker_id_embedded=speaker_id_embedded, reverse=True)
+      if record is not None:
+        record["output_frames"] = n_spec_frames
+    return z
+
+  #posterior_noiseを指定した場合はPosteriorEncoderでのzのサンプリングに乱数の代わりに用いる
+  def voice_conversion(self, spec_padded, spec_lengths, source_speaker_id, target_speaker_id, decoder_chunk_frames=None, posterior_noise=None):
     assert self.n_speakers > 0
-    emb_source = self.speaker_embedding(source_speaker_id).unsqueeze(-1) #話者埋め込み用ネットワーク
-    emb_target = self.speaker_embedding(target_speaker_id).unsqueeze(-1) #話者埋め込み用ネットワーク
-    z, m_q, logs_q, spec_mask = self.posterior_encoder(spec_padded, spec_lengths, speaker_id_embedded=emb_source)
-    z_p = self.flow(z, spec_mask, speaker_id_embedded=emb_source)
-    z_hat = self.flow(z_p, spec_mask, speaker_id_embedded=emb_target, reverse=True)
-    wav_fake = self.decoder(z_hat * spec_mask, speaker_id_embedded=emb_target)
+    z_p, spec_mask = self.encode_source(spec_padded, spec_lengths, source_speaker_id, posterior_noise=posterior_noise)
+    wav_fake = self.convert_source_latent(z_p, spec_mask, target_speaker_id, decoder_chunk_frames=decoder_chunk_frames)
     return wav_fake
+
+  #音声変換のうち変換元の話者に依存する処理　PosteriorEncoderと順方向のFlowを適用し、話者に依存しない潜在変数z_pを得る
+  #結果は変換先の話者によらないため、1つの変換元音声を複数の話者へ変換する場合は使い回すことができる
+  def encode_source(self, spec_padded, spec_lengths, source_speaker_id, posterior_noise=None):
+    emb_source = self.embed_speaker(source_speaker_id) #話者埋め込み用ネットワーク
+    n_spec_frames = spec_padded.size(0) * spec_padded.size(2)
+    with self._stage("posterior_encoder", n_spec_frames) as record, self._autocast():
+      z, m_q, logs_q, spec_mask = self.posterior_encoder(spec_padded, spec_lengths, speaker_id_embedded=emb_source, noise=posterior_noise)
+      if record is not None:
+        record["output_frames"] = n_spec_frames
+    #Flowはfloat32で実行する
+    z, spec_mask = z.float(), spec_mask.float()
+    with self._stage("flow_forward", n_spec_frames) as record:
+      z_p = self.flow(z, spec_mask, speaker_id_embedded=emb_source)
+      if record is not None:
+        record["output_frames"] = n_spec_frames
+    return z_p, spec_mask
+
+  #音声変換のうち変換先の話者に依存する処理　逆方向のFlowとdecoderを適用し音声を生成する
+  def convert_source_latent(self, z_p, spec_mask, target_speaker_id, decoder_chunk_frames=None):
+    emb_target = self.embed_speaker(target_speaker_id) #話者埋め込み用ネットワーク
+    z_hat = self.reverse_flow(z_p, spec_mask, emb_target)
+    wav_fake = self.decode(z_hat * spec_mask, speaker_id_embedded=emb_target, chunk_frames=decoder_chunk_frames, z_mask=spec_mask)
+    return wav_fake
+
+  #encode_sourceで得た1つの変換元音声のz_p(batch_size=1)を、target_speaker_idsで指定した複数の話者へ1つのbatchとしてまとめて変換する
+  #返り値はtorch.Size([len(target_speaker_ids), 1, length*256])
+  def voice_conversion_fan_out(self, z_p, spec_mask, target_speaker_ids, decoder_chunk_frames=None):
+    assert z_p.size(0) == 1
+    n_targets = target_speaker_ids.size(0)
+    z_p = z_p.expand(n_targets, -1, -1)
+    spec_mask = spec_mask.expand(n_targets, -1, -1)
+    wav_fake = self.convert_source_latent(z_p, spec_mask, target_speaker_ids, decoder_chunk_frames=decoder_chunk_frames)
+    return wav_fake
+
+  #推論時にzから音声波形を生成する　chunk_framesを指定した場合は窓ごとに分割してdecodeする
+  #z_maskを指定した場合は長さの異なる発話をまとめたbatchのpadding部分を無視する
+  def decode(self, z, speaker_id_embedded, chunk_frames=None, chunk_batch_size=1, z_mask=None):
+    with self._stage("decoder", z.size(0) * z.size(2)) as record, self._autocast():
+      if chunk_frames is None:
+        wav_fake = self.decoder(z, speaker_id_embedded=speaker_id_embedded, z_mask=z_mask)
+      else:
+        wav_fake = self.decoder.forward_chunked(z, speaker_id_embedded, chunk_frames=chunk_frames, chunk_batch_size=chunk_batch_size, z_mask=z_mask)
+      #decoderの出力はサンプル数で数える
+      if record is not None:
+        record["output_frames"] = wav_fake.size(0) * wav_fake.size(2)
+    return wav_fake.float()
+
+  #inference_precisionが"bf16"の場合に、処理をbfloat16で実行するためのcontext manager
+  def _autocast(self):
+    return torch.autocast(device_type=self.speaker_embedding.weight.device.type, dtype=torch.bfloat16, enabled=(self.inference_precision == "bf16"))
+
+
+  #stage_profilerが設定されている場合に、推論の段階nameの処理を囲んで記録するcontext manager　設定されていなければ何もせずNoneを返す
+  def _stage(self, name, input_frames):
+    if self.stage_profiler is None:
+      return nullcontext()
+    return self.stage_profiler.stage(name, input_frames)
+
+  #推論時に話者idを埋め込む　speaker_conditioning_cacheが設定されている場合は、前計算した条件付けの特徴量(SpeakerConditioning)を返す
+  def embed_speaker(self, speaker_id):
+    if self.speaker_conditioning_cache is not None:
+      return self.speaker_conditioning_cache.get(speaker_id)
+    return self.speaker_embedding(speaker_id).unsqueeze(-1)
+
+  #埋め込み済み話者idを入力にとる条件付け層を列挙する
+  def speaker_condition_layers(self):
+    condition_layers = [self.decoder.cond, self.stochastic_duration_predictor.cond]
+    condition_layers += [module.condition_layer for module in self.modules() if isinstance(module, WN)]
+    return condition_layers
+
+  #話者idについて、全ての条件付け層の出力を計算してSpeakerConditioningにまとめる
+  def compute_speaker_conditioning(self, speaker_id):
+    speaker_id_embedded = self.speaker_embedding(speaker_id).unsqueeze(-1)
+    features = {condition_layer : condition_layer(speaker_id_embedded) for condition_layer in self.speaker_condition_layers()}
+    return SpeakerConditioning(speaker_id_embedded, features)
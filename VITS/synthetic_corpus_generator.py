@@ -0,0 +1,29 @@
+#encoding:utf-8
+
+#JVS corpusやpyopenjtalkがない環境で学習の速度を計測するために、前処理済みのデータセットと同じ形式の合成データセットを作るスクリプト
+#音素列はphoneme_listからランダムに選び、音声は倍音とノイズから合成する　発話の長さの分布はJVS corpusのおおよその分布か、指定したデータセットの分布に合わせる
+#出力したtxtファイルは、vits_train.pyやvits_train_benchmark.pyのtrain_dataset_txtfile_pathにそのまま指定できる
+
+from module.synthetic_corpus import write_synthetic_corpus
+
+#出力用ディレクトリ
+output_dir = "./dataset/synthetic/"
+#合成する発話の数
+n_utterances = 1000
+#話者の数
+n_speakers = 100
+#推論用データとして用いる音声ファイルの数
+validation_file_number = 10
+#長さの分布を合わせる対象の前処理済みデータセットのtxtファイルへのパス　Noneならば既定の分布(JVS corpusのおおよその分布)を用いる
+reference_txtfile_path = None
+#音声ファイルのサンプリングレート
+sampling_rate = 22050
+#乱数のシード
+seed = 999
+#学習に使用する音素を列挙(vits_train.pyと同じもの)
+phoneme_list = [' ', 'I', 'N', 'U', 'a', 'b', 'by', 'ch', 'cl', 'd', 'dy', 'e', 'f', 'g', 'gy', 'h', 'hy', 'i', 'j', 'k', 'ky', 'm', 'my', 'n', 'ny', 'o', 'p', 'py', 'r', 'ry', 's', 'sh', 't', 'ts', 'ty', 'u', 'v', 'w', 'y', 'z']
+
+train_txtfile_path = write_synthetic_corpus(output_dir, n_utterances, n_speakers, phoneme_list, validation_file_number=validation_file_number, sampling_rate=sampling_rate, seed=seed, reference_txtfile_path=reference_txtfile_path)
+print(f"train dataset size : {n_utterances - validation_file_number}")
+print(f"validation dataset size : {validation_file_number}")
+print(f"saved: {train_txtfile_path}")
@@ -0,0 +1,90 @@
+#encoding:utf-8
+
+#長さの異なる発話をまとめたbatchで推論した結果が、各発話を1つずつ推論した結果と一致するか確認するスクリプト
+#Decoder(netG.decode)は窓に分割しない場合と分割する場合(chunk_frames)の両方を、text_to_speech_batchはtext_to_speechとの一致を確認する
+#重みはランダムに初期化するため、データセットや学習済みパラメーターは不要　一致しない場合は終了コードを1とする(CIなどでの利用を想定)
+
+import sys
+
+import torch
+
+from module.vits_generator import VitsGenerator
+
+###以下は確認に必要なパラメーター###
+#確認するDecoderの構成(vits_train.pyのdecoder_config)
+decoder_variants = {
+	"default" : {},
+	"istft" : {"decoder_type" : "istft"},
+	"multiband_istft" : {"decoder_type" : "multiband_istft"},
+}
+#batchにまとめる各発話のzの長さ[フレーム]
+decoder_lengths = [40, 25, 13]
+#窓に分割してdecodeする場合の窓の大きさ[フレーム]　Noneは分割しない
+chunk_frames_options = [None, 8]
+#batchにまとめる各発話の音素列の長さ(text_to_speech_batch)
+text_lengths = [24, 15, 7]
+#出力の差(最大絶対誤差)がこれ以下ならば一致とみなす
+max_abs_error_tolerance = 1e-4
+#使用するデバイス
+device = "cpu"
+#乱数のシード
+seed = 999
+#学習に使用した音素の種類数
+n_phoneme = 40
+#学習に使用した話者の数
+n_speakers = 100
+
+device = torch.device(device if torch.cuda.is_available() or device == "cpu" else "cpu")
+print("device:",device)
+
+#batchの各発話について、有効な範囲の出力と1つずつ推論した出力との最大絶対誤差を返す
+def max_abs_errors(wav_batch, wav_lengths, solo_fn):
+	errors = []
+	for i, wav_length in enumerate(wav_lengths):
+		wav_solo = solo_fn(i)
+		if wav_solo.size(2) != wav_length:
+			#長さが異なる場合は一致しないとみなす
+			errors.append(float("inf"))
+			continue
+		errors.append((wav_batch[i, :, :wav_length] - wav_solo[0]).abs().max().item())
+	return errors
+
+results = []
+for name, decoder_config in decoder_variants.items():
+	torch.manual_seed(seed)
+	netG = VitsGenerator(n_phoneme=n_phoneme, n_speakers=n_speakers, decoder_config=decoder_config).to(device).eval()
+	upsample_rate = netG.decoder.upsample_rate
+	speaker_id = torch.arange(len(decoder_lengths), device=device)
+	with torch.no_grad():
+		##########Decoder##########
+		#padding部分にも値を入れ、maskによって無視されることを確認する
+		z = torch.randn(len(decoder_lengths), netG.z_channels, max(decoder_lengths), device=device)
+		z_mask = (torch.arange(z.size(2), device=device)[None, :] < torch.tensor(decoder_lengths, device=device)[:, None]).unsqueeze(1).float()
+		speaker_id_embedded = netG.embed_speaker(speaker_id)
+		for chunk_frames in chunk_frames_options:
+			wav_batch = netG.decode(z, speaker_id_embedded, chunk_frames=chunk_frames, z_mask=z_mask)
+			solo_fn = lambda i: netG.decode(z[i:i+1, :, :decoder_lengths[i]], speaker_id_embedded[i:i+1], chunk_frames=chunk_frames)
+			errors = max_abs_errors(wav_batch, [length * upsample_rate for length in decoder_lengths], solo_fn)
+			results.append((name, f"decode(chunk_frames={chunk_frames})", errors))
+		##########text_to_speech_batch##########
+		#乱数の影響をなくすため、noise_scale, noise_scale_wは0とする
+		text_padded = torch.zeros(len(text_lengths), max(text_lengths), dtype=torch.long, device=device)
+		for i, text_length in enumerate(text_lengths):
+			text_padded[i, :text_length] = torch.randint(1, n_phoneme, (text_length,), device=device)
+		text_lengths_tensor = torch.LongTensor(text_lengths).to(device)
+		for chunk_frames in chunk_frames_options:
+			wav_batch, wav_lengths = netG.text_to_speech_batch(text_padded, text_lengths_tensor, speaker_id[:len(text_lengths)], noise_scale=0, noise_scale_w=0, decoder_chunk_frames=chunk_frames)
+			solo_fn = lambda i: netG.text_to_speech(text_padded[i:i+1, :text_lengths[i]], text_lengths_tensor[i:i+1], speaker_id[i:i+1], noise_scale=0, noise_scale_w=0, decoder_chunk_frames=chunk_frames)
+			errors = max_abs_errors(wav_batch, wav_lengths.tolist(), solo_fn)
+			results.append((name, f"text_to_speech_batch(decoder_chunk_frames={chunk_frames})", errors))
+
+##########確認結果の出力##########
+passed = True
+for name, target, errors in results:
+	ok = max(errors) <= max_abs_error_tolerance
+	passed = passed and ok
+	print(f"{name}: {target}: max_abs_error: " + ", ".join(f"{error:.2e}" for error in errors) + f" {'OK' if ok else 'NG'}")
+if not passed:
+	print("parity check failed")
+	sys.exit(1)
+print("parity check passed")
@@ -0,0 +1,86 @@
+#encoding:utf-8
+
+#ディレクトリ内の全てのwavファイル、またはmanifestファイルに記した音声を、まとめて音声変換するスクリプト
+#モデルの読み込みは1度だけ行い、長さの近い音声同士をbatchにまとめて推論する
+#出力済みのファイルは飛ばすため、途中で中断しても同じ設定で実行し直せば続きから再開できる
+
+import time
+import os
+
+import torch
+
+from module.model_loader import load_generator_for_inference, print_startup_time
+from module.precision_util import set_inference_precision
+from module.bulk_conversion import read_conversion_manifest, list_conversion_jobs, remove_finished_jobs, bucket_jobs_by_length, run_conversion_batches
+
+###以下は推論に必要なパラメーター###
+#学習済みパラメーターへのパス
+trained_weight_path = "./output/vits/train/iteration1999999/netG_cpu.pth"
+#vits_train.pyでdecoder_configを指定して学習したGeneratorやvits_distill.pyで蒸留したGeneratorを用いる場合は、その構成を保存したjsonファイル(model_config.json)へのパス　Noneならば既定の構成
+model_config_path = None
+#変換の指定を記したファイルへのパス　各行に"wavファイルへのパス|変換元の話者id|変換先の話者id"または"wavファイルへのパス|変換元の話者id|変換先の話者id|出力先のwavファイルへのパス"を記す　Noneならばinput_dirを用いる
+manifest_path = None
+#manifest_pathがNoneの場合、このディレクトリ以下の全てのwavファイルを変換する
+input_dir = "./dataset/jvs_preprocessed/jvs_wav_preprocessed/jvs099/"
+#input_dirを用いる場合の変換元の話者id　input_dir直下のディレクトリごとに異なる場合は、source_speaker_id_mapに{"ディレクトリ名" : 話者id}の形で指定する
+source_speaker_id = 98
+source_speaker_id_map = {}
+#input_dirを用いる場合の変換先の話者id　各wavファイルを全ての話者へ変換する
+target_speaker_ids = [9]
+#結果を出力するためのディレクトリ　出力先は(このディレクトリ)/(変換先の話者id)/(wavファイルの親ディレクトリ名/wavファイル名またはinput_dirからの相対パス)となる
+output_dir = "./output/vits/inference/bulk_voice_conversion/"
+#使用するデバイス
+device = "cuda:0"
+#学習に使用した音素の種類数
+n_phoneme = 40
+#学習に使用した話者の数
+n_speakers = 100
+#推論時の演算精度　"fp32", "int8_dynamic", "bf16"から選ぶ(module/precision_util.py参照)
+inference_precision = "fp32"
+#1つのbatchにまとめる最大の件数と、(batch内の最大サンプル数)×(件数)の上限
+max_batch_size = 16
+max_batch_samples = 22050 * 60
+#並列に推論するprocessの数　2以上の場合はCPUでのみ用いる(各processはモデルのパラメーターを共有する)
+n_workers = 1
+
+###以下は音声処理に必要なパラメーター###
+#扱う音声のサンプリングレート
+sampling_rate = 22050
+#スペクトログラムの計算時に何サンプル単位でSTFTを行うか
+filter_length = 1024
+#スペクトログラムの計算時に適用する窓の大きさ
+win_length = 1024
+#ホップ数　何サンプルずらしながらSTFTを行うか
+hop_length = 256
+
+#GPUが使用可能かどうか確認
+device = torch.device(device if torch.cuda.is_available() else "cpu")
+print("device:",device)
+if device.type != "cpu":
+	n_workers = 1
+
+##########変換の指定の読み込み##########
+if manifest_path is not None:
+	jobs = read_conversion_manifest(manifest_path, output_dir)
+else:
+	jobs = list_conversion_jobs(input_dir, output_dir, target_speaker_ids, source_speaker_id=source_speaker_id, source_speaker_id_map=source_speaker_id_map)
+n_jobs = len(jobs)
+#出力済みのものを除く
+jobs = remove_finished_jobs(jobs)
+print(f"jobs: {n_jobs} (already converted: {n_jobs - len(jobs)})")
+batches = bucket_jobs_by_length(jobs, max_batch_size=max_batch_size, max_batch_samples=max_batch_samples)
+
+##########音声変換の実行##########
+#Generatorのインスタンスを生成し、学習済みパラメーターを読み込む
+netG, startup_time = load_generator_for_inference(trained_weight_path, n_phoneme=n_phoneme, n_speakers=n_speakers, device=device, model_config_path=model_config_path)
+#起動にかかった時間の内訳を出力
+print_startup_time(startup_time)
+#推論時の演算精度を設定
+set_inference_precision(netG, inference_precision)
+
+time_start = time.perf_counter()
+n_converted = 0
+for n_batch_jobs in run_conversion_batches(netG, batches, n_workers=n_workers, sampling_rate=sampling_rate, filter_length=filter_length, hop_length=hop_length, win_length=win_length):
+	n_converted += n_batch_jobs
+	elapsed_time = time.perf_counter() - time_start
+	print(f"{n_converted}/{len(jobs)} converted ({elapsed_time:.1f} s)")
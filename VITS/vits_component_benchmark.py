@@ -0,0 +1,157 @@
+#encoding:utf-8
+
+#Generatorの各構成要素(TextEncoder, PosteriorEncoder, Flow, StochasticDurationPredictor, Decoder)、Discriminator、Monotonic Alignment Searchについて、
+#順伝搬と順伝搬+逆伝搬にかかる時間を、batch size・音素列の長さ・スペクトログラムの長さを変えながら計測するスクリプト
+#重みはランダムに初期化するため、データセットや学習済みパラメーターは不要
+#結果はjsonファイルに保存し、baseline_json_pathを指定した場合は基準の結果と比較して一定以上遅くなった計測を表示する
+
+import os
+import sys
+import itertools
+
+import torch
+
+from module.vits_generator import VitsGenerator
+from module.vits_discriminator import VitsDiscriminator
+from module.model_component import monotonic_align
+from module.benchmark_util import measure_time, summarize_times, environment_info, save_benchmark_results, load_benchmark_results, compare_with_baseline
+
+###以下は計測に必要なパラメーター###
+#使用するデバイス
+device = "cuda:0"
+#計測するbatch size
+batch_sizes = [1, 4]
+#計測する音素列の長さ(TextEncoder, StochasticDurationPredictor, Monotonic Alignment Search)
+text_lengths = [32, 128]
+#計測するスペクトログラムの長さ[フレーム](PosteriorEncoder, Flow, Monotonic Alignment Search)
+spec_lengths = [128, 512]
+#DecoderとDiscriminatorに入力する長さ[フレーム](1フレーム=256サンプル)　学習時はsegment_size//hop_length=32フレーム分を切り出して入力する
+decoder_lengths = [32, 128]
+#計測する構成要素　Noneならば全て
+components = None
+#各計測を何回繰り返すか(最初のn_warmup回は計測しない)
+n_warmup = 1
+n_repeats = 5
+#結果を出力するjsonファイルへのパス
+output_json_path = "./output/vits/benchmark/component_benchmark.json"
+#比較の基準とする結果(以前にこのスクリプトで出力したjsonファイル)へのパス　Noneならば比較しない
+baseline_json_path = None
+#基準より何割以上遅くなった場合に性能の低下とみなすか
+regression_threshold = 0.1
+#計測は行わず、このjsonファイルの結果とbaseline_json_pathの結果の比較のみを行う場合に指定する
+compare_only_json_path = None
+#乱数のシード
+seed = 999
+#学習に使用した音素の種類数
+n_phoneme = 40
+#学習に使用した話者の数
+n_speakers = 100
+
+#比較する指標
+metrics = ["forward_ms", "forward_backward_ms"]
+
+if compare_only_json_path is not None:
+	compare_only = load_benchmark_results(compare_only_json_path)
+	n_regressions = compare_with_baseline(compare_only["results"], baseline_json_path, metrics, threshold=regression_threshold, environment=compare_only["environment"])
+	#比較できなかった場合は終了コードを2、性能の低下があった場合は1とする(CIなどでの利用を想定)
+	if n_regressions is None:
+		sys.exit(2)
+	sys.exit(1 if n_regressions > 0 else 0)
+
+torch.manual_seed(seed)
+#GPUが使用可能かどうか確認
+device = torch.device(device if torch.cuda.is_available() else "cpu")
+print("device:",device)
+
+netG = VitsGenerator(n_phoneme=n_phoneme, n_speakers=n_speakers).to(device)
+netD = VitsDiscriminator().to(device)
+speaker_id_embedding_dim = netG.speaker_id_embedding_dim
+
+##########各構成要素への入力を作り、順伝搬を行う関数を返す関数##########
+#いずれもbatch内の全ての発話を最大の長さとし(maskは全て1)、出力のtensorを返す
+def text_encoder_case(batch_size, text_length):
+	text_padded = torch.randint(1, n_phoneme, (batch_size, text_length), device=device)
+	text_lengths = torch.full((batch_size,), text_length, dtype=torch.long, device=device)
+	return lambda: netG.text_encoder(text_padded, text_lengths)[1]
+
+def posterior_encoder_case(batch_size, spec_length):
+	spec = torch.rand(batch_size, netG.spec_channels, spec_length, device=device)
+	spec_lengths = torch.full((batch_size,), spec_length, dtype=torch.long, device=device)
+	speaker_id_embedded = torch.randn(batch_size, speaker_id_embedding_dim, 1, device=device)
+	return lambda: netG.posterior_encoder(spec, spec_lengths, speaker_id_embedded=speaker_id_embedded)[0]
+
+def flow_case(batch_size, spec_length, reverse):
+	z = torch.randn(batch_size, netG.z_channels, spec_length, device=device)
+	z_mask = torch.ones(batch_size, 1, spec_length, device=device)
+	speaker_id_embedded = torch.randn(batch_size, speaker_id_embedding_dim, 1, device=device)
+	return lambda: netG.flow(z, z_mask, speaker_id_embedded=speaker_id_embedded, reverse=reverse)
+
+def stochastic_duration_predictor_case(batch_size, text_length, reverse):
+	text_encoded = torch.randn(batch_size, netG.phoneme_embedding_dim, text_length, device=device)
+	text_mask = torch.ones(batch_size, 1, text_length, device=device)
+	duration_of_each_phoneme = torch.randint(1, 10, (batch_size, 1, text_length), device=device).float()
+	speaker_id_embedded = torch.randn(batch_size, speaker_id_embedding_dim, 1, device=device)
+	if reverse:
+		return lambda: netG.stochastic_duration_predictor(text_encoded, text_mask, speaker_id_embedded=speaker_id_embedded, reverse=True)
+	return lambda: netG.stochastic_duration_predictor(text_encoded, text_mask, duration_of_each_phoneme, speaker_id_embedded=speaker_id_embedded)
+
+def decoder_case(batch_size, decoder_length):
+	z = torch.randn(batch_size, netG.z_channels, decoder_length, device=device)
+	speaker_id_embedded = torch.randn(batch_size, speaker_id_embedding_dim, 1, device=device)
+	return lambda: netG.decoder(z, speaker_id_embedded=speaker_id_embedded)
+
+def discriminator_case(batch_size, decoder_length):
+	wav = torch.rand(batch_size, 1, decoder_length * 256, device=device) * 2 - 1
+	#各discriminatorの判定結果を1つのtensorにまとめる
+	return lambda: torch.cat(netD(wav)[0], dim=1)
+
+def maximum_path_case(batch_size, text_length, spec_length):
+	neg_cent = torch.randn(batch_size, spec_length, text_length, device=device)
+	mask = torch.ones(batch_size, spec_length, text_length, device=device)
+	return lambda: monotonic_align.maximum_path(neg_cent, mask)
+
+#(構成要素の名前, 入力の大きさを決める変数とその候補, 入力を作る関数, 逆伝搬を計測するかどうか, 計測するmodule)
+cases = [
+	("text_encoder", {"batch" : batch_sizes, "text" : text_lengths}, text_encoder_case, True, netG.text_encoder),
+	("posterior_encoder", {"batch" : batch_sizes, "spec" : spec_lengths}, posterior_encoder_case, True, netG.posterior_encoder),
+	("flow_forward", {"batch" : batch_sizes, "spec" : spec_lengths}, lambda b, s: flow_case(b, s, reverse=False), True, netG.flow),
+	("flow_reverse", {"batch" : batch_sizes, "spec" : spec_lengths}, lambda b, s: flow_case(b, s, reverse=True), True, netG.flow),
+	("sdp_forward", {"batch" : batch_sizes, "text" : text_lengths}, lambda b, t: stochastic_duration_predictor_case(b, t, reverse=False), True, netG.stochastic_duration_predictor),
+	("sdp_reverse", {"batch" : batch_sizes, "text" : text_lengths}, lambda b, t: stochastic_duration_predictor_case(b, t, reverse=True), True, netG.stochastic_duration_predictor),
+	("decoder", {"batch" : batch_sizes, "frames" : decoder_lengths}, decoder_case, True, netG.decoder),
+	("discriminator", {"batch" : batch_sizes, "frames" : decoder_lengths}, discriminator_case, True, netD),
+	#Monotonic Alignment Searchは勾配を計算しないため順伝搬のみを計測する
+	("maximum_path", {"batch" : batch_sizes, "text" : text_lengths, "spec" : spec_lengths}, maximum_path_case, False, None),
+]
+
+##########計測##########
+results = {}
+for name, grid, make_case, measure_backward, module in cases:
+	if components is not None and name not in components:
+		continue
+	for sizes in itertools.product(*grid.values()):
+		case_name = name + "/" + "_".join(f"{key}{size}" for key, size in zip(grid.keys(), sizes))
+		forward = make_case(*sizes)
+		#順伝搬は推論時と同じくeval modeで勾配を計算せずに計測する
+		if module is not None:
+			module.eval()
+		with torch.no_grad():
+			result = {"forward_ms" : summarize_times(measure_time(forward, n_warmup=n_warmup, n_repeats=n_repeats, device=device))["median_ms"]}
+		if measure_backward:
+			#順伝搬+逆伝搬は学習時と同じくtrain modeで計測する
+			module.train()
+			def forward_backward():
+				module.zero_grad(set_to_none=True)
+				forward().float().sum().backward()
+			result["forward_backward_ms"] = summarize_times(measure_time(forward_backward, n_warmup=n_warmup, n_repeats=n_repeats, device=device))["median_ms"]
+			module.zero_grad(set_to_none=True)
+		results[case_name] = result
+		print(f"{case_name:<48} " + ", ".join(f"{key}: {value:.2f}" for key, value in result.items()))
+
+os.makedirs(os.path.dirname(output_json_path), exist_ok=True)
+save_benchmark_results(output_json_path, results, environment_info(device))
+print(f"saved: {output_json_path}")
+
+##########基準の結果との比較##########
+if baseline_json_path is not None:
+	compare_with_baseline(results, baseline_json_path, metrics, threshold=regression_threshold, environment=environment_info(device))
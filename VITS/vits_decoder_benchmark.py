@@ -0,0 +1,150 @@
+#encoding:utf-8
+
+#Decoderの種類(module/model_component/decoder.pyのbuild_decoderのdecoder_type)ごとに、パラメーター数、推論速度(Real Time Factor)、学習時の順伝搬+逆伝搬の時間、FLOP数を比べるスクリプト
+#速度の計測は重みをランダムに初期化したDecoderで行うため、データセットや学習済みパラメーターは不要
+#trained_variantsに学習済みのパラメーターを指定した場合は、評価用の発話についてPosteriorEncoderのzから再構成した音声と元の音声との差(音質の目安)も求める
+
+import os
+import random
+
+import torch
+from torch.utils.flop_counter import FlopCounterMode
+
+from module.vits_generator import VitsGenerator
+from module.model_loader import load_generator_for_inference
+from module.dataset_util import AudioSpeakerTextLoader
+from module.distillation import spectral_distances, parameter_size
+from module.benchmark_util import measure_time, summarize_times, environment_info, save_benchmark_results, compare_with_baseline
+
+###以下は計測に必要なパラメーター###
+#比べるDecoderの構成(vits_train.pyのdecoder_config)
+decoder_variants = {
+	"default" : {},
+	"istft" : {"decoder_type" : "istft"},
+	"multiband_istft" : {"decoder_type" : "multiband_istft"},
+}
+#音質を比べる学習済みのパラメーター　{decoder_variantsの名前 : (学習済みパラメーターへのパス, 構成を保存したjsonファイルへのパス)}　空ならば音質は比べない
+trained_variants = {}
+#音質の評価に用いるデータセットのtxtファイル(jvs_preprocessor.pyで作成したもの)へのパス
+eval_dataset_txtfile_path = "./dataset/jvs_preprocessed/jvs_preprocessed_for_validation.txt"
+#音質の評価に用いる発話の数
+n_eval_utterances = 20
+#使用するデバイス　CPUでの推論速度を比べるため既定はCPU
+device = "cpu"
+#推論に用いるthread数　Noneならば変更しない
+n_threads = None
+#推論速度の計測に用いるzの長さ[フレーム]
+decoder_frames = 256
+#学習時の計測に用いるbatch sizeとzの長さ[フレーム]　vits_train.pyのbatch_size, segment_size//hop_lengthと同じ
+train_batch_size = 16
+train_segment_frames = 32
+#FLOP数を数えるかどうか
+count_flops = True
+#各計測を何回繰り返すか(最初のn_warmup回は計測しない)
+n_warmup = 1
+n_repeats = 5
+#結果を出力するjsonファイルへのパス
+output_json_path = "./output/vits/benchmark/decoder_benchmark.json"
+#比較の基準とする結果(以前にこのスクリプトで出力したjsonファイル)へのパス　Noneならば比較しない
+baseline_json_path = None
+#基準より何割以上遅くなった場合に性能の低下とみなすか
+regression_threshold = 0.1
+#乱数のシード
+seed = 999
+#扱う音声のサンプリングレート
+sampling_rate = 22050
+#ホップ数
+hop_length = 256
+#学習に使用した音素を列挙
+phoneme_list = [' ', 'I', 'N', 'U', 'a', 'b', 'by', 'ch', 'cl', 'd', 'dy', 'e', 'f', 'g', 'gy', 'h', 'hy', 'i', 'j', 'k', 'ky', 'm', 'my', 'n', 'ny', 'o', 'p', 'py', 'r', 'ry', 's', 'sh', 't', 'ts', 'ty', 'u', 'v', 'w', 'y', 'z']
+#学習に使用した音素の種類数
+n_phoneme = len(phoneme_list)
+#学習に使用した話者の数
+n_speakers = 100
+
+device = torch.device(device if torch.cuda.is_available() or device == "cpu" else "cpu")
+print("device:",device)
+if n_threads is not None:
+	torch.set_num_threads(n_threads)
+
+#速度とFLOP数の計測
+def benchmark_decoder(netG):
+	torch.manual_seed(seed)
+	result = {f"decoder_{key}" : value for key, value in parameter_size(netG.decoder).items()}
+	speaker_id_embedded = netG.embed_speaker(torch.LongTensor([0]).to(device))
+	z = torch.randn(1, netG.z_channels, decoder_frames, device=device)
+	#推論
+	netG.eval()
+	with torch.no_grad():
+		median_ms = summarize_times(measure_time(lambda: netG.decode(z, speaker_id_embedded), n_warmup=n_warmup, n_repeats=n_repeats, device=device))["median_ms"]
+		result["inference_median_ms"] = median_ms
+		result["inference_rtf"] = median_ms / 1000 / (decoder_frames * hop_length / sampling_rate)
+		if count_flops:
+			with FlopCounterMode(display=False) as flop_counter:
+				netG.decode(z, speaker_id_embedded)
+			#1秒の音声あたりのFLOP数
+			result["inference_gflops_per_second_of_audio"] = flop_counter.get_total_flops() / 1e9 / (decoder_frames * hop_length / sampling_rate)
+	#学習時(Decoderの順伝搬+逆伝搬)
+	netG.decoder.train()
+	z_train = torch.randn(train_batch_size, netG.z_channels, train_segment_frames, device=device)
+	speaker_id_embedded_train = netG.embed_speaker(torch.randint(0, n_speakers, (train_batch_size,), device=device)).detach()
+	def forward_backward():
+		netG.decoder.zero_grad(set_to_none=True)
+		netG.decoder(z_train, speaker_id_embedded=speaker_id_embedded_train).abs().mean().backward()
+	result["train_forward_backward_median_ms"] = summarize_times(measure_time(forward_backward, n_warmup=n_warmup, n_repeats=n_repeats, device=device))["median_ms"]
+	netG.decoder.zero_grad(set_to_none=True)
+	return result
+
+#学習済みのnetGについて、評価用の発話のPosteriorEncoderの出力(平均)から再構成した音声と元の音声との差の平均
+def reconstruction_distances(netG, eval_data):
+	distances = []
+	netG.eval()
+	with torch.no_grad():
+		for wav, spec, speaker_id in eval_data:
+			spec = spec.unsqueeze(0).to(device)
+			spec_lengths = torch.LongTensor([spec.size(2)]).to(device)
+			speaker_id_embedded = netG.embed_speaker(speaker_id.to(device))
+			_, m_q, _, _ = netG.posterior_encoder(spec, spec_lengths, speaker_id_embedded=speaker_id_embedded)
+			distances.append(spectral_distances(netG.decode(m_q, speaker_id_embedded)[0].cpu(), wav))
+	return {key : sum(distance[key] for distance in distances) / len(distances) for key in distances[0].keys()}
+
+##########計測##########
+eval_data = []
+if len(trained_variants) > 0:
+	dataset = AudioSpeakerTextLoader(dataset_txtfile_path=eval_dataset_txtfile_path, phoneme_list=phoneme_list)
+	random.seed(seed)
+	eval_data = [dataset[index][:3] for index in random.sample(range(len(dataset)), min(n_eval_utterances, len(dataset)))]
+	print(f"{len(eval_data)} evaluation utterances")
+
+results = {}
+for name, decoder_config in decoder_variants.items():
+	if name in trained_variants:
+		weight_path, model_config_path = trained_variants[name]
+		netG, _ = load_generator_for_inference(weight_path, n_phoneme=n_phoneme, n_speakers=n_speakers, device=device, model_config_path=model_config_path)
+	else:
+		torch.manual_seed(seed)
+		netG = VitsGenerator(n_phoneme=n_phoneme, n_speakers=n_speakers, decoder_config=decoder_config).to(device)
+	result = benchmark_decoder(netG)
+	if name in trained_variants:
+		result.update(reconstruction_distances(netG, eval_data))
+	results[name] = result
+	del netG
+
+#既定のDecoderの何倍速いか
+if "default" in results:
+	for name, result in results.items():
+		for key in ["inference", "train_forward_backward"]:
+			result[f"{key}_speedup"] = results["default"][f"{key}_median_ms"] / result[f"{key}_median_ms"]
+
+for name, result in results.items():
+	print(f"\n{name}")
+	for key, value in result.items():
+		print(f"  {key:<40} {value:.4g}" if isinstance(value, float) else f"  {key:<40} {value}")
+
+os.makedirs(os.path.dirname(output_json_path), exist_ok=True)
+save_benchmark_results(output_json_path, results, environment_info(device))
+print(f"saved: {output_json_path}")
+
+##########基準の結果との比較##########
+if baseline_json_path is not None:
+	compare_with_baseline(results, baseline_json_path, ["inference_median_ms", "train_forward_backward_median_ms"], threshold=regression_threshold, environment=environment_info(device))
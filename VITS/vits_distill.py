@@ -0,0 +1,197 @@
+#encoding:utf-8
+
+#vits_train.pyで学習したGenerator(教師)から、Decoder(と任意でFlow)を小さくしたGenerator(生徒)を蒸留するスクリプト(module/distillation.py参照)
+#最初に教師の潜在変数zとz_p、zから教師のDecoderが生成した音声を発話ごとに保存し(latent_cache_dir)、以降は教師を実行せずにそれを用いて学習する
+#生徒のDecoderは教師と同じzから教師と同じ音声(対数メルスペクトログラム)を、生徒のFlowは教師のFlowと同じ変換を出力するよう学習する
+#出力した生徒のパラメーターとmodel_config.jsonは、vits_text_to_speech.pyなどの変数trained_weight_path, model_config_pathに指定してそのまま推論に用いることができる
+
+import random
+import os
+import itertools
+import time
+
+import matplotlib as mpl
+mpl.use('Agg')# AGG(Anti-Grain Geometry engine)
+import matplotlib.pyplot as plt
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+from module.dataset_util import AudioSpeakerTextLoader
+from module.model_loader import load_generator_for_inference, save_model_config
+from module.distillation import make_student_generator, distilled_module_names, cache_teacher_latents, TeacherLatentDataset, multi_resolution_mel_loss, flow_distillation_loss, parameter_size
+
+#乱数のシードを設定
+manualSeed = 999
+print("Random Seed: ", manualSeed)
+random.seed(manualSeed)
+torch.manual_seed(manualSeed)
+
+###以下は蒸留に必要なパラメーター###
+#教師とする学習済みパラメーターへのパス
+teacher_weight_path = "./output/vits/train/iteration1999999/netG_cpu.pth"
+#教師の構成を保存したjsonファイルへのパス　Noneならば既定の構成
+teacher_model_config_path = None
+#教師の潜在変数を作るのに用いるデータセットのtxtファイルへのパス(vits_train.pyと同じもの)
+train_dataset_txtfile_path = "./dataset/jvs_preprocessed/jvs_preprocessed_for_train.txt"
+#教師の潜在変数と生成音声を保存するディレクトリ　既にlatents_for_train.txtが存在する場合は保存済みのものを用いる
+#1発話あたり、フレーム数×(192×2×2 + 256×2)byte程度を用いる
+latent_cache_dir = "./output/vits/distill/teacher_latents/"
+#評価用(vits_distill_report.py)に学習に用いず残しておく発話の数
+n_eval_utterances = 20
+#生徒のDecoderの構成(module/model_component/decoder.pyのDecoderの引数)　指定しないものは教師と同じ既定値となる
+#既定値はupsample_initial_channel=512, resblock_kernel_sizes=[3, 7, 11], resblock_dilation_sizes=[[1, 3, 5], [1, 3, 5], [1, 3, 5]]
+decoder_config = {"upsample_initial_channel" : 256, "resblock_kernel_sizes" : [3], "resblock_dilation_sizes" : [[1, 3, 5]]}
+#生徒のFlowの構成(module/model_component/flow.pyのFlowの引数)　Noneならば教師のFlowをそのまま用いる
+#例えば{"n_resblocks" : 2}とするとFlow内のWNの層を半分にする
+flow_config = None
+#結果を出力するためのディレクトリ
+output_dir = "./output/vits/distill/"
+#使用するデバイス
+device = "cuda:0"
+#バッチサイズ
+batch_size = 16
+#DataLoaderのworker数
+num_workers = 4
+#イテレーション数
+total_iterations = 200000
+#学習率
+lr = 0.0002
+#何イテレーションごとに学習結果を出力するか
+output_iter = 5000
+#Decoderに入力するzの長さ[フレーム](1フレーム=256サンプル)　vits_train.pyのsegment_size//hop_lengthと同じ
+segment_frames = 32
+#扱う音声のサンプリングレート
+sampling_rate = 22050
+#学習に使用した音素を列挙
+phoneme_list = [' ', 'I', 'N', 'U', 'a', 'b', 'by', 'ch', 'cl', 'd', 'dy', 'e', 'f', 'g', 'gy', 'h', 'hy', 'i', 'j', 'k', 'ky', 'm', 'my', 'n', 'ny', 'o', 'p', 'py', 'r', 'ry', 's', 'sh', 't', 'ts', 'ty', 'u', 'v', 'w', 'y', 'z']
+#学習に使用した音素の種類数
+n_phoneme = len(phoneme_list)
+#学習に使用した話者の数
+n_speakers = 100
+
+#出力用ディレクトリがなければ作る
+os.makedirs(output_dir, exist_ok=True)
+
+#GPUが使用可能かどうか確認
+device = torch.device(device if torch.cuda.is_available() else "cpu")
+print("device:",device)
+
+#教師を読み込む　教師のパラメーターは更新しない
+teacher, _ = load_generator_for_inference(teacher_weight_path, n_phoneme=n_phoneme, n_speakers=n_speakers, device=device, model_config_path=teacher_model_config_path)
+teacher.requires_grad_(False)
+
+##########教師の潜在変数と生成音声の保存##########
+latents_txtfile_path = os.path.join(latent_cache_dir, "latents_for_train.txt")
+if not os.path.exists(latents_txtfile_path):
+	print(f"caching teacher latents to {latent_cache_dir} ...")
+	dataset = AudioSpeakerTextLoader(dataset_txtfile_path=train_dataset_txtfile_path, phoneme_list=phoneme_list)
+	cache_teacher_latents(teacher, dataset, latent_cache_dir, n_eval_utterances=n_eval_utterances, device=device, seed=manualSeed)
+
+train_dataset = TeacherLatentDataset(latents_txtfile_path, segment_frames=segment_frames)
+train_loader = torch.utils.data.DataLoader(train_dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers, drop_last=True, pin_memory=device.type == "cuda")
+print("train dataset size: {}".format(len(train_dataset)))
+
+##########生徒の作成##########
+student = make_student_generator(teacher, decoder_config, flow_config).to(device)
+save_model_config(os.path.join(output_dir, "model_config.json"), student)
+#教師は以降用いないため解放する
+del teacher
+
+#蒸留するmodule以外のパラメーターは教師の値のまま固定する
+student.requires_grad_(False)
+student.eval()
+distilled_modules = [getattr(student, name) for name in distilled_module_names(distill_flow=flow_config is not None)]
+for module in distilled_modules:
+	module.requires_grad_(True)
+	module.train()
+for name, module in zip(distilled_module_names(distill_flow=flow_config is not None), distilled_modules):
+	print(f"student {name}: {parameter_size(module)}")
+
+optimizer = optim.AdamW([p for module in distilled_modules for p in module.parameters()], lr=lr, betas=(0.8, 0.99), weight_decay=0.01)
+
+#lossを記録することで学習過程を追うための変数
+losses_recorded = {"mel_loss/decoder" : []}
+if flow_config is not None:
+	losses_recorded["distillation_loss/flow"] = []
+#現在のイテレーション回数
+now_iteration = 0
+
+print("Start Distillation")
+
+#学習開始時刻を保存
+t_epoch_start = time.time()
+
+for epoch in itertools.count():
+	for z, z_p, wav_teacher, speaker_id in train_loader:
+		z, z_p, wav_teacher, speaker_id = z.to(device), z_p.to(device), wav_teacher.to(device), speaker_id.to(device)
+		with torch.no_grad():
+			speaker_id_embedded = student.speaker_embedding(speaker_id).unsqueeze(-1)
+
+		#生徒のDecoderは教師と同じzから教師の音声を生成するよう学習する
+		wav_student = student.decoder(z, speaker_id_embedded=speaker_id_embedded)
+		mel_loss = multi_resolution_mel_loss(wav_student.squeeze(1), wav_teacher.squeeze(1), sampling_rate=sampling_rate)
+		loss = mel_loss
+		loss_stdout = {"mel_loss/decoder" : mel_loss}
+		if flow_config is not None:
+			flow_loss = flow_distillation_loss(student.flow, z, z_p, speaker_id_embedded)
+			loss = loss + flow_loss
+			loss_stdout["distillation_loss/flow"] = flow_loss
+
+		#勾配をリセット
+		optimizer.zero_grad()
+		#勾配を計算
+		loss.backward()
+		#gradient explosionを避けるため勾配を制限
+		nn.utils.clip_grad_norm_([p for module in distilled_modules for p in module.parameters()], max_norm=1.0, norm_type=2.0)
+		#パラメーターの更新
+		optimizer.step()
+
+		#####stdoutへlossを出力する#####
+		loss_stdout = {key : value.item() for key, value in loss_stdout.items()}
+		if now_iteration % 10 == 0:
+			print(f"[{now_iteration}/{total_iterations}]", end="")
+			for key, value in loss_stdout.items():
+				print(f" {key}:{value:.5f}", end="")
+			print("")
+		#lossを記録
+		for key, value in loss_stdout.items():
+			losses_recorded[key].append(value)
+
+		#####学習状況をファイルに出力#####
+		if((now_iteration%output_iter==0) or (now_iteration+1>=total_iterations)):
+			out_dir = os.path.join(output_dir, f"iteration{now_iteration}")
+			#出力用ディレクトリがなければ作る
+			os.makedirs(out_dir, exist_ok=True)
+
+			#ここまでの学習にかかった時間を出力
+			total_time = time.time() - t_epoch_start
+			with open(os.path.join(out_dir,"time.txt"), mode='w') as f:
+				f.write("total_time: {:.4f} sec.\n".format(total_time))
+
+			#生徒を出力(教師から写したパラメーターも含むため、このファイルだけで推論できる)
+			torch.save({key : value.cpu() for key, value in student.state_dict().items()}, os.path.join(out_dir, "netG_cpu.pth"))
+
+			#####lossのグラフを出力#####
+			plt.clf()
+			plt.figure(figsize=(16, 3))
+			plt.subplots_adjust(wspace=0.4)
+			for i, (loss_name, loss_list) in enumerate(losses_recorded.items(), 0):
+				plt.subplot(1, len(losses_recorded), i+1)
+				plt.title(loss_name)
+				plt.plot(loss_list, label="loss")
+				plt.xlabel("iterations")
+				plt.ylabel("loss")
+				plt.legend()
+				plt.grid()
+			plt.savefig(os.path.join(out_dir, "loss.png"))
+			plt.close()
+
+		now_iteration += 1
+		#イテレーション数が上限に達したらループを抜ける
+		if(now_iteration>=total_iterations):
+			break
+	#イテレーション数が上限に達したらループを抜ける
+	if(now_iteration>=total_iterations):
+		break
@@ -0,0 +1,130 @@
+#encoding:utf-8
+
+#vits_distill.pyで蒸留した生徒と教師について、パラメーター数・大きさ、推論速度(Real Time Factor)、教師の音声との差を比べるスクリプト
+#速度はテキスト読み上げ(ランダムな音素列)・音声変換・Decoderのみの3つについて計測する
+#音声の差は、学習に用いなかった評価用の発話(latents_for_eval.txt)について、教師と同じzから生成した音声を教師の音声と比べる
+#Flowも蒸留した場合は、教師のz_pから生徒の逆方向のFlowとDecoderで生成した音声(テキスト読み上げと同じ経路)も比べる
+
+import os
+
+import torch
+
+from module.model_loader import load_generator_for_inference
+from module.audio_util import compute_spectrogram
+from module.distillation import read_latent_manifest, load_cached_latent, spectral_distances, parameter_size
+from module.benchmark_util import measure_time, summarize_times, environment_info, save_benchmark_results, compare_with_baseline
+
+###以下は計測に必要なパラメーター###
+#教師の学習済みパラメーターと構成へのパス
+teacher_weight_path = "./output/vits/train/iteration1999999/netG_cpu.pth"
+teacher_model_config_path = None
+#生徒の学習済みパラメーターと構成(vits_distill.pyで出力したもの)へのパス
+student_weight_path = "./output/vits/distill/iteration199999/netG_cpu.pth"
+student_model_config_path = "./output/vits/distill/model_config.json"
+#Flowも蒸留したかどうか(vits_distill.pyのflow_configを指定したかどうか)
+flow_distilled = False
+#評価用の発話のtxtファイル(vits_distill.pyのlatent_cache_dir内のlatents_for_eval.txt)へのパス
+eval_latents_txtfile_path = "./output/vits/distill/teacher_latents/latents_for_eval.txt"
+#使用するデバイス　CPUでの推論速度を比べるため既定はCPU
+device = "cpu"
+#推論に用いるthread数　Noneならば変更しない
+n_threads = None
+#テキスト読み上げの速度の計測に用いる音素列の長さ(ランダムな音素列を用いる)
+text_length = 64
+#Decoderの速度の計測に用いるzの長さ[フレーム]
+decoder_frames = 256
+#各計測を何回繰り返すか(最初のn_warmup回は計測しない)
+n_warmup = 1
+n_repeats = 5
+#結果を出力するjsonファイルへのパス
+output_json_path = "./output/vits/benchmark/distill_report.json"
+#比較の基準とする結果(以前にこのスクリプトで出力したjsonファイル)へのパス　Noneならば比較しない
+baseline_json_path = None
+#基準より何割以上遅くなった場合に性能の低下とみなすか
+regression_threshold = 0.1
+#乱数のシード
+seed = 999
+#扱う音声のサンプリングレート
+sampling_rate = 22050
+#ホップ数
+hop_length = 256
+#学習に使用した音素の種類数
+n_phoneme = 40
+#学習に使用した話者の数
+n_speakers = 100
+
+device = torch.device(device if torch.cuda.is_available() or device == "cpu" else "cpu")
+print("device:",device)
+if n_threads is not None:
+	torch.set_num_threads(n_threads)
+
+models = {
+	"teacher" : load_generator_for_inference(teacher_weight_path, n_phoneme=n_phoneme, n_speakers=n_speakers, device=device, model_config_path=teacher_model_config_path)[0],
+	"student" : load_generator_for_inference(student_weight_path, n_phoneme=n_phoneme, n_speakers=n_speakers, device=device, model_config_path=student_model_config_path)[0],
+}
+eval_entries = read_latent_manifest(eval_latents_txtfile_path)
+print(f"{len(eval_entries)} evaluation utterances")
+
+#速度の計測に用いる入力　音声変換には評価用の最初の発話の教師の音声を用いる
+torch.manual_seed(seed)
+text_padded = torch.randint(1, n_phoneme, (1, text_length), device=device)
+text_lengths = torch.LongTensor([text_length]).to(device)
+speaker_id = torch.LongTensor([0]).to(device)
+_, _, wav_source, source_speaker_id = load_cached_latent(eval_entries[0][0])
+spec_source = compute_spectrogram(wav_source).to(device)
+spec_source_lengths = torch.LongTensor([spec_source.size(2)]).to(device)
+source_speaker_id = torch.LongTensor([source_speaker_id]).to(device)
+z_decoder = torch.randn(1, models["teacher"].z_channels, decoder_frames, device=device)
+
+#fnを計測し、生成した音声の長さから1秒の音声あたりの処理時間(Real Time Factor)を求める
+def measure_rtf(fn, n_samples):
+	median_ms = summarize_times(measure_time(fn, n_warmup=n_warmup, n_repeats=n_repeats, device=device))["median_ms"]
+	return {"median_ms" : median_ms, "rtf" : median_ms / 1000 / (n_samples / sampling_rate)}
+
+##########計測##########
+results = {}
+for name, netG in models.items():
+	result = {}
+	#パラメーター数・大きさ
+	for module_name, module in [("total", netG), ("decoder", netG.decoder), ("flow", netG.flow)]:
+		result.update({f"{module_name}_{key}" : value for key, value in parameter_size(module).items()})
+	with torch.no_grad():
+		#推論速度　テキスト読み上げの音声の長さは音素継続長の予測(教師と生徒で共通)で決まるため、1回生成して長さを求める
+		torch.manual_seed(seed)
+		n_samples = netG.text_to_speech(text_padded, text_lengths, speaker_id).size(2)
+		result.update({f"tts_{key}" : value for key, value in measure_rtf(lambda: netG.text_to_speech(text_padded, text_lengths, speaker_id), n_samples).items()})
+		result.update({f"vc_{key}" : value for key, value in measure_rtf(lambda: netG.voice_conversion(spec_source, spec_source_lengths, source_speaker_id, speaker_id), spec_source.size(2) * hop_length).items()})
+		speaker_id_embedded = netG.embed_speaker(speaker_id)
+		result.update({f"decoder_{key}" : value for key, value in measure_rtf(lambda: netG.decode(z_decoder, speaker_id_embedded), decoder_frames * hop_length).items()})
+		#教師の音声との差(評価用の発話の平均)
+		if name == "student":
+			distances = []
+			for path, utterance_speaker_id, _ in eval_entries:
+				z, z_p, wav_teacher, _ = load_cached_latent(path)
+				speaker_id_embedded = netG.embed_speaker(torch.LongTensor([utterance_speaker_id]).to(device))
+				z, z_p = z.unsqueeze(0).to(device), z_p.unsqueeze(0).to(device)
+				distance = {f"decoder_{key}" : value for key, value in spectral_distances(netG.decode(z, speaker_id_embedded)[0].cpu(), wav_teacher).items()}
+				if flow_distilled:
+					spec_mask = torch.ones_like(z_p[:, :1, :])
+					wav_student = netG.decode(netG.reverse_flow(z_p, spec_mask, speaker_id_embedded), speaker_id_embedded)
+					distance.update({f"flow_decoder_{key}" : value for key, value in spectral_distances(wav_student[0].cpu(), wav_teacher).items()})
+				distances.append(distance)
+			result.update({key : sum(distance[key] for distance in distances) / len(distances) for key in distances[0].keys()})
+	results[name] = result
+
+#生徒が教師の何倍速いか・何分の1の大きさか
+results["student"].update({f"{key}_speedup" : results["teacher"][f"{key}_median_ms"] / results["student"][f"{key}_median_ms"] for key in ["tts", "vc", "decoder"]})
+results["student"]["total_size_ratio"] = results["student"]["total_size_mb"] / results["teacher"]["total_size_mb"]
+
+for name, result in results.items():
+	print(f"\n{name}")
+	for key, value in result.items():
+		print(f"  {key:<40} {value:.4g}" if isinstance(value, float) else f"  {key:<40} {value}")
+
+os.makedirs(os.path.dirname(output_json_path), exist_ok=True)
+save_benchmark_results(output_json_path, results, environment_info(device))
+print(f"saved: {output_json_path}")
+
+##########基準の結果との比較##########
+if baseline_json_path is not None:
+	compare_with_baseline(results, baseline_json_path, ["tts_median_ms", "vc_median_ms", "decoder_median_ms"], threshold=regression_threshold, environment=environment_info(device))
@@ -0,0 +1,111 @@
+#encoding:utf-8
+
+#学習用のDataLoader(AudioSpeakerTextLoader + collate_fn)について、worker数・prefetch_factor・persistent_workers・main processのthread数を変えながら
+#1秒あたりに読み込めるサンプル数を計測し、さらにworker数とthread数の分け方ごとに学習の1stepを含めた学習全体のthroughputを計測するスクリプト
+#DataLoaderのworkerとモデルの演算のthreadが同じcoreを取り合わないよう、core数をworker数とthread数に分けて比較する
+#最もthroughputの大きかった設定をjsonファイルに保存し、vits_train.pyは起動時にその設定を読み込んで用いる
+
+import os
+import itertools
+
+import torch
+import torch.optim as optim
+
+from module.dataset_util import AudioSpeakerTextLoader
+from module.vits_generator import VitsGenerator
+from module.vits_discriminator import VitsDiscriminator
+from module.train_util import train_step
+from module.loader_tuning import make_train_loader, measure_loader_throughput, candidate_core_splits, best_config_per_core_split, save_loader_config
+from module.benchmark_util import environment_info, save_benchmark_results, run_in_subprocess
+
+###以下は計測に必要なパラメーター###
+#前処理用スクリプトによって出力された、データセットに関するtxtファイルへのパス
+train_dataset_txtfile_path = "./dataset/jvs_preprocessed/jvs_preprocessed_for_train.txt"
+#使用するデバイス
+device = "cuda:0"
+#バッチサイズ
+batch_size = 16
+#core数　Noneならばこのマシンのcore数
+n_cores = None
+#比較する(worker数, thread数)の組　Noneならばcandidate_core_splitsでworker数を0, 1, 2, 4, ...とし、残りのcoreをthreadに割り当てる
+core_splits = None
+#比較するprefetch_factor
+prefetch_factors = [2, 4]
+#比較するpersistent_workers
+persistent_workers_options = [False, True]
+#DataLoaderのみの計測で、各epochで読み込むbatch数とepoch数
+n_batches = 20
+n_epochs = 2
+#学習全体の計測で、各epochで実行するstep数
+n_steps = 5
+#最もthroughputの大きかった設定を出力するjsonファイルへのパス(vits_train.pyのloader_config_pathと同じにする)
+output_config_path = "./output/vits/loader_config.json"
+#計測結果を出力するjsonファイルへのパス
+output_json_path = "./output/vits/benchmark/loader_benchmark.json"
+#乱数のシード
+seed = 999
+#学習に使用する音素を列挙
+phoneme_list = [' ', 'I', 'N', 'U', 'a', 'b', 'by', 'ch', 'cl', 'd', 'dy', 'e', 'f', 'g', 'gy', 'h', 'hy', 'i', 'j', 'k', 'ky', 'm', 'my', 'n', 'ny', 'o', 'p', 'py', 'r', 'ry', 's', 'sh', 't', 'ts', 'ty', 'u', 'v', 'w', 'y', 'z']
+#話者の数
+n_speakers = 100
+#学習率(optimizerによる更新の時間を含めるため)
+lr = 0.0002
+
+device = torch.device(device if torch.cuda.is_available() else "cpu")
+print("device:",device)
+n_cores = os.cpu_count() if n_cores is None else n_cores
+core_splits = candidate_core_splits(n_cores) if core_splits is None else core_splits
+
+train_dataset = AudioSpeakerTextLoader(dataset_txtfile_path=train_dataset_txtfile_path, phoneme_list=phoneme_list)
+print("train dataset size: {}".format(len(train_dataset)))
+
+##########1つの設定での計測(設定ごとにthread数を変えるため、子processで実行する)##########
+def measure(config, train):
+	torch.set_num_threads(config["torch_threads"])
+	torch.manual_seed(seed)
+	loader = make_train_loader(train_dataset, batch_size, config["num_workers"], prefetch_factor=config["prefetch_factor"], persistent_workers=config["persistent_workers"], pin_memory=device.type == "cuda", seed=seed)
+	if not train:
+		return measure_loader_throughput(loader, n_batches=n_batches, n_epochs=n_epochs)
+	netG = VitsGenerator(n_phoneme=len(phoneme_list), n_speakers=n_speakers).to(device).train()
+	netD = VitsDiscriminator().to(device).train()
+	optimizerG = optim.AdamW(netG.parameters(), lr=lr, betas=(0.8, 0.99), weight_decay=0.01)
+	optimizerD = optim.AdamW(netD.parameters(), lr=lr, betas=(0.8, 0.99), weight_decay=0.01)
+	return measure_loader_throughput(loader, n_batches=n_steps, n_epochs=n_epochs, step_fn=lambda data: train_step(netG, netD, optimizerG, optimizerD, data, device))
+
+def config_name(config):
+	return f"workers{config['num_workers']}_threads{config['torch_threads']}_prefetch{config['prefetch_factor']}_persistent{int(config['persistent_workers'])}"
+
+##########DataLoaderのみの計測##########
+configs = []
+for (num_workers, torch_threads), prefetch_factor, persistent_workers in itertools.product(core_splits, prefetch_factors, persistent_workers_options):
+	#worker数が0の場合はprefetch_factorとpersistent_workersは意味を持たないため、1通りのみ計測する
+	if num_workers == 0 and (prefetch_factor != prefetch_factors[0] or persistent_workers != persistent_workers_options[0]):
+		continue
+	configs.append({"num_workers" : num_workers, "prefetch_factor" : prefetch_factor, "persistent_workers" : persistent_workers, "torch_threads" : torch_threads})
+
+results = {}
+for config in configs:
+	result = run_in_subprocess(measure, config, False)
+	results[f"loader/{config_name(config)}"] = {**config, **result}
+	print(f"loader/{config_name(config):<48} {result['samples_per_second']:8.1f} samples/s, first batch: {result['first_batch_seconds']:.2f} s")
+
+##########学習全体の計測##########
+#DataLoaderのみのthroughputはworker数が多くthread数が少ない設定ほど大きくなり、学習全体のthroughputの順位とは一致しないため、
+#(worker数, thread数)の分け方ごとにDataLoaderのみのthroughputが最大の設定を選び、全ての分け方について学習の1stepを含めて計測する
+split_configs = best_config_per_core_split(configs, [results[f"loader/{config_name(config)}"]["samples_per_second"] for config in configs])
+best_config, best_throughput = None, 0
+for config in split_configs:
+	result = run_in_subprocess(measure, config, True)
+	results[f"train/{config_name(config)}"] = {**config, **result}
+	print(f"train/{config_name(config):<48} {result['samples_per_second']:8.2f} samples/s, first batch: {result['first_batch_seconds']:.2f} s")
+	if result["samples_per_second"] > best_throughput:
+		best_config, best_throughput = config, result["samples_per_second"]
+
+os.makedirs(os.path.dirname(output_json_path), exist_ok=True)
+save_benchmark_results(output_json_path, results, environment_info(device))
+print(f"saved: {output_json_path}")
+
+os.makedirs(os.path.dirname(output_config_path), exist_ok=True)
+save_loader_config(output_config_path, best_config)
+print(f"best config: {best_config} ({best_throughput:.2f} samples/s)")
+print(f"saved: {output_config_path}")
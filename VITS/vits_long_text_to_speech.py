@@ -0,0 +1,121 @@
+#encoding:utf-8
+
+import random
+import numpy as np
+import os
+import time
+import soundfile as sf
+
+import torch
+
+from module.model_loader import load_generator_for_inference, print_startup_time
+from module.text_util import text_to_phoneme, phoneme_to_ids, split_sentences
+from module.inference_util import SynthesisRequest, SpeakerConditioningCache, run_synthesis_windows
+
+#乱数のシードを設定
+manualSeed = 999
+print("Random Seed: ", manualSeed)
+random.seed(manualSeed)
+torch.manual_seed(manualSeed)
+
+###以下は推論に必要なパラメーター###
+#学習済みパラメーターへのパス
+trained_weight_path = "./output/vits/train/iteration1999999/netG_cpu.pth"
+#vits_train.pyでdecoder_configを指定して学習したGeneratorやvits_distill.pyで蒸留したGeneratorを用いる場合は、その構成を保存したjsonファイル(model_config.json)へのパス　Noneならば既定の構成
+model_config_path = None
+#音声合成の対象とする文章が書かれたtxtファイルへのパス
+source_text_path = "./long_text.txt"
+#対象とする話者id
+target_speaker_id = 9
+#結果を出力するためのディレクトリ
+output_dir = "./output/vits/inference/long_text_to_speech/"
+#使用するデバイス
+device = "cuda:0"
+#扱う音声のサンプリングレート
+sampling_rate = 22050
+#いくつの文をまとめて1つのbatchとして推論するか
+batch_size = 8
+#何文ずつ読み込んで処理するか　読み込んだ文は長さ順に並べ替えてからbatchにまとめ、元の順に並べ直してファイルへ書き出す
+#大きいほどbatch内のpaddingが減るが、書き出しを待つ音声を保持するメモリが増える
+sentences_per_window = 64
+#文と文の間に挿入する無音の長さ[秒]
+silence_between_sentences = 0.3
+#推論時のノイズの大きさ、発話速度(大きいほど遅い)、音素継続長のノイズの大きさ
+noise_scale = 0.667
+length_scale = 1.0
+noise_scale_w = 0.8
+#decoderでzを何フレームずつ分割して処理するか　Noneならば分割しない
+decoder_chunk_frames = None
+#並列に推論するprocessの数　2以上の場合はCPUでのみ用いる(各processはモデルのパラメーターを共有し、sentences_per_window文ずつ分担して推論する)
+#各processのthread数は(全体のthread数)/n_workersとなる　短い文のbatchが多い場合は、1つのprocessで多くのthreadを用いるよりも速い
+n_workers = 1
+
+#学習に使用した音素を列挙
+phoneme_list = [' ', 'I', 'N', 'U', 'a', 'b', 'by', 'ch', 'cl', 'd', 'dy', 'e', 'f', 'g', 'gy', 'h', 'hy', 'i', 'j', 'k', 'ky', 'm', 'my', 'n', 'ny', 'o', 'p', 'py', 'r', 'ry', 's', 'sh', 't', 'ts', 'ty', 'u', 'v', 'w', 'y', 'z']
+#音素とindexを対応付け
+phoneme2index = {p : i for i, p in enumerate(phoneme_list, 0)}
+#学習に使用した音素の種類数
+n_phoneme = len(phoneme_list)
+#学習に使用した話者の数
+n_speakers = 100
+
+#出力用ディレクトリがなければ作る
+os.makedirs(output_dir, exist_ok=True)
+
+#GPUが使用可能かどうか確認
+device = torch.device(device if torch.cuda.is_available() else "cpu")
+print("device:",device)
+if device.type != "cpu":
+	n_workers = 1
+
+#Generatorのインスタンスを生成し、学習済みパラメーターを読み込む
+netG, startup_time = load_generator_for_inference(trained_weight_path, n_phoneme=n_phoneme, n_speakers=n_speakers, device=device, model_config_path=model_config_path)
+#起動にかかった時間の内訳を出力
+print_startup_time(startup_time)
+#全ての文で同じ話者を用いるため、話者の条件付けの特徴量は一度だけ計算して使い回す
+netG.speaker_conditioning_cache = SpeakerConditioningCache(netG, max_speakers=1)
+
+##########音声合成の対象とする文章を読み込み、文単位に分割する##########
+with open(source_text_path, "r", encoding="utf-8") as f:
+	sentences = split_sentences(f.read())
+print(f"number of sentences: {len(sentences)}")
+
+#文と文の間に挿入する無音
+silence = np.zeros(int(silence_between_sentences * sampling_rate), dtype=np.float32)
+
+time_start = time.perf_counter()
+n_output_samples = 0
+n_written_sentences = 0
+n_processed_sentences = 0
+#sentences_per_window文ずつ音素idへ変換し、(音素idのlist, 推論の指定のlist)の組を順に返すgenerator
+#pauが含まれている(解釈に失敗した記号がある)文は飛ばす　全ての文を飛ばした組も空の組として返し、処理済みの文の数を組ごとに数えられるようにする
+def iterate_windows():
+	for window_start in range(0, len(sentences), sentences_per_window):
+		phoneme_ids_list = []
+		for sentence in sentences[window_start:window_start+sentences_per_window]:
+			try:
+				phoneme_ids_list.append(phoneme_to_ids(text_to_phoneme(sentence), phoneme2index))
+			except ValueError as e:
+				print(f"skipped: {sentence} ({e})")
+		yield phoneme_ids_list, [SynthesisRequest("", target_speaker_id, noise_scale, length_scale, noise_scale_w)] * len(phoneme_ids_list)
+
+with sf.SoundFile(os.path.join(output_dir, "output.wav"), mode="w", samplerate=sampling_rate, channels=1, subtype="FLOAT") as output_file:
+	#各組の文を長さ順にbatchにまとめて推論を実行　結果は元の文の順に並んで返される(n_workers > 1の場合は複数の組を並列に推論する)
+	for window_index, output_wavs in enumerate(run_synthesis_windows(netG, iterate_windows(), n_workers=n_workers, seed=manualSeed, device=device, max_batch_size=batch_size, decoder_chunk_frames=decoder_chunk_frames)):
+		#文の順に無音を挟みながらファイルへ書き出す
+		for output_wav in output_wavs:
+			if n_written_sentences > 0:
+				output_file.write(silence)
+				n_output_samples += len(silence)
+			output_file.write(output_wav.numpy())
+			n_output_samples += len(output_wav)
+			n_written_sentences += 1
+		#各組はsentences_per_window文(最後の組は残りの文)を受け持つ
+		n_processed_sentences = min((window_index + 1) * sentences_per_window, len(sentences))
+		print(f"[{n_processed_sentences}/{len(sentences)}] sentences processed ({n_written_sentences} written, {n_processed_sentences - n_written_sentences} skipped)")
+print(f"{n_written_sentences} sentences written, {len(sentences) - n_written_sentences} skipped")
+
+#(生成にかかった時間)/(生成された音声の長さ)をReal Time Factorとして出力
+elapsed_time = time.perf_counter() - time_start
+print(f"output length: {n_output_samples / sampling_rate:.2f} sec.")
+print(f"real time factor: {elapsed_time / max(n_output_samples / sampling_rate, 1e-8):.4f}")
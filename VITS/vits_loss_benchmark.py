@@ -0,0 +1,107 @@
+#encoding:utf-8
+
+#Discriminatorのadversarial loss・Generatorのadversarial loss・feature matching lossについて、
+#discriminator・特徴量ごとにPythonのloopで計算する元の関数(module/loss_function.pyのdiscriminator_adversarial_lossなど)と、まとめて計算する関数(fused_*)の
+#順伝搬+逆伝搬にかかる時間・ATenの演算の数・GPUのkernelの数・deviceからhostへの同期の数を、batch sizeを変えながら計測するスクリプト
+#同時に、両者のlossの値と勾配が一致するか(相対誤差)を確認する
+#Discriminatorの重みはランダムに初期化し、入力波形もランダムに作るため、データセットや学習済みパラメーターは不要
+
+import os
+
+import torch
+
+from module.vits_discriminator import VitsDiscriminator
+from module.loss_function import discriminator_adversarial_loss, generator_adversarial_loss, feature_loss, fused_discriminator_adversarial_loss, fused_generator_adversarial_loss, fused_feature_loss
+from module.benchmark_util import measure_time, summarize_times, count_launches, environment_info, save_benchmark_results, compare_with_baseline
+
+###以下は計測に必要なパラメーター###
+#使用するデバイス
+device = "cuda:0"
+#計測するbatch size
+batch_sizes = [1, 16]
+#Discriminatorに入力する波形の長さ(学習時のsegment_size)
+segment_size = 8192
+#各計測を何回繰り返すか(最初のn_warmup回は計測しない)
+n_warmup = 2
+n_repeats = 10
+#結果を出力するjsonファイルへのパス
+output_json_path = "./output/vits/benchmark/loss_benchmark.json"
+#比較の基準とする結果(以前にこのスクリプトで出力したjsonファイル)へのパス　Noneならば比較しない
+baseline_json_path = None
+#基準より何割以上遅くなった場合に性能の低下とみなすか
+regression_threshold = 0.1
+#乱数のシード
+seed = 999
+
+torch.manual_seed(seed)
+device = torch.device(device if torch.cuda.is_available() else "cpu")
+print("device:",device)
+
+netD = VitsDiscriminator().to(device)
+
+#学習の1stepと同じ順にlossを計算する関数
+#Discriminatorの学習では元の関数は各discriminatorのlossを.item()でfloatにして返す
+def loop_losses(authenticity_real, authenticity_fake, feature_map_real, feature_map_fake):
+	adversarial_loss_D, _, _ = discriminator_adversarial_loss(authenticity_real, authenticity_fake)
+	adversarial_loss_G, _ = generator_adversarial_loss(authenticity_fake)
+	return adversarial_loss_D, adversarial_loss_G + feature_loss(feature_map_real, feature_map_fake)
+
+def fused_losses(authenticity_real, authenticity_fake, feature_map_real, feature_map_fake):
+	adversarial_loss_D = fused_discriminator_adversarial_loss(authenticity_real, authenticity_fake)
+	adversarial_loss_G = fused_generator_adversarial_loss(authenticity_fake)
+	return adversarial_loss_D, adversarial_loss_G + fused_feature_loss(feature_map_real, feature_map_fake)
+
+#discriminatorごとのlossもdevice上のtensorとして受け取る場合
+def fused_breakdown_losses(authenticity_real, authenticity_fake, feature_map_real, feature_map_fake):
+	adversarial_loss_D, _, _ = fused_discriminator_adversarial_loss(authenticity_real, authenticity_fake, return_breakdown=True)
+	adversarial_loss_G, _ = fused_generator_adversarial_loss(authenticity_fake, return_breakdown=True)
+	feature_matching_loss, _ = fused_feature_loss(feature_map_real, feature_map_fake, return_breakdown=True)
+	return adversarial_loss_D, adversarial_loss_G + feature_matching_loss
+
+implementations = {"loop" : loop_losses, "fused" : fused_losses, "fused_breakdown" : fused_breakdown_losses}
+
+#Discriminatorの出力を勾配を計算する葉のtensorとし、lossの計算と逆伝搬のみを計測する
+def make_inputs(batch_size):
+	wav_real = torch.rand(batch_size, 1, segment_size, device=device) * 2 - 1
+	wav_fake = torch.rand(batch_size, 1, segment_size, device=device) * 2 - 1
+	with torch.no_grad():
+		authenticity_real, feature_map_real = netD(wav_real)
+		authenticity_fake, feature_map_fake = netD(wav_fake)
+	authenticity_fake = [output.clone().requires_grad_() for output in authenticity_fake]
+	feature_map_fake = [[fmap.clone().requires_grad_() for fmap in fmaps] for fmaps in feature_map_fake]
+	return authenticity_real, authenticity_fake, feature_map_real, feature_map_fake
+
+#lossの順伝搬+逆伝搬を行い、2つのlossと葉のtensorの勾配を返す
+def forward_backward(losses_fn, inputs):
+	leaves = inputs[1] + [fmap for fmaps in inputs[3] for fmap in fmaps]
+	for leaf in leaves:
+		leaf.grad = None
+	loss_D, loss_G = losses_fn(*inputs)
+	(loss_D + loss_G).backward()
+	return loss_D.detach(), loss_G.detach(), [leaf.grad for leaf in leaves]
+
+def relative_error(value, reference):
+	return ((value - reference).abs().max() / reference.abs().max().clamp(min=1e-12)).item()
+
+##########計測##########
+results = {}
+for batch_size in batch_sizes:
+	inputs = make_inputs(batch_size)
+	reference = forward_backward(loop_losses, inputs)
+	for name, losses_fn in implementations.items():
+		case_name = f"{name}/batch{batch_size}"
+		result = {"forward_backward_ms" : summarize_times(measure_time(lambda: forward_backward(losses_fn, inputs), n_warmup=n_warmup, n_repeats=n_repeats, device=device))["median_ms"]}
+		result.update(count_launches(lambda: forward_backward(losses_fn, inputs), device=device))
+		loss_D, loss_G, grads = forward_backward(losses_fn, inputs)
+		result["loss_relative_error"] = max(relative_error(loss_D, reference[0]), relative_error(loss_G, reference[1]))
+		result["grad_relative_error"] = max(relative_error(grad, grad_reference) for grad, grad_reference in zip(grads, reference[2]))
+		results[case_name] = result
+		print(f"{case_name:<28} " + ", ".join(f"{key}: {value:.3g}" if isinstance(value, float) else f"{key}: {value}" for key, value in result.items()))
+
+os.makedirs(os.path.dirname(output_json_path), exist_ok=True)
+save_benchmark_results(output_json_path, results, environment_info(device))
+print(f"saved: {output_json_path}")
+
+##########基準の結果との比較##########
+if baseline_json_path is not None:
+	compare_with_baseline(results, baseline_json_path, ["forward_backward_ms"], threshold=regression_threshold, environment=environment_info(device))
@@ -0,0 +1,117 @@
+#encoding:utf-8
+
+#学習の1step(Generatorの順伝搬、Discriminatorの学習、Generatorの学習)について、各module(TextEncoder, PosteriorEncoder, Flow, StochasticDurationPredictor, Decoder,
+#Discriminatorの各構成要素、Monotonic Alignment Search)がどれだけメモリを使っているかを、スペクトログラムの長さを変えながら計測するスクリプト
+#重みはランダムに初期化し、入力もランダムに作るため、データセットや学習済みパラメーターは不要
+#各計測では逆伝搬のために保持されたactivationの大きさを全てのデバイスで記録し、GPUでは加えてmoduleごとのメモリ確保量の増分と最大値を記録する
+#最後に、各moduleのactivationの大きさがスペクトログラムの長さに対して何乗で増えるかを表示する(MASは音素列の長さ×スペクトログラムの長さに比例するため、1乗より大きくなる)
+
+import os
+
+import numpy as np
+import torch
+
+from module.vits_generator import VitsGenerator
+from module.vits_discriminator import VitsDiscriminator
+from module.train_util import train_step as run_train_step
+from module.memory_profiler import ModuleMemoryProfiler
+from module.benchmark_util import environment_info, save_benchmark_results
+
+###以下は計測に必要なパラメーター###
+#使用するデバイス
+device = "cuda:0"
+#batch size
+batch_size = 16
+#計測するスペクトログラムの長さ[フレーム](batch内の全ての発話をこの長さとする)
+spec_lengths = [200, 400, 800]
+#1音素あたりのスペクトログラムのフレーム数　音素列の長さはスペクトログラムの長さ//frames_per_phonemeとする
+frames_per_phoneme = 6
+#記録するsubmoduleの深さ(1ならばnetG.text_encoder, netD.discriminators.0など、2ならばnetG.decoder.resblocksの中身など)　ModuleListなどの入れ物は深さに数えない
+max_depth = 1
+#各長さについて表示するmoduleの数
+n_top_modules = 12
+#結果を出力するjsonファイルへのパス
+output_json_path = "./output/vits/benchmark/memory_profile.json"
+#乱数のシード
+seed = 999
+#扱う音声のサンプリングレート
+sampling_rate = 22050
+#学習時に切り出す波形のサンプル数
+segment_size = 8192
+#FFTのサイズ
+filter_length = 1024
+#ホップ数　何サンプルずらしながらSTFTを行うか
+hop_length = 256
+#窓関数のサイズ
+win_length = 1024
+#メルスペクトログラムの周波数方向の次元数
+melspec_freq_dim = 80
+#学習に使用した音素の種類数
+n_phoneme = 40
+#学習に使用した話者の数
+n_speakers = 100
+
+torch.manual_seed(seed)
+#GPUが使用可能かどうか確認
+device = torch.device(device if torch.cuda.is_available() else "cpu")
+print("device:",device)
+
+netG = VitsGenerator(n_phoneme=n_phoneme, n_speakers=n_speakers).to(device).train()
+netD = VitsDiscriminator().to(device).train()
+profiler = ModuleMemoryProfiler.for_vits(netG, netD, max_depth=max_depth, device=device)
+
+##########学習の1step(vits_train.pyと同じmodule/train_util.pyのtrain_stepを用い、optimizerによる更新のみを省く)##########
+def train_step(spec_length):
+	text_length = spec_length // frames_per_phoneme
+	#collate_fnと同じ形式のbatchをランダムに作る
+	data = (
+		torch.rand(batch_size, 1, spec_length*hop_length) * 2 - 1,
+		torch.full((batch_size,), spec_length*hop_length, dtype=torch.long),
+		torch.rand(batch_size, filter_length//2 + 1, spec_length),
+		torch.full((batch_size,), spec_length, dtype=torch.long),
+		torch.randint(0, n_speakers, (batch_size,)),
+		torch.randint(1, n_phoneme, (batch_size, text_length)),
+		torch.full((batch_size,), text_length, dtype=torch.long),
+	)
+	run_train_step(netG, netD, None, None, data, device, segment_size=segment_size, sampling_rate=sampling_rate, filter_length=filter_length, hop_length=hop_length, win_length=win_length, melspec_freq_dim=melspec_freq_dim)
+	netG.zero_grad(set_to_none=True)
+	netD.zero_grad(set_to_none=True)
+
+def to_mb(n_bytes):
+	return None if n_bytes is None else n_bytes / 1024**2
+
+##########計測##########
+results = {}
+for spec_length in spec_lengths:
+	#1回目の計測には初期化(cuDNNのworkspaceの確保など)の影響が含まれるため、同じ長さで1度実行してから計測する
+	train_step(spec_length)
+	with profiler.step():
+		train_step(spec_length)
+	records = profiler.sorted_records()
+	total_saved_bytes = sum(records_of_network["saved_activation_bytes"] for name, records_of_network in records if name in ("netG", "netD"))
+	print(f"\nspec length: {spec_length} frames, text length: {spec_length // frames_per_phoneme}, batch size: {batch_size}, saved activations: {to_mb(total_saved_bytes):.1f} MB" + (f", step peak: {to_mb(profiler.step_peak_bytes):.1f} MB" if profiler.use_cuda_stats else ""))
+	for name, record in records[:n_top_modules]:
+		line = f"{name:<40} saved: {to_mb(record['saved_activation_bytes']):>9.1f} MB ({record['saved_activation_bytes'] / max(total_saved_bytes, 1) * 100:5.1f}%), output: {to_mb(record['output_bytes']):>8.1f} MB, calls: {record['calls']}"
+		if profiler.use_cuda_stats:
+			line += f", allocated: {to_mb(record['allocated_delta_bytes']):>9.1f} MB, peak: {to_mb(record['peak_delta_bytes']):>9.1f} MB"
+		print(line)
+	results[f"spec{spec_length}"] = {"spec_length" : spec_length, "text_length" : spec_length // frames_per_phoneme, "batch_size" : batch_size, "modules" : {name : dict(record) for name, record in records}}
+profiler.remove()
+
+os.makedirs(os.path.dirname(output_json_path), exist_ok=True)
+save_benchmark_results(output_json_path, results, environment_info(device))
+print(f"saved: {output_json_path}")
+
+##########長さに対するメモリ使用量の増え方##########
+#log(大きさ)をlog(スペクトログラムの長さ)に対して直線で近似した傾き　1ならば長さに比例、2ならば長さの2乗に比例して増える
+#MASは勾配を計算しないためactivationを保持しない　代わりに出力(alignment)の大きさの増え方を見る
+def growth_exponent(values):
+	return np.polyfit(np.log(spec_lengths), np.log(values), 1)[0] if min(values) > 0 else float("nan")
+
+if len(spec_lengths) >= 2:
+	print("\nsaved activations [MB] by spec length (exponent: growth rate against spec length)")
+	print(f"{'module':<40} " + " ".join(f"{spec_length:>9}" for spec_length in spec_lengths) + "  exponent  output exponent")
+	for name, _ in profiler.sorted_records()[:n_top_modules]:
+		saved_bytes = [results[f"spec{spec_length}"]["modules"][name]["saved_activation_bytes"] for spec_length in spec_lengths]
+		output_bytes = [results[f"spec{spec_length}"]["modules"][name]["output_bytes"] for spec_length in spec_lengths]
+		print(f"{name:<40} " + " ".join(f"{to_mb(n_bytes):>9.1f}" for n_bytes in saved_bytes) + f"  {growth_exponent(saved_bytes):8.2f}  {growth_exponent(output_bytes):15.2f}")
@@ -0,0 +1,90 @@
+#encoding:utf-8
+
+#Text-to-Speechと音声変換の推論を、音素列・スペクトログラムの長さを可変としてONNX形式で書き出し、
+#onnxruntimeで実行した結果がPyTorchでの推論結果と一致するか検証するスクリプト
+
+import os
+import sys
+
+import torch
+import torchaudio
+
+from module.model_loader import load_generator_for_inference
+from module.audio_util import compute_spectrogram
+from module.text_util import text_to_phoneme, phoneme_to_ids
+from module.onnx_export import prepare_generator_for_export, make_tts_inputs, make_vc_inputs, export_text_to_speech, export_voice_conversion, validate_graph, eager_text_to_speech, eager_voice_conversion, tts_input_names, vc_input_names
+
+#乱数のシードを設定
+manualSeed = 999
+print("Random Seed: ", manualSeed)
+torch.manual_seed(manualSeed)
+
+###以下は書き出しに必要なパラメーター###
+#学習済みパラメーターへのパス
+trained_weight_path = "./output/vits/train/iteration1999999/netG_cpu.pth"
+#vits_train.pyでdecoder_configを指定して学習したGeneratorやvits_distill.pyで蒸留したGeneratorを用いる場合は、その構成を保存したjsonファイル(model_config.json)へのパス　Noneならば既定の構成
+model_config_path = None
+#書き出したグラフを保存するディレクトリ
+output_dir = "./output/vits/onnx/"
+#ONNXのopset version
+opset_version = 17
+#書き出し時の入力例と、検証に用いる文章(書き出し時と異なる長さで正しく動作するか確認する)
+example_text = "これはテスト音声です"
+validation_texts = ["あ", "こんにちは", "今日はいい天気ですね", "書き出したグラフが様々な長さの入力に対して正しく動作するか検証しています"]
+#対象とする話者id
+target_speaker_id = 9
+#音声変換の入力例と検証に用いるwavファイル、変換元の話者id　ファイルが存在しない場合は白色雑音で代用する
+source_wav_path = "./dataset/jvs_preprocessed/jvs_wav_preprocessed/jvs099/VOICEACTRESS100_011.wav"
+source_speaker_id = 98
+#生成される音声のフレーム数(1フレーム=256サンプル)の上限　Text-to-Speechのグラフに入力するlatent_noiseの長さとなる
+max_frames = 2048
+#PyTorchでの推論結果との誤差の許容値
+max_abs_error_tolerance = 1e-3
+#学習に使用した音素を列挙
+phoneme_list = [' ', 'I', 'N', 'U', 'a', 'b', 'by', 'ch', 'cl', 'd', 'dy', 'e', 'f', 'g', 'gy', 'h', 'hy', 'i', 'j', 'k', 'ky', 'm', 'my', 'n', 'ny', 'o', 'p', 'py', 'r', 'ry', 's', 'sh', 't', 'ts', 'ty', 'u', 'v', 'w', 'y', 'z']
+#音素とindexを対応付け
+phoneme2index = {p : i for i, p in enumerate(phoneme_list, 0)}
+#学習に使用した音素の種類数
+n_phoneme = len(phoneme_list)
+#学習に使用した話者の数
+n_speakers = 100
+
+#出力用ディレクトリがなければ作る
+os.makedirs(output_dir, exist_ok=True)
+
+#Generatorのインスタンスを生成し、学習済みパラメーターを読み込む　書き出しはCPU上で行う
+netG, _ = load_generator_for_inference(trained_weight_path, n_phoneme=n_phoneme, n_speakers=n_speakers, device="cpu", model_config_path=model_config_path)
+netG = prepare_generator_for_export(netG)
+
+##########Text-to-Speech##########
+tts_path = os.path.join(output_dir, "text_to_speech.onnx")
+export_text_to_speech(netG, tts_path, make_tts_inputs(phoneme_to_ids(text_to_phoneme(example_text), phoneme2index), target_speaker_id, max_frames=max_frames), opset_version=opset_version)
+print(f"exported: {tts_path} ({os.path.getsize(tts_path) / 1e6:.1f} MB)")
+tts_inputs_list = [make_tts_inputs(phoneme_to_ids(text_to_phoneme(text), phoneme2index), target_speaker_id, max_frames=max_frames) for text in validation_texts]
+tts_results = validate_graph(netG, eager_text_to_speech, tts_path, tts_input_names, tts_inputs_list)
+
+##########音声変換##########
+if os.path.exists(source_wav_path):
+	loaded_wav, _ = torchaudio.load(source_wav_path)
+else:
+	print(f"{source_wav_path} not found, white noise is used instead")
+	loaded_wav = torch.randn(1, 22050) * 0.1
+spec = compute_spectrogram(loaded_wav)
+vc_path = os.path.join(output_dir, "voice_conversion.onnx")
+export_voice_conversion(netG, vc_path, make_vc_inputs(spec, source_speaker_id, target_speaker_id), opset_version=opset_version)
+print(f"exported: {vc_path} ({os.path.getsize(vc_path) / 1e6:.1f} MB)")
+#書き出し時と異なる長さで検証する
+vc_inputs_list = [make_vc_inputs(spec[:, :, :length], source_speaker_id, target_speaker_id) for length in [spec.size(2), spec.size(2) // 2, 7]]
+vc_results = validate_graph(netG, eager_voice_conversion, vc_path, vc_input_names, vc_inputs_list)
+
+##########検証結果の出力##########
+passed = True
+for task, results in [("tts", tts_results), ("vc", vc_results)]:
+	for result in results:
+		ok = result["max_abs_error"] <= max_abs_error_tolerance
+		passed = passed and ok
+		print(f"{task}: output_length: {result['output_length']}, max_abs_error: {result['max_abs_error']:.2e}, eager: {result['eager_time']*1000:.1f} ms, onnxruntime: {result['graph_time']*1000:.1f} ms, {'OK' if ok else 'NG'}")
+if not passed:
+	print("validation failed")
+	sys.exit(1)
+print("validation passed")
@@ -0,0 +1,138 @@
+#encoding:utf-8
+
+#推論時の演算精度(fp32, int8_dynamic, int8_static, bf16)ごとに、Text-to-Speechと音声変換のReal Time Factor、モデルの大きさ、
+#fp32の出力からの品質の変化(メルスペクトログラムのL1距離)を計測するスクリプト
+
+import io
+import os
+import time
+
+import torch
+import torchaudio
+
+from module.model_loader import load_generator_for_inference
+from module.precision_util import set_inference_precision
+from module.audio_util import compute_spectrogram, compute_mel_spectrogram
+from module.text_util import text_to_phoneme, phoneme_to_ids
+
+###以下は計測に必要なパラメーター###
+#学習済みパラメーターへのパス
+trained_weight_path = "./output/vits/train/iteration1999999/netG_cpu.pth"
+#vits_train.pyでdecoder_configを指定して学習したGeneratorやvits_distill.pyで蒸留したGeneratorを用いる場合は、その構成を保存したjsonファイル(model_config.json)へのパス　Noneならば既定の構成
+model_config_path = None
+#使用するデバイス　int8の量子化はCPUでのみ動作する
+device = "cpu"
+#計測する演算精度
+precisions = ["fp32", "int8_dynamic", "int8_static", "bf16"]
+#Text-to-Speechの計測に用いる文章と話者id
+source_texts = ["これはテスト音声です", "今日はいい天気ですね", "音声合成の推論速度と品質を計測しています"]
+target_speaker_id = 9
+#音声変換の計測に用いる(wavファイルへのパス, 変換元の話者id, 変換先の話者id)　存在しないファイルは飛ばす
+source_wavs = [("./dataset/jvs_preprocessed/jvs_wav_preprocessed/jvs099/VOICEACTRESS100_011.wav", 98, 9)]
+#int8_staticのcalibrationに用いる文章(計測に用いる文章とは別のものを指定する)
+calibration_texts = ["こんにちは", "音声の量子化に用いる入力の範囲を計測します", "明日は雨が降るそうです"]
+#各計測を何回繰り返すか(最も速かった回の時間を用いる)
+n_repeats = 3
+#乱数のシード　各精度で同じノイズを用いることで出力を比較できるようにする
+seed = 999
+#扱う音声のサンプリングレート
+sampling_rate = 22050
+#学習に使用した音素を列挙
+phoneme_list = [' ', 'I', 'N', 'U', 'a', 'b', 'by', 'ch', 'cl', 'd', 'dy', 'e', 'f', 'g', 'gy', 'h', 'hy', 'i', 'j', 'k', 'ky', 'm', 'my', 'n', 'ny', 'o', 'p', 'py', 'r', 'ry', 's', 'sh', 't', 'ts', 'ty', 'u', 'v', 'w', 'y', 'z']
+#音素とindexを対応付け
+phoneme2index = {p : i for i, p in enumerate(phoneme_list, 0)}
+#学習に使用した音素の種類数
+n_phoneme = len(phoneme_list)
+#学習に使用した話者の数
+n_speakers = 100
+
+device = torch.device(device)
+print("device:",device)
+
+##########計測に用いる入力の用意##########
+def make_tts_inputs(texts):
+	tts_inputs = []
+	for text in texts:
+		phoneme_ids = phoneme_to_ids(text_to_phoneme(text), phoneme2index)
+		text_padded = torch.LongTensor(phoneme_ids).unsqueeze(0).to(device)
+		text_lengths = torch.tensor([text_padded.size(1)], dtype=torch.long).to(device)
+		tts_inputs.append((text_padded, text_lengths, torch.tensor([target_speaker_id], dtype=torch.long).to(device)))
+	return tts_inputs
+
+tts_inputs = make_tts_inputs(source_texts)
+calibration_inputs = make_tts_inputs(calibration_texts)
+vc_inputs = []
+for source_wav_path, source_speaker_id, vc_target_speaker_id in source_wavs:
+	if not os.path.exists(source_wav_path):
+		print(f"skip (not found): {source_wav_path}")
+		continue
+	loaded_wav, _ = torchaudio.load(source_wav_path)
+	spec = compute_spectrogram(loaded_wav).to(device)
+	spec_lengths = torch.tensor([spec.size(2)], dtype=torch.long).to(device)
+	vc_inputs.append((spec, spec_lengths, torch.tensor([source_speaker_id], dtype=torch.long).to(device), torch.tensor([vc_target_speaker_id], dtype=torch.long).to(device)))
+
+##########各演算精度での計測##########
+def run_tts(netG, inputs):
+	output_wavs = []
+	for text_padded, text_lengths, speaker_id in inputs:
+		torch.manual_seed(seed)
+		output_wavs.append(netG.text_to_speech(text_padded=text_padded, text_lengths=text_lengths, speaker_id=speaker_id)[0, 0].data.cpu())
+	return output_wavs
+
+def run_vc(netG, inputs):
+	output_wavs = []
+	for spec, spec_lengths, source_speaker_id, vc_target_speaker_id in inputs:
+		torch.manual_seed(seed)
+		output_wavs.append(netG.voice_conversion(spec, spec_lengths, source_speaker_id, vc_target_speaker_id)[0, 0].data.cpu())
+	return output_wavs
+
+#推論にかかった時間(n_repeats回のうち最短のもの)と出力された音声を返す
+def measure(run, netG, inputs):
+	elapsed_times = []
+	for _ in range(n_repeats):
+		time_start = time.perf_counter()
+		with torch.no_grad():
+			output_wavs = run(netG, inputs)
+		elapsed_times.append(time.perf_counter() - time_start)
+	return min(elapsed_times), output_wavs
+
+#int8_staticのcalibrationに用いる関数
+def calibrate(netG):
+	run_tts(netG, calibration_inputs)
+	run_vc(netG, vc_inputs)
+
+#fp32の出力とのメルスペクトログラムのL1距離(各発話の平均)　発話の長さが異なる場合は短い方に合わせる
+def mel_l1_distance(output_wavs, reference_wavs):
+	distances = []
+	for output_wav, reference_wav in zip(output_wavs, reference_wavs):
+		length = min(output_wav.size(0), reference_wav.size(0))
+		mel_output = compute_mel_spectrogram(output_wav[:length].unsqueeze(0), sampling_rate)
+		mel_reference = compute_mel_spectrogram(reference_wav[:length].unsqueeze(0), sampling_rate)
+		distances.append(torch.mean(torch.abs(mel_output - mel_reference)).item())
+	return sum(distances) / len(distances)
+
+def model_size_mb(netG):
+	buffer = io.BytesIO()
+	torch.save(netG.state_dict(), buffer)
+	return buffer.getbuffer().nbytes / 1e6
+
+#fp32の結果を基準とするため最初に計測する
+precisions = ["fp32"] + [precision for precision in precisions if precision != "fp32"]
+reference_wavs = {}
+for precision in precisions:
+	#量子化はモデルを置き換えるため、精度ごとにモデルを読み込み直す
+	netG, _ = load_generator_for_inference(trained_weight_path, n_phoneme=n_phoneme, n_speakers=n_speakers, device=device, model_config_path=model_config_path)
+	set_inference_precision(netG, precision, calibrate=calibrate)
+	result = {"precision" : precision, "model_size_mb" : model_size_mb(netG)}
+	for task, run, inputs in [("tts", run_tts, tts_inputs), ("vc", run_vc, vc_inputs)]:
+		if len(inputs) == 0:
+			continue
+		elapsed_time, output_wavs = measure(run, netG, inputs)
+		if precision == "fp32":
+			reference_wavs[task] = output_wavs
+		#(生成にかかった時間)/(生成された音声の長さ)
+		result[f"{task}_rtf"] = elapsed_time / (sum(output_wav.size(0) for output_wav in output_wavs) / sampling_rate)
+		result[f"{task}_mel_l1"] = mel_l1_distance(output_wavs, reference_wavs[task])
+		#発話の長さ(StochasticDurationPredictorの予測)がfp32と変わった発話の数
+		result[f"{task}_length_changed"] = sum(output_wav.size(0) != reference_wav.size(0) for output_wav, reference_wav in zip(output_wavs, reference_wavs[task]))
+	print(", ".join(f"{key}: {value:.4f}" if isinstance(value, float) else f"{key}: {value}" for key, value in result.items()))
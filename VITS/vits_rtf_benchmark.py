@@ -0,0 +1,135 @@
+#encoding:utf-8
+
+#Text-to-Speech(text_to_speech_batch)と音声変換(voice_conversion)の推論について、thread数・batch size・入力の長さを変えながら
+#Real Time Factor、latencyのpercentile、throughput(1秒あたりに生成できる音声の秒数)、peak RSSを計測するスクリプト
+#最後に、1台のマシンのcore数をどのようにreplica(推論processの数)とreplicaあたりのthread数に割り振るとthroughputが最大となるかを表示する
+
+import os
+import itertools
+
+import torch
+
+from module.vits_generator import VitsGenerator
+from module.model_loader import load_generator_for_inference, load_model_config
+from module.precision_util import set_inference_precision
+from module.benchmark_util import measure_time, summarize_times, environment_info, save_benchmark_results, peak_rss_mb, run_in_subprocess
+
+###以下は計測に必要なパラメーター###
+#学習済みパラメーターへのパス　Noneならばランダムに初期化した重みを用いる
+#(Text-to-Speechで生成される音声の長さは予測された音素継続長で決まるため、実際の発話に近い長さで計測するには学習済みパラメーターを指定する)
+trained_weight_path = None
+#vits_train.pyでdecoder_configを指定して学習したGeneratorやvits_distill.pyで蒸留したGeneratorを用いる場合は、その構成を保存したjsonファイル(model_config.json)へのパス　Noneならば既定の構成
+model_config_path = None
+#使用するデバイス　thread数を変えた計測とpeak RSSはCPUでのみ意味を持ち、各計測はforkした子processで行う(CUDAは子processで初期化し直せない)ため、CPUのみに対応する
+device = "cpu"
+#推論時の演算精度　"fp32", "int8_dynamic", "bf16"から選ぶ(module/precision_util.py参照)
+inference_precision = "fp32"
+#計測するintra-op thread数
+thread_counts = [1, 2, 4]
+#計測するbatch size
+batch_sizes = [1, 4]
+#Text-to-Speechの入力とする音素列の長さ(ランダムな音素列を用いる)
+text_lengths = [20, 80]
+#音声変換の入力とする音声の長さ[s](ランダムなスペクトログラムを用いる)
+vc_seconds = [2, 8]
+#計測するタスク
+tasks = ["tts", "vc"]
+#各計測を何回繰り返すか(最初のn_warmup回は計測しない)
+n_warmup = 1
+n_repeats = 5
+#replicaの割り振りを考える対象のマシンのcore数　Noneならばこのマシンのcore数
+host_cores = None
+#結果を出力するjsonファイルへのパス
+output_json_path = "./output/vits/benchmark/rtf_benchmark.json"
+#乱数のシード
+seed = 999
+#扱う音声のサンプリングレート
+sampling_rate = 22050
+#ホップ数　何サンプルずらしながらSTFTを行うか
+hop_length = 256
+#学習に使用した音素の種類数
+n_phoneme = 40
+#学習に使用した話者の数
+n_speakers = 100
+
+if torch.device(device).type != "cpu":
+	print(f"warning: {device} is not supported (measurements run in forked subprocesses), using cpu instead")
+device = torch.device("cpu")
+print("device:",device)
+host_cores = os.cpu_count() if host_cores is None else host_cores
+
+#子processでの計測の前にモデルを読み込んでおき、各子processと共有する
+torch.manual_seed(seed)
+if trained_weight_path is not None:
+	netG, _ = load_generator_for_inference(trained_weight_path, n_phoneme=n_phoneme, n_speakers=n_speakers, device=device, model_config_path=model_config_path)
+else:
+	netG = VitsGenerator(n_phoneme=n_phoneme, n_speakers=n_speakers, **load_model_config(model_config_path)).to(device).eval()
+set_inference_precision(netG, inference_precision)
+
+##########1つの設定での計測(子processで実行する)##########
+def measure(task, n_threads, batch_size, length):
+	torch.set_num_threads(n_threads)
+	torch.manual_seed(seed)
+	speaker_id = torch.randint(0, n_speakers, (batch_size,), device=device)
+	audio_seconds = []
+	if task == "tts":
+		text_padded = torch.randint(1, n_phoneme, (batch_size, length), device=device)
+		text_lengths = torch.full((batch_size,), length, dtype=torch.long, device=device)
+		def run():
+			with torch.no_grad():
+				_, wav_lengths = netG.text_to_speech_batch(text_padded, text_lengths, speaker_id)
+			audio_seconds.append(wav_lengths.sum().item() / sampling_rate)
+	else:
+		n_frames = int(length * sampling_rate / hop_length)
+		spec = torch.rand(batch_size, netG.spec_channels, n_frames, device=device)
+		spec_lengths = torch.full((batch_size,), n_frames, dtype=torch.long, device=device)
+		target_speaker_id = torch.randint(0, n_speakers, (batch_size,), device=device)
+		def run():
+			with torch.no_grad():
+				wav_fake = netG.voice_conversion(spec, spec_lengths, speaker_id, target_speaker_id)
+			audio_seconds.append(wav_fake.size(0) * wav_fake.size(2) / sampling_rate)
+	elapsed_times = measure_time(run, n_warmup=n_warmup, n_repeats=n_repeats, device=device)
+	#計測した回の生成された音声の長さのみを用いる
+	audio_seconds = audio_seconds[n_warmup:]
+	result = {
+		#(生成にかかった時間)/(生成された音声の長さ)
+		"rtf" : sum(elapsed_times) / sum(audio_seconds),
+		#1秒あたりに生成できる音声の長さ[s]
+		"throughput" : sum(audio_seconds) / sum(elapsed_times),
+		"audio_seconds_per_call" : sum(audio_seconds) / len(audio_seconds),
+		"peak_rss_mb" : peak_rss_mb(),
+	}
+	#推論1回(batch_size件)のlatency
+	result.update({f"latency_{key}" : value for key, value in summarize_times(elapsed_times).items()})
+	return result
+
+##########計測##########
+results = {}
+for task in tasks:
+	lengths = text_lengths if task == "tts" else vc_seconds
+	for n_threads, batch_size, length in itertools.product(thread_counts, batch_sizes, lengths):
+		case_name = f"{task}/threads{n_threads}_batch{batch_size}_" + (f"text{length}" if task == "tts" else f"{length}s")
+		results[case_name] = {"task" : task, "threads" : n_threads, "batch_size" : batch_size, "length" : length, **run_in_subprocess(measure, task, n_threads, batch_size, length)}
+		result = results[case_name]
+		print(f"{case_name:<36} rtf: {result['rtf']:.3f}, throughput: {result['throughput']:.2f} audio-s/s, latency p50: {result['latency_p50_ms']:.1f} ms, p90: {result['latency_p90_ms']:.1f} ms, p99: {result['latency_p99_ms']:.1f} ms, peak RSS: {result['peak_rss_mb']:.0f} MB")
+
+os.makedirs(os.path.dirname(output_json_path), exist_ok=True)
+save_benchmark_results(output_json_path, results, environment_info(device))
+print(f"saved: {output_json_path}")
+
+##########replicaの割り振りの比較##########
+#replicaあたりのthread数ごとに、host_cores個のcoreを(host_cores//thread数)個のreplicaで使う場合のマシン全体のthroughputとメモリ使用量を見積もる
+#replica同士はcoreを取り合わないものと仮定し、replicaのthroughputを単純に足し合わせる
+print(f"\nreplica sizing for {host_cores} cores (assuming replicas scale linearly):")
+for task, batch_size in itertools.product(tasks, batch_sizes):
+	lengths = text_lengths if task == "tts" else vc_seconds
+	for length in lengths:
+		candidates = []
+		for n_threads in thread_counts:
+			if n_threads > host_cores:
+				continue
+			result = [r for r in results.values() if (r["task"], r["threads"], r["batch_size"], r["length"]) == (task, n_threads, batch_size, length)][0]
+			n_replicas = host_cores // n_threads
+			candidates.append((n_replicas * result["throughput"], n_threads, n_replicas, result))
+		for host_throughput, n_threads, n_replicas, result in sorted(candidates, key=lambda candidate: candidate[0], reverse=True):
+			print(f"{task} batch{batch_size} length{length}: {n_threads} threads x {n_replicas} replicas -> {host_throughput:.2f} audio-s/s, latency p90: {result['latency_p90_ms']:.1f} ms, memory: {n_replicas * result['peak_rss_mb']:.0f} MB")
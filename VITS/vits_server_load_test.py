@@ -0,0 +1,79 @@
+#encoding:utf-8
+
+#vits_synthesis_server.pyで起動したサーバーに対し、複数のclientから同時にText-to-Speechの要求を送り、throughputとlatencyを計測するスクリプト
+#同時に要求を送るclientの数を変えながら、batchにまとめて処理する場合(mode=batched)と1件ずつ順に処理する場合(mode=serial)の両方を計測し、
+#latencyのp99がp99_target_ms以下に収まる範囲で最も大きなthroughputを比較する
+
+import json
+import time
+import random
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+###以下は計測に必要なパラメーター###
+#サーバーのURL
+server_url = "http://127.0.0.1:8000"
+#計測するmode　"batched"はbatchにまとめて処理、"serial"は1件ずつ順に処理する
+modes = ["batched", "serial"]
+#同時に要求を送るclientの数の候補(小さい順)
+client_counts = [1, 2, 4, 8, 16]
+#clientの数1つあたりに送る要求の数(送る要求の総数はclientの数×この値)
+n_requests_per_client = 8
+#各計測の前に送る要求の数(計測しない)
+n_warmup_requests = 2
+#latencyのp99の目標[ms]　これ以下に収まるclientの数のうち、throughputが最大のものを各modeの結果とする
+p99_target_ms = 5000
+#要求に用いる文章と話者id
+source_texts = ["これはテスト音声です", "こんにちは", "今日はいい天気ですね", "音声合成の負荷試験を行っています"]
+speaker_ids = [0, 9, 50, 99]
+
+random.seed(999)
+
+def send_tts_request(text, speaker_id, mode):
+	body = json.dumps({"text" : text, "speaker_id" : speaker_id}).encode("utf-8")
+	request = urllib.request.Request(server_url + f"/tts?mode={mode}", data=body, headers={"Content-Type" : "application/json"})
+	time_start = time.perf_counter()
+	with urllib.request.urlopen(request) as response:
+		wav_bytes = response.read()
+	return time.perf_counter() - time_start, len(wav_bytes)
+
+#n_clients個のclientから同時に要求を送り、throughput[requests/sec.]とlatencyのpercentile[ms]を返す
+def run_load(mode, n_clients):
+	for _ in range(n_warmup_requests):
+		send_tts_request(random.choice(source_texts), random.choice(speaker_ids), mode)
+	requests = [(random.choice(source_texts), random.choice(speaker_ids), mode) for _ in range(n_clients * n_requests_per_client)]
+	time_start = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=n_clients) as executor:
+		results = list(executor.map(lambda request: send_tts_request(*request), requests))
+	elapsed_time = time.perf_counter() - time_start
+	latencies = np.array([latency for latency, _ in results]) * 1000
+	result = {"throughput" : len(requests) / elapsed_time}
+	for percentile in [50, 90, 99]:
+		result[f"p{percentile}_ms"] = float(np.percentile(latencies, percentile))
+	return result
+
+best_results = {}
+for mode in modes:
+	print(f"mode: {mode}")
+	best_results[mode] = None
+	for n_clients in client_counts:
+		result = run_load(mode, n_clients)
+		within_target = result["p99_ms"] <= p99_target_ms
+		print(f"  clients: {n_clients:>3}, throughput: {result['throughput']:6.2f} requests/sec., latency p50: {result['p50_ms']:8.1f} ms, p90: {result['p90_ms']:8.1f} ms, p99: {result['p99_ms']:8.1f} ms {'' if within_target else '(over p99 target)'}")
+		if within_target and (best_results[mode] is None or result["throughput"] > best_results[mode]["throughput"]):
+			best_results[mode] = {"n_clients" : n_clients, **result}
+	#サーバー側の統計を出力
+	with urllib.request.urlopen(server_url + f"/stats?mode={mode}") as response:
+		print("  server stats:", json.loads(response.read().decode("utf-8")))
+
+##########p99の目標を満たす範囲でのthroughputの比較##########
+print(f"\nbest throughput with p99 <= {p99_target_ms} ms:")
+for mode in modes:
+	if best_results[mode] is None:
+		print(f"  {mode:<8} no client count met the p99 target")
+	else:
+		print(f"  {mode:<8} {best_results[mode]['throughput']:6.2f} requests/sec. (clients: {best_results[mode]['n_clients']}, p99: {best_results[mode]['p99_ms']:.1f} ms)")
+if best_results.get("batched") is not None and best_results.get("serial") is not None:
+	print(f"batched / serial: {best_results['batched']['throughput'] / best_results['serial']['throughput']:.2f}x")
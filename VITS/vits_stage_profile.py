@@ -0,0 +1,100 @@
+#encoding:utf-8
+
+#Text-to-Speechの推論(text_to_speech)について、TextEncoder, StochasticDurationPredictor(逆), pathの生成, Flow(逆), Decoderの各段階にかかる時間・入出力のフレーム数・FLOP数を、
+#音素列の長さを変えながら計測するスクリプト(module/stage_profiler.py参照)
+#各長さで最も時間のかかった段階を表示するため、短い文章でStochasticDurationPredictorが律速になるといった変化を確認できる
+#結果はjsonファイルに保存し、baseline_json_pathを指定した場合は基準の結果と比較して一定以上遅くなった段階を表示する
+
+import os
+
+import torch
+
+from module.vits_generator import VitsGenerator
+from module.model_loader import load_generator_for_inference, load_model_config
+from module.precision_util import set_inference_precision
+from module.stage_profiler import InferenceStageProfiler
+from module.benchmark_util import environment_info, save_benchmark_results, compare_with_baseline
+
+###以下は計測に必要なパラメーター###
+#学習済みパラメーターへのパス　Noneならばランダムに初期化した重みを用いる
+#(生成される音声の長さは予測された音素継続長で決まるため、実際の発話に近い長さで計測するには学習済みパラメーターを指定する)
+trained_weight_path = None
+#vits_train.pyでdecoder_configを指定して学習したGeneratorやvits_distill.pyで蒸留したGeneratorを用いる場合は、その構成を保存したjsonファイル(model_config.json)へのパス　Noneならば既定の構成
+model_config_path = None
+#使用するデバイス
+device = "cuda:0"
+#推論時の演算精度　"fp32", "int8_dynamic", "bf16"から選ぶ(module/precision_util.py参照)
+inference_precision = "fp32"
+#計測する音素列の長さ(ランダムな音素列を用いる)
+text_lengths = [8, 32, 128]
+#batch size
+batch_size = 1
+#FLOP数を数えるかどうか　数える場合は時間の計測とは別に1回推論を行う
+count_flops = True
+#各計測を何回繰り返すか(最初のn_warmup回は計測しない)
+n_warmup = 1
+n_repeats = 5
+#結果を出力するjsonファイルへのパス
+output_json_path = "./output/vits/benchmark/stage_profile.json"
+#比較の基準とする結果(以前にこのスクリプトで出力したjsonファイル)へのパス　Noneならば比較しない
+baseline_json_path = None
+#基準より何割以上遅くなった場合に性能の低下とみなすか
+regression_threshold = 0.1
+#乱数のシード
+seed = 999
+#学習に使用した音素の種類数
+n_phoneme = 40
+#学習に使用した話者の数
+n_speakers = 100
+
+torch.manual_seed(seed)
+device = torch.device(device if torch.cuda.is_available() else "cpu")
+print("device:",device)
+
+if trained_weight_path is not None:
+	netG, _ = load_generator_for_inference(trained_weight_path, n_phoneme=n_phoneme, n_speakers=n_speakers, device=device, model_config_path=model_config_path)
+else:
+	netG = VitsGenerator(n_phoneme=n_phoneme, n_speakers=n_speakers, **load_model_config(model_config_path)).to(device).eval()
+set_inference_precision(netG, inference_precision)
+
+#音素列の長さtext_lengthのランダムな入力でtext_to_speechをn_repeats回実行し、profilerの記録をまとめたdictを返す
+def profile(text_length, profiler, n_repeats):
+	torch.manual_seed(seed)
+	text_padded = torch.randint(1, n_phoneme, (batch_size, text_length), device=device)
+	text_lengths = torch.full((batch_size,), text_length, dtype=torch.long, device=device)
+	speaker_id = torch.randint(0, n_speakers, (batch_size,), device=device)
+	netG.stage_profiler = profiler
+	for _ in range(n_repeats):
+		with torch.no_grad():
+			netG.text_to_speech(text_padded, text_lengths, speaker_id)
+	netG.stage_profiler = None
+	return profiler.summary()
+
+##########計測##########
+results = {}
+for text_length in text_lengths:
+	profile(text_length, InferenceStageProfiler(device, count_flops=False), n_warmup)
+	#時間はFLOP数を数えずに計測する
+	summary = profile(text_length, InferenceStageProfiler(device, count_flops=False), n_repeats)
+	if count_flops:
+		flops_summary = profile(text_length, InferenceStageProfiler(device, count_flops=True), 1)
+		for name, stage in summary.items():
+			stage["flops_per_call"] = flops_summary[name]["flops"]
+			stage["flops_per_second"] = flops_summary[name]["flops"] / (stage["mean_ms"] / 1000)
+	print(f"\ntext length: {text_length}, batch size: {batch_size}")
+	for name, stage in summary.items():
+		results[f"text{text_length}/{name}"] = stage
+		line = f"{name:<20} {stage['mean_ms']:>9.2f} ms ({stage['ratio'] * 100:5.1f}%), frames: {stage['input_frames'] // stage['calls']:>7} -> {stage['output_frames'] // stage['calls']:>8}"
+		if count_flops:
+			line += f", {stage['flops_per_call'] / 1e9:>8.3f} GFLOP, {stage['flops_per_second'] / 1e9:>7.2f} GFLOP/s"
+		print(line)
+	bottleneck = max(summary.items(), key=lambda item: item[1]["mean_ms"])[0]
+	print(f"bottleneck: {bottleneck}")
+
+os.makedirs(os.path.dirname(output_json_path), exist_ok=True)
+save_benchmark_results(output_json_path, results, environment_info(device))
+print(f"saved: {output_json_path}")
+
+##########基準の結果との比較##########
+if baseline_json_path is not None:
+	compare_with_baseline(results, baseline_json_path, ["mean_ms"], threshold=regression_threshold, environment=environment_info(device))
@@ -0,0 +1,88 @@
+#encoding:utf-8
+
+import random
+
+import torch
+
+from module.model_loader import load_generator_for_inference, print_startup_time
+from module.synthesis_server import MicroBatcher, make_server
+from module.inference_util import SpeakerConditioningCache
+from module.stage_profiler import InferenceStageProfiler
+
+#乱数のシードを設定
+manualSeed = 999
+print("Random Seed: ", manualSeed)
+random.seed(manualSeed)
+torch.manual_seed(manualSeed)
+
+###以下は推論に必要なパラメーター###
+#学習済みパラメーターへのパス
+trained_weight_path = "./output/vits/train/iteration1999999/netG_cpu.pth"
+#vits_train.pyでdecoder_configを指定して学習したGeneratorやvits_distill.pyで蒸留したGeneratorを用いる場合は、その構成を保存したjsonファイル(model_config.json)へのパス　Noneならば既定の構成
+model_config_path = None
+#使用するデバイス
+device = "cuda:0"
+#扱う音声のサンプリングレート
+sampling_rate = 22050
+#学習に使用した音素を列挙
+phoneme_list = [' ', 'I', 'N', 'U', 'a', 'b', 'by', 'ch', 'cl', 'd', 'dy', 'e', 'f', 'g', 'gy', 'h', 'hy', 'i', 'j', 'k', 'ky', 'm', 'my', 'n', 'ny', 'o', 'p', 'py', 'r', 'ry', 's', 'sh', 't', 'ts', 'ty', 'u', 'v', 'w', 'y', 'z']
+#音素とindexを対応付け
+phoneme2index = {p : i for i, p in enumerate(phoneme_list, 0)}
+#学習に使用した音素の種類数
+n_phoneme = len(phoneme_list)
+#学習に使用した話者の数
+n_speakers = 100
+
+###以下はサーバーに関するパラメーター###
+#待ち受けるアドレスとポート
+host = "127.0.0.1"
+port = 8000
+#最初の要求が届いてから、同じbatchにまとめる要求を何[ms]待つか
+max_wait_ms = 10
+#1つのbatchにまとめる要求の最大数　1とすれば要求を1件ずつ順に処理する
+max_batch_size = 16
+#1つのbatchの(要求数)*(最大の入力長)の上限　Text-to-Speechでは音素列の長さ、音声変換ではスペクトログラムのフレーム数で数える
+max_batch_text_length = 4096
+max_batch_spec_frames = 8192
+#話者ごとの条件付けの特徴量を前計算して保持する話者数の上限　0ならば保持せず毎回計算する
+max_cached_speakers = 100
+#推論の段階ごとの時間・フレーム数・FLOP数を記録し、GET /metricsで返すかどうか　FLOP数を数える分だけ推論が遅くなるため、count_stage_flops=Falseとすれば時間のみを記録する
+stage_profiling = False
+count_stage_flops = False
+
+#GPUが使用可能かどうか確認
+device = torch.device(device if torch.cuda.is_available() else "cpu")
+print("device:",device)
+
+#Generatorのインスタンスを生成し、学習済みパラメーターを読み込む
+netG, startup_time = load_generator_for_inference(trained_weight_path, n_phoneme=n_phoneme, n_speakers=n_speakers, device=device, model_config_path=model_config_path)
+#起動にかかった時間の内訳を出力
+print_startup_time(startup_time)
+#話者ごとの条件付けの特徴量を前計算しておく
+if(max_cached_speakers > 0):
+	netG.speaker_conditioning_cache = SpeakerConditioningCache(netG, max_speakers=max_cached_speakers)
+	netG.speaker_conditioning_cache.preload(device=device)
+
+#推論の段階ごとの記録を有効にする
+if(stage_profiling):
+	netG.stage_profiler = InferenceStageProfiler(device=device, count_flops=count_stage_flops)
+
+#要求をまとめて推論するworkerを起動
+batcher = MicroBatcher(
+				netG,
+				device,
+				max_wait_ms=max_wait_ms,
+				max_batch_size=max_batch_size,
+				max_batch_text_length=max_batch_text_length,
+				max_batch_spec_frames=max_batch_spec_frames
+			)
+#mode=serialを付けた要求も同じworkerで、他の要求とまとめずに1件ずつ推論する
+batcher.start()
+
+#HTTPサーバーを起動
+server = make_server(batcher, phoneme2index, sampling_rate, host=host, port=port)
+print(f"serving on http://{host}:{port}")
+try:
+	server.serve_forever()
+except KeyboardInterrupt:
+	server.server_close()
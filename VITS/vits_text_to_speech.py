@@ -1,32 +1,23 @@
 #encoding:utf-8
 
+#起動にかかった時間を計測するため、最初に時刻を記録しておく
+import time
+time_start_import = time.perf_counter()
+
 import random
 import numpy as np
-import glob
 import os
-import itertools
-import time
 import sys
-import re
-import pyopenjtalk
+import soundfile as sf
 
 import torch
-import torch.nn as nn
-import torch.optim as optim
-import torch.utils.data as data
-import torchvision
-from torchvision import models,transforms
-import torchvision.utils as vutils
-import torch.nn.init as init
-from torch.autograd import Function
-import torch.nn.functional as F
-
 import torchaudio
 
-from module.dataset_util import *
-from module.vits_generator import VitsGenerator
-from module.vits_discriminator import VitsDiscriminator
-from module.loss_function import *
+from module.model_loader import load_generator_for_inference, print_startup_time
+from module.precision_util import set_inference_precision
+from module.text_util import text_to_phoneme, phoneme_to_ids
+
+time_import = time.perf_counter() - time_start_import
 
 #乱数のシードを設定
 manualSeed = 999
@@ -37,6 +28,8 @@ torch.manual_seed(manualSeed)
 ###以下は推論に必要なパラメーター###
 #学習済みパラメーターへのパス
 trained_weight_path = "./output/vits/train/iteration1999999/netG_cpu.pth"
+#vits_train.pyでdecoder_configを指定して学習したGeneratorやvits_distill.pyで蒸留したGeneratorを用いる場合は、その構成を保存したjsonファイル(model_config.json)へのパス　Noneならば既定の構成
+model_config_path = None
 #音声合成の対象とするテキスト
 source_text = "これはテスト音声です"
 #対象とする話者id
@@ -47,6 +40,17 @@ output_dir = "./output/vits/inference/text_to_speech/"
 device = "cuda:0"
 #扱う音声のサンプリングレート
 sampling_rate = 22050
+#decoderでzを何フレームずつ分割して処理するか　Noneならば分割しない(長い音声でメモリが不足する場合に指定する)
+decoder_chunk_frames = None
+#音声を生成され次第chunkごとにファイルへ書き出すかどうか　Trueの場合、最初の音声が出力されるまでの時間とReal Time Factorを表示する
+streaming = False
+#streaming時、decoderでzを何フレームずつ処理して出力するか(1フレーム=256サンプル)
+streaming_chunk_frames = 32
+#推論時の演算精度　"fp32", "int8_dynamic", "bf16"から選ぶ(module/precision_util.py参照)
+inference_precision = "fp32"
+#音声合成の途中の結果を保存するディレクトリ(module/inference_util.pyのSynthesisCache参照)　Noneならば用いない
+#同じ文章・話者・パラメーターでの実行時は保存した結果を再利用する　乱数はmanualSeedから決まるため、用いない場合とは異なる音声となる
+synthesis_cache_dir = None
 
 #学習に使用した音素を列挙
 phoneme_list = [' ', 'I', 'N', 'U', 'a', 'b', 'by', 'ch', 'cl', 'd', 'dy', 'e', 'f', 'g', 'gy', 'h', 'hy', 'i', 'j', 'k', 'ky', 'm', 'my', 'n', 'ny', 'o', 'p', 'py', 'r', 'ry', 's', 'sh', 't', 'ts', 'ty', 'u', 'v', 'w', 'y', 'z']
@@ -64,44 +68,57 @@ os.makedirs(output_dir, exist_ok=True)
 device = torch.device(device if torch.cuda.is_available() else "cpu")
 print("device:",device)
 
-#Generatorのインスタンスを生成
-netG = VitsGenerator(n_phoneme=n_phoneme, n_speakers=n_speakers)
-#学習済みパラメーターを読み込む
-netG.load_state_dict(torch.load(trained_weight_path))
-#ネットワークをデバイスに移動
-netG = netG.to(device)
-#ネットワークを推論モードにする
-netG.eval()
+#Generatorのインスタンスを生成し、学習済みパラメーターを読み込む
+netG, startup_time = load_generator_for_inference(trained_weight_path, n_phoneme=n_phoneme, n_speakers=n_speakers, device=device, model_config_path=model_config_path)
+#起動にかかった時間の内訳を出力
+print_startup_time({"import" : time_import, **startup_time})
+#推論時の演算精度を設定
+set_inference_precision(netG, inference_precision)
 
 ##########音声合成の対象とするテキストを音素列に変換、前処理を施す##########
-source_text = source_text.strip()#改行コードを削除
-source_text = re.sub('・|・|「|」|』', '', source_text)#発音とは無関係な記号を削除
-source_text = re.split('、|,|，|。|『', source_text)#句読点、もしくは『で分割
-#分割した各文字列について音素列への変換を実行
-source_phoneme = [pyopenjtalk.g2p(element) for element in source_text if(not element=="")]
-
-#分割した各文字列についてスペースをカンマに変換
-source_phoneme = [element.replace(" ",",") for element in source_phoneme]
-#各発話(音素列)をスペース区切りで接合
-source_phoneme = ', ,'.join(source_phoneme)
-#文字列にpauが含まれている(解釈に失敗した記号)が含まれていれば処理を飛ばす　
-if("pau" in source_phoneme):
-	print(f"\"pau\" is included:{source_phoneme}")
+#文字列にpauが含まれている(解釈に失敗した記号)が含まれていれば処理を飛ばす
+try:
+	source_phoneme = text_to_phoneme(source_text)
+except ValueError as e:
+	print(e)
 	sys.exit()
-
 #音素を数値に変換
-source_phoneme = source_phoneme.replace("\n", "").split(",")
-source_phoneme_converted_into_index = [phoneme2index[p] for p in source_phoneme]
-#各音素の間に0を挿入する
-text_norm = [0] * (len(source_phoneme_converted_into_index) * 2 + 1)
-text_norm[1::2] = source_phoneme_converted_into_index
+text_norm = phoneme_to_ids(source_phoneme, phoneme2index)
 
 #音素をtensorへと変換
 source_phoneme = torch.LongTensor(text_norm).to(device)
 source_phoneme_lengths = torch.tensor([source_phoneme.size()[-1]], dtype=torch.long).to(device)
 #対象とする話者idを数値に変換
 target_speaker_id = torch.tensor([target_speaker_id], dtype=torch.long).to(device)
-#Text to Speechの推論を実行
-output_wav = netG.text_to_speech(text_padded=source_phoneme.unsqueeze(0), text_lengths=source_phoneme_lengths, speaker_id=target_speaker_id)[0].data.cpu()
-#結果を出力
-torchaudio.save(os.path.join(output_dir, "output.wav"), output_wav, sample_rate=sampling_rate)
+if(streaming):
+	#Text to Speechの推論をchunkごとに実行し、生成された音声を順にファイルへ書き出す
+	time_start = time.perf_counter()
+	time_to_first_audio = None
+	n_output_samples = 0
+	with torch.no_grad(), sf.SoundFile(os.path.join(output_dir, "output.wav"), mode="w", samplerate=sampling_rate, channels=1, subtype="FLOAT") as output_file:
+		for output_wav_chunk in netG.text_to_speech_stream(text_padded=source_phoneme.unsqueeze(0), text_lengths=source_phoneme_lengths, speaker_id=target_speaker_id, chunk_frames=streaming_chunk_frames):
+			output_wav_chunk = output_wav_chunk[0, 0].data.cpu().numpy()
+			#最初の音声が得られるまでの時間を記録
+			if(time_to_first_audio is None):
+				time_to_first_audio = time.perf_counter() - time_start
+			output_file.write(output_wav_chunk)
+			n_output_samples += len(output_wav_chunk)
+	#(生成にかかった時間)/(生成された音声の長さ)をReal Time Factorとして出力
+	elapsed_time = time.perf_counter() - time_start
+	print(f"time to first audio: {time_to_first_audio*1000:.1f} ms")
+	print(f"real time factor: {elapsed_time / (n_output_samples / sampling_rate):.4f}")
+elif(synthesis_cache_dir is not None):
+	#SynthesisCacheを用いる場合のみ読み込む(module/inference_util.pyは音声変換やprocess poolのためのmoduleも読み込むため)
+	from module.inference_util import SynthesisCache
+	#保存した途中の結果を再利用しつつText to Speechの推論を実行
+	synthesis_cache = SynthesisCache(netG, phoneme2index, disk_dir=synthesis_cache_dir)
+	output_wav = synthesis_cache.synthesize(source_text, target_speaker_id.item(), seed=manualSeed, decoder_chunk_frames=decoder_chunk_frames).unsqueeze(0)
+	for level, level_stats in synthesis_cache.stats().items():
+		print(f"{level}: " + ", ".join(f"{key}: {value}" for key, value in level_stats.items()))
+	#結果を出力
+	torchaudio.save(os.path.join(output_dir, "output.wav"), output_wav, sample_rate=sampling_rate)
+else:
+	#Text to Speechの推論を実行
+	output_wav = netG.text_to_speech(text_padded=source_phoneme.unsqueeze(0), text_lengths=source_phoneme_lengths, speaker_id=target_speaker_id, decoder_chunk_frames=decoder_chunk_frames)[0].data.cpu()
+	#結果を出力
+	torchaudio.save(os.path.join(output_dir, "output.wav"), output_wav, sample_rate=sampling_rate)
@@ -25,6 +25,10 @@ from module.dataset_util import *
 from module.vits_generator import VitsGenerator
 from module.vits_discriminator import VitsDiscriminator
 from module.loss_function import *
+from module.train_util import train_step
+from module.loader_tuning import make_train_loader, load_loader_config_or_default, apply_loader_config
+from module.batch_capture import capture_batch, save_captured_batches
+from module.model_loader import save_model_config
 
 #乱数のシードを設定
 manualSeed = 999
@@ -39,6 +43,11 @@ train_dataset_txtfile_path = "./dataset/jvs_preprocessed/jvs_preprocessed_for_tr
 output_dir = "./output/vits/train/"
 #使用するデバイス
 device = "cuda:0"
+#vits_loader_tuner.pyで出力したDataLoaderのworker数・thread数の設定へのパス　ファイルが存在しなければworker数をcore数とする
+loader_config_path = "./output/vits/loader_config.json"
+#指定した場合、最初のn_capture_batches個のbatchと各stepの直前の乱数の状態をこのファイルに保存する(vits_train_replay.pyで同じ処理を再現するため)　Noneならば保存しない
+capture_batches_path = None
+n_capture_batches = 8
 #バッチサイズ
 batch_size = 16
 #イテレーション数
@@ -55,6 +64,9 @@ phoneme_list = [' ', 'I', 'N', 'U', 'a', 'b', 'by', 'ch', 'cl', 'd', 'dy', 'e',
 n_phoneme = len(phoneme_list)
 #話者の数
 n_speakers = 100
+#Decoderの構成(module/model_component/decoder.pyのbuild_decoderの引数)　空ならば既定のDecoder
+#例えば{"decoder_type" : "istft"}とすると逆STFTで波形を合成するDecoder、{"decoder_type" : "multiband_istft"}とするとさらに4つの帯域に分けてPQMFで合成するDecoderを用いる
+decoder_config = {}
 
 #生成するor切り出す音声波形の大きさ
 segment_size = 8192
@@ -84,20 +96,17 @@ train_dataset = AudioSpeakerTextLoader(
 								dataset_txtfile_path=train_dataset_txtfile_path,
 								phoneme_list = phoneme_list
 							)
-train_loader = torch.utils.data.DataLoader(
-								train_dataset, 
-								batch_size=batch_size,
-								collate_fn=collate_fn, 
-								num_workers=os.cpu_count(),
-								shuffle=False, 
-								pin_memory=True,
-								#num_workerごとにシードを設定　これがないと各num_workerにおいて乱数が似たような値を返してしまう
-    							worker_init_fn=lambda worker_id: torch.manual_seed(manualSeed + worker_id)
-							)
+#DataLoaderのworker数とこのprocessのthread数を決める　loader_config_pathの設定(vits_loader_tuner.pyで出力したもの)があればそれを用いる
+loader_config = load_loader_config_or_default(loader_config_path)
+print("loader config:", loader_config)
+#num_workerごとにシードを設定　これがないと各num_workerにおいて乱数が似たような値を返してしまう(make_train_loader参照)
+train_loader = make_train_loader(train_dataset, batch_size, seed=manualSeed, **apply_loader_config(loader_config))
 print("train dataset size: {}".format(len(train_dataset)))
 
 #Generatorのインスタンスを生成
-netG = VitsGenerator(n_phoneme=n_phoneme, n_speakers=n_speakers)
+netG = VitsGenerator(n_phoneme=n_phoneme, n_speakers=n_speakers, decoder_config=decoder_config)
+#構成を保存する(推論時にmodel_config_pathとして指定する)
+save_model_config(os.path.join(output_dir, "model_config.json"), netG)
 #ネットワークをデバイスに移動
 netG = netG.to(device)
 
@@ -127,6 +136,8 @@ losses_recorded = {
 }
 #現在のイテレーション回数
 now_iteration = 0
+#capture_batches_pathを指定した場合に保存するbatch
+captured_batches = []
 
 print("Start Training")
 
@@ -141,93 +152,16 @@ netD.train()
 for epoch in itertools.count():
 	#データセットからbatch_size個ずつ取り出し学習
 	for data in train_loader:
-		#各データをdeviceに転送
-		wav_real, wav_real_length = data[0].to(device), data[1].to(device)
-		spec_real, spec_real_length = data[2].to(device), data[3].to(device)
-		speaker_id = data[4].to(device)
-		text, text_length = data[5].to(device), data[6].to(device)
-
-		###Generatorによる生成###
-		wav_fake, stochastic_duration_predictor_loss, attn, id_slice, x_mask, z_mask, (z, z_p, m_p, logs_p, m_q, logs_q) = netG(text, text_length, spec_real, spec_real_length, speaker_id)
-
-		#データセット中のスペクトログラムからメルスペクトログラムを計算
-		fbanks = torchaudio.functional.melscale_fbanks(n_freqs=filter_length//2 + 1, f_min=0, f_max=sampling_rate//2, n_mels=melspec_freq_dim, sample_rate=sampling_rate).to(device)
-		mel_spec_real = torch.matmul(spec_real.clone().transpose(-1, -2), fbanks).transpose(-1, -2)
-		#batch内の各メルスペクトログラム(上で計算したもの)について、id_sliceで指定されたindexから時間軸に沿って(segment_size//hop_length)サンプル分取り出す
-		mel_spec_real = slice_segments(input_tensor=mel_spec_real, start_indices=id_slice, segment_size=segment_size//hop_length)
-		
-		#Generatorによって生成された波形からメルスペクトログラムを計算
-		pad_size = int((filter_length-hop_length)/2)
-		wav_fake_padded = torch.nn.functional.pad(wav_fake, (pad_size, pad_size), mode='reflect')
-		spec_fake = torchaudio.functional.spectrogram(
-									waveform=wav_fake_padded,
-									pad=0,#torchaudio.functional.spectrogram内で使われているtorch.nn.functional.padはmode='constant'となっているが、今回はmode='reflect'としたいため手動でpaddingする
-									window=torch.hann_window(win_length).to(device),
-									n_fft=filter_length,
-									hop_length=hop_length,
-									win_length=win_length,
-									power=2,
-									normalized=False,
-									center=False
-								).squeeze(1)
-		mel_spec_fake = torch.matmul(spec_fake.clone().transpose(-1, -2), fbanks).transpose(-1, -2)
-		
-		#データセット中の波形「wav_real」について、batch内の各波形について、id_slice*hop_lengthで指定されたindexから時間軸に沿ってsegment_sizeサンプル分取り出す
-		wav_real = slice_segments(input_tensor=wav_real, start_indices=id_slice*hop_length, segment_size=segment_size)
-
-		#####Discriminatorの学習#####
-		# wav_real : 本物波形
-		# wav_fake : 生成された波形
-		authenticity_real, _ = netD(wav_real)
-		authenticity_fake, _ = netD(wav_fake.detach())
-
-		#lossを計算
-		adversarial_loss_D, _, _ = discriminator_adversarial_loss(authenticity_real, authenticity_fake)#adversarial loss
-
-		#Discriminatorのlossの総計
-		lossD = adversarial_loss_D
-
-		#勾配をリセット
-		optimizerD.zero_grad()
-		#勾配を計算
-		lossD.backward()
-		#gradient explosionを避けるため勾配を制限
-		nn.utils.clip_grad_norm_(netD.parameters(), max_norm=1.0, norm_type=2.0)
-		#パラメーターの更新
-		optimizerD.step()
-
-		#####Generatorの学習#####
-		authenticity_real, d_feature_map_real = netD(wav_real)
-		authenticity_fake, d_feature_map_fake = netD(wav_fake)
-
-		#lossを計算
-		duration_loss = torch.sum(stochastic_duration_predictor_loss.float())#duration loss
-		mel_reconstruction_loss = F.l1_loss(mel_spec_real, mel_spec_fake)*45#reconstruction loss
-		kl_loss = kl_divergence_loss(z_p, logs_q, m_p, logs_p, z_mask)#KL divergence
-		feature_matching_loss = feature_loss(d_feature_map_real, d_feature_map_fake)#feature matching loss(Discriminatorの中間層の出力分布の統計量を, realとfakeの場合それぞれにおいて互いの分布間で近づける)
-		adversarial_loss_G, _ = generator_adversarial_loss(authenticity_fake)#adversarial loss
-
-		#Generatorのlossの総計
-		lossG = duration_loss + mel_reconstruction_loss + kl_loss + feature_matching_loss + adversarial_loss_G
-
-		#勾配をリセット
-		optimizerG.zero_grad()
-		#勾配を計算
-		lossG.backward()
-		#gradient explosionを避けるため勾配を制限
-		nn.utils.clip_grad_norm_(netG.parameters(), max_norm=1.0, norm_type=2.0)
-		#パラメーターの更新
-		optimizerG.step()
+		#batchと乱数の状態を記録し、n_capture_batches個集まったら保存する
+		if capture_batches_path is not None and len(captured_batches) < n_capture_batches:
+			captured_batches.append(capture_batch(data, device))
+			if len(captured_batches) == n_capture_batches:
+				save_captured_batches(capture_batches_path, captured_batches, {"batch_size" : batch_size, "segment_size" : segment_size, "sampling_rate" : sampling_rate, "filter_length" : filter_length, "hop_length" : hop_length, "win_length" : win_length, "melspec_freq_dim" : melspec_freq_dim, "n_phoneme" : n_phoneme, "n_speakers" : n_speakers, "decoder_config" : decoder_config, "lr" : lr})
+				print(f"captured {n_capture_batches} batches: {capture_batches_path}")
+		#Generatorによる生成、Discriminatorの学習、Generatorの学習を行う(module/train_util.py参照)
+		loss_stdout = train_step(netG, netD, optimizerG, optimizerD, data, device, segment_size=segment_size, sampling_rate=sampling_rate, filter_length=filter_length, hop_length=hop_length, win_length=win_length, melspec_freq_dim=melspec_freq_dim)
 
 		#####stdoutへlossを出力する#####
-		loss_stdout = {
-			"adversarial_loss/D" : adversarial_loss_D.item(),
-			"adversarial_loss/G" : adversarial_loss_G.item(),
-			"duration_loss/G" : duration_loss.item(),
-			"mel_reconstruction_loss/G" : mel_reconstruction_loss.item(),
-			"kl_loss/G" : kl_loss.item(),
-			"feature_matching_loss/G" : feature_matching_loss.item()
-		}
 		if now_iteration % 10 == 0:
 			print(f"[{now_iteration}/{total_iterations}]", end="")
 			for key, value in loss_stdout.items():
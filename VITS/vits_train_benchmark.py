@@ -0,0 +1,115 @@
+#encoding:utf-8
+
+#vits_train.pyと同じ学習の1step(module/train_util.pyのtrain_step)をn_iterations回実行し、1秒あたりのiteration数・サンプル数と、
+#データの読み込み・Generatorの順伝搬・メルスペクトログラムの計算・Discriminatorの学習・Generatorのloss計算・Generatorの更新の各段階にかかった時間の内訳を計測するスクリプト
+#データセットが存在しない場合は合成データセット(synthetic_corpus_generator.py参照)を作って用いるため、JVS corpusやpyopenjtalkは不要
+
+import os
+
+import torch
+import torch.optim as optim
+
+from module.dataset_util import AudioSpeakerTextLoader
+from module.vits_generator import VitsGenerator
+from module.vits_discriminator import VitsDiscriminator
+from module.train_util import train_step
+from module.loader_tuning import make_train_loader, load_loader_config_or_default, apply_loader_config
+from module.synthetic_corpus import write_synthetic_corpus
+from module.benchmark_util import PhaseTimer, environment_info, save_benchmark_results, compare_with_baseline
+
+###以下は計測に必要なパラメーター###
+#学習に用いるデータセットのtxtファイルへのパス　存在しなければ合成データセットをこのパスに作る
+train_dataset_txtfile_path = "./dataset/synthetic/synthetic_for_train.txt"
+#合成データセットを作る場合の発話の数
+synthetic_n_utterances = 200
+#使用するデバイス
+device = "cuda:0"
+#バッチサイズ
+batch_size = 16
+#計測するiteration数(最初のn_warmup回は計測しない)
+n_warmup = 2
+n_iterations = 20
+#vits_loader_tuner.pyで出力したDataLoaderのworker数・thread数の設定へのパス　ファイルが存在しなければworker数をcore数とする
+loader_config_path = "./output/vits/loader_config.json"
+#結果を出力するjsonファイルへのパス
+output_json_path = "./output/vits/benchmark/train_benchmark.json"
+#比較の基準とする結果(以前にこのスクリプトで出力したjsonファイル)へのパス　Noneならば比較しない
+baseline_json_path = None
+#基準より何割以上遅くなった場合に性能の低下とみなすか
+regression_threshold = 0.1
+#乱数のシード
+seed = 999
+#学習に使用する音素を列挙
+phoneme_list = [' ', 'I', 'N', 'U', 'a', 'b', 'by', 'ch', 'cl', 'd', 'dy', 'e', 'f', 'g', 'gy', 'h', 'hy', 'i', 'j', 'k', 'ky', 'm', 'my', 'n', 'ny', 'o', 'p', 'py', 'r', 'ry', 's', 'sh', 't', 'ts', 'ty', 'u', 'v', 'w', 'y', 'z']
+#話者の数
+n_speakers = 100
+#学習率
+lr = 0.0002
+#Decoderの構成(vits_train.pyのdecoder_config)　空ならば既定のDecoder
+decoder_config = {}
+
+torch.manual_seed(seed)
+device = torch.device(device if torch.cuda.is_available() else "cpu")
+print("device:",device)
+
+if not os.path.exists(train_dataset_txtfile_path):
+	print(f"{train_dataset_txtfile_path} does not exist. writing a synthetic corpus of {synthetic_n_utterances} utterances...")
+	write_synthetic_corpus(os.path.dirname(train_dataset_txtfile_path), synthetic_n_utterances, n_speakers, phoneme_list, seed=seed)
+
+train_dataset = AudioSpeakerTextLoader(dataset_txtfile_path=train_dataset_txtfile_path, phoneme_list=phoneme_list)
+loader_config = load_loader_config_or_default(loader_config_path)
+print("loader config:", loader_config)
+train_loader = make_train_loader(train_dataset, batch_size, seed=seed, pin_memory=device.type == "cuda", **apply_loader_config(loader_config))
+print("train dataset size: {}".format(len(train_dataset)))
+
+#vits_train.pyと同じ設定でGenerator, Discriminator, optimizerを作る
+netG = VitsGenerator(n_phoneme=len(phoneme_list), n_speakers=n_speakers, decoder_config=decoder_config).to(device).train()
+netD = VitsDiscriminator().to(device).train()
+optimizerG = optim.AdamW(netG.parameters(), lr=lr, betas=(0.8, 0.99), weight_decay=0.01)
+optimizerD = optim.AdamW(netD.parameters(), lr=lr, betas=(0.8, 0.99), weight_decay=0.01)
+
+#データセットを使い切った場合は次のepochに進み、batchを取り出し続けるgenerator
+def iterate_batches():
+	while True:
+		yield from train_loader
+
+##########計測##########
+timer = PhaseTimer(device)
+batches = iterate_batches()
+n_samples = 0
+for iteration in range(n_warmup + n_iterations):
+	#warmupの間の記録を消す
+	if iteration == n_warmup:
+		timer.reset()
+		n_samples = 0
+	#batchの読み込み(DataLoaderのworkerが先読みしていれば待ち時間のみ)
+	with timer("data_loading"):
+		data = next(batches)
+	train_step(netG, netD, optimizerG, optimizerD, data, device, phase_timer=timer)
+	n_samples += data[0].size(0)
+
+summary = timer.summary()
+total_seconds = sum(phase["total_s"] for phase in summary.values())
+results = {
+	"train_step" : {
+		"iterations_per_second" : n_iterations / total_seconds,
+		"samples_per_second" : n_samples / total_seconds,
+		"seconds_per_iteration" : total_seconds / n_iterations,
+		"batch_size" : batch_size,
+		**loader_config,
+	},
+}
+#各段階の1iterationあたりの時間[ms]
+results.update({f"phase/{name}" : phase for name, phase in summary.items()})
+
+print(f"\n{n_iterations} iterations: {results['train_step']['iterations_per_second']:.3f} iterations/s, {results['train_step']['samples_per_second']:.2f} samples/s")
+for name, phase in sorted(summary.items(), key=lambda item: item[1]["total_s"], reverse=True):
+	print(f"{name:<24} {phase['mean_ms']:>10.1f} ms/iteration ({phase['ratio'] * 100:5.1f}%)")
+
+os.makedirs(os.path.dirname(output_json_path), exist_ok=True)
+save_benchmark_results(output_json_path, results, environment_info(device))
+print(f"saved: {output_json_path}")
+
+##########基準の結果との比較##########
+if baseline_json_path is not None:
+	compare_with_baseline(results, baseline_json_path, ["seconds_per_iteration", "mean_ms"], threshold=regression_threshold, environment=environment_info(device))
@@ -0,0 +1,114 @@
+#encoding:utf-8
+
+#vits_train.pyで保存したbatchと乱数の状態(capture_batches_path)を読み込み、全てのbatchについて同じ重みから学習の1step(module/train_util.pyのtrain_step)を再現するスクリプト
+#どのbatchも同じ重み・同じ乱数(切り出し位置、PosteriorEncoderのサンプリング、StochasticDurationPredictorのノイズ、dropout)で実行するため、毎回全く同じ処理となる
+#各stepの時間の内訳・lossの値・パラメーターの更新量をjsonファイルに保存し、baseline_json_pathを指定した場合は基準の結果(変更前のコードでの再現結果など)と時間と数値の一致を比較する
+#MASの実装・lossの計算・演算精度などを変更した際に、同じ処理での速度と数値を比べるために用いる
+
+import os
+import copy
+
+import torch
+import torch.optim as optim
+
+from module.vits_generator import VitsGenerator
+from module.vits_discriminator import VitsDiscriminator
+from module.train_util import train_step
+from module.batch_capture import load_captured_batches, restore_batch, restore_rng_state
+from module.benchmark_util import PhaseTimer, environment_info, save_benchmark_results, load_benchmark_results, compare_with_baseline
+
+###以下は再現に必要なパラメーター###
+#vits_train.pyのcapture_batches_pathで保存したファイルへのパス
+captured_batches_path = "./output/vits/train/captured_batches.pt"
+#学習済みパラメーターへのパス　Noneならばseedで初期化した重みを用いる
+generator_weight_path = None
+discriminator_weight_path = None
+#使用するデバイス　batchを保存した時と同じ種類のデバイス(CPUかGPUか)を指定する
+device = "cuda:0"
+#各batchを何回繰り返すか(最初のn_warmup回は計測しない)　繰り返しごとに数値が一致するかも確認する
+n_warmup = 1
+n_repeats = 3
+#結果を出力するjsonファイルへのパス
+output_json_path = "./output/vits/benchmark/train_replay.json"
+#比較の基準とする結果(以前にこのスクリプトで出力したjsonファイル)へのパス　Noneならば比較しない
+baseline_json_path = None
+#基準より何割以上遅くなった場合に性能の低下とみなすか
+regression_threshold = 0.1
+#lossとパラメーターの更新量が基準とどれだけ異なれば(相対誤差)数値が一致しないとみなすか
+parity_tolerance = 1e-4
+#重みの初期化に用いる乱数のシード
+seed = 999
+
+device = torch.device(device if torch.cuda.is_available() else "cpu")
+print("device:",device)
+
+batches, metadata = load_captured_batches(captured_batches_path)
+print(f"{len(batches)} batches (batch size: {metadata['batch_size']})")
+step_kwargs = {key : metadata[key] for key in ["segment_size", "sampling_rate", "filter_length", "hop_length", "win_length", "melspec_freq_dim"]}
+
+torch.manual_seed(seed)
+#decoder_configを記録していない(以前に保存した)batchは既定のDecoderを用いる
+netG = VitsGenerator(n_phoneme=metadata["n_phoneme"], n_speakers=metadata["n_speakers"], decoder_config=metadata.get("decoder_config", {}))
+netD = VitsDiscriminator()
+if generator_weight_path is not None:
+	netG.load_state_dict(torch.load(generator_weight_path, map_location="cpu"))
+if discriminator_weight_path is not None:
+	netD.load_state_dict(torch.load(discriminator_weight_path, map_location="cpu"))
+netG, netD = netG.to(device).train(), netD.to(device).train()
+#各stepの前にこの重みに戻す
+initial_state_G, initial_state_D = copy.deepcopy(netG.state_dict()), copy.deepcopy(netD.state_dict())
+
+#optimizerによる全パラメーターの更新量(初期の重みとの差)をまとめた2-norm
+#勾配はclip_grad_norm_によって制限された後の値しか残らないため、勾配の一致は更新量で確認する
+def update_norm(network, initial_state):
+	return torch.norm(torch.stack([(p.detach() - initial_state[name]).float().norm() for name, p in network.named_parameters()])).item()
+
+#captured(1つのbatch)について、記録時と同じ状態から学習の1stepを実行し、lossとパラメーターの更新量を返す
+def replay(captured, timer=None):
+	netG.load_state_dict(initial_state_G)
+	netD.load_state_dict(initial_state_D)
+	optimizerG = optim.AdamW(netG.parameters(), lr=metadata["lr"], betas=(0.8, 0.99), weight_decay=0.01)
+	optimizerD = optim.AdamW(netD.parameters(), lr=metadata["lr"], betas=(0.8, 0.99), weight_decay=0.01)
+	data = restore_batch(captured, metadata["filter_length"], metadata["hop_length"], metadata["win_length"])
+	restore_rng_state(captured, device)
+	losses = train_step(netG, netD, optimizerG, optimizerD, data, device, phase_timer=timer, **step_kwargs)
+	return {**losses, "update_norm/G" : update_norm(netG, initial_state_G), "update_norm/D" : update_norm(netD, initial_state_D)}
+
+##########再現##########
+results = {}
+for index, captured in enumerate(batches):
+	timer = PhaseTimer(device)
+	values = [replay(captured) for _ in range(n_warmup)]
+	for _ in range(n_repeats):
+		values.append(replay(captured, timer))
+	#同じ入力・乱数で繰り返した結果が一致するか(非決定的なkernelを用いていないか)
+	deterministic = all(value == values[0] for value in values)
+	summary = timer.summary()
+	result = {**values[0], "deterministic" : deterministic, "step_ms" : sum(phase["mean_ms"] for phase in summary.values())}
+	result.update({f"{name}_ms" : phase["mean_ms"] for name, phase in summary.items()})
+	results[f"batch{index}"] = result
+	print(f"batch{index}: step {result['step_ms']:.1f} ms, deterministic: {deterministic}, " + ", ".join(f"{key}: {value:.5f}" for key, value in values[0].items()))
+
+os.makedirs(os.path.dirname(output_json_path), exist_ok=True)
+save_benchmark_results(output_json_path, results, environment_info(device))
+print(f"saved: {output_json_path}")
+
+##########基準の結果との比較##########
+if baseline_json_path is not None:
+	print("\nspeed:")
+	time_metrics = [key for key in results["batch0"].keys() if key.endswith("_ms")]
+	compare_with_baseline(results, baseline_json_path, time_metrics, threshold=regression_threshold, environment=environment_info(device))
+	baseline = load_benchmark_results(baseline_json_path)
+	#lossとパラメーターの更新量について、基準との相対誤差の最大値を表示する
+	print("\nnumeric parity:")
+	value_keys = [key for key in results["batch0"].keys() if "/" in key]
+	n_mismatches = 0
+	for key in value_keys:
+		errors = [abs(result[key] - baseline["results"][name][key]) / max(abs(baseline["results"][name][key]), 1e-12) for name, result in results.items() if key in baseline["results"].get(name, {})]
+		#基準の結果に含まれない値は比較しない
+		if len(errors) == 0:
+			continue
+		mismatch = max(errors) > parity_tolerance
+		n_mismatches += mismatch
+		print(f"{key:<32} max relative error: {max(errors):.2e} {'MISMATCH' if mismatch else ''}")
+	print(f"mismatches: {n_mismatches} / {len(value_keys)} (tolerance: {parity_tolerance:.0e})")
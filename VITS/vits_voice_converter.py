@@ -1,30 +1,25 @@
 #encoding:utf-8
 
+#起動にかかった時間を計測するため、最初に時刻を記録しておく
+import time
+time_start_import = time.perf_counter()
+
 import random
 import numpy as np
-import glob
 import os
-import itertools
-import time
 import sys
+import soundfile as sf
 
 import torch
-import torch.nn as nn
-import torch.optim as optim
-import torch.utils.data as data
-import torchvision
-from torchvision import models,transforms
-import torchvision.utils as vutils
-import torch.nn.init as init
-from torch.autograd import Function
-import torch.nn.functional as F
-
 import torchaudio
 
-from module.dataset_util import *
-from module.vits_generator import VitsGenerator
-from module.vits_discriminator import VitsDiscriminator
-from module.loss_function import *
+from module.model_loader import load_generator_for_inference, print_startup_time
+from module.precision_util import set_inference_precision
+from module.audio_util import read_wav_blocks
+from module.streaming_util import StreamingVoiceConverter
+from module.inference_util import SourceLatentCache
+
+time_import = time.perf_counter() - time_start_import
 
 #乱数のシードを設定
 manualSeed = 999
@@ -35,12 +30,16 @@ torch.manual_seed(manualSeed)
 ###以下は推論に必要なパラメーター###
 #学習済みパラメーターへのパス
 trained_weight_path = "./output/vits/train/iteration1999999/netG_cpu.pth"
-#変換対象としたいwavファイルへのパス
+#vits_train.pyでdecoder_configを指定して学習したGeneratorやvits_distill.pyで蒸留したGeneratorを用いる場合は、その構成を保存したjsonファイル(model_config.json)へのパス　Noneならば既定の構成
+model_config_path = None
+#変換対象としたいwavファイルへのパス　streaming時に"-"を指定した場合は標準入力から16bit monoのraw PCMを読み込む
 source_wav_path = "./dataset/jvs_preprocessed/jvs_wav_preprocessed/jvs099/VOICEACTRESS100_011.wav"
 #変換元の話者id
 source_speaker_id = 98
-#変換先の話者id
+#変換先の話者id　[9, 10, 11]のようにlistで指定した場合、変換元側の処理を1度だけ行い全ての話者へまとめて変換する
 target_speaker_id = 9
+#listで指定した変換先の話者を何人ずつ1つのbatchとして変換するか
+fan_out_batch_size = 16
 #結果を出力するためのディレクトリ
 output_dir = "./output/vits/inference/voice_conversion/"
 #使用するデバイス
@@ -49,6 +48,19 @@ device = "cuda:0"
 n_phoneme = 40
 #学習に使用した話者の数
 n_speakers = 100
+#decoderでzを何フレームずつ分割して処理するか　Noneならば分割しない(長い音声でメモリが不足する場合に指定する)
+decoder_chunk_frames = None
+#推論時の演算精度　"fp32", "int8_dynamic", "bf16"から選ぶ(module/precision_util.py参照)
+inference_precision = "fp32"
+#音声を少しずつ読み込みながら変換し、変換され次第chunkごとにファイルへ書き出すかどうか　Trueの場合、chunkごとの処理時間と遅延を表示する
+streaming = False
+#streaming時、何フレームずつ変換して出力するか(1フレーム=256サンプル)
+streaming_chunk_frames = 16
+#streaming時、各段階(PosteriorEncoderと順方向のFlow、逆方向のFlow、decoder)で窓の左右に付け足す文脈の最大フレーム数
+#Noneならば受容野全体とし、出力は音声全体を一度に変換した場合と一致する　小さくすると先読みによる遅延が減る(module/streaming_util.py参照)
+streaming_context_frames = 16
+#streaming時、入力を何サンプルずつ読み込むか
+streaming_block_samples = 1024
 
 ###以下は音声処理に必要なパラメーター###
 #扱う音声のサンプリングレート
@@ -67,38 +79,58 @@ os.makedirs(output_dir, exist_ok=True)
 device = torch.device(device if torch.cuda.is_available() else "cpu")
 print("device:",device)
 
-#Generatorのインスタンスを生成
-netG = VitsGenerator(n_phoneme=n_phoneme, n_speakers=n_speakers)
-#学習済みパラメーターを読み込む
-netG.load_state_dict(torch.load(trained_weight_path))
-#ネットワークをデバイスに移動
-netG = netG.to(device)
-#ネットワークを推論モードにする
-netG.eval()
+#Generatorのインスタンスを生成し、学習済みパラメーターを読み込む
+netG, startup_time = load_generator_for_inference(trained_weight_path, n_phoneme=n_phoneme, n_speakers=n_speakers, device=device, model_config_path=model_config_path)
+#起動にかかった時間の内訳を出力
+print_startup_time({"import" : time_import, **startup_time})
+#推論時の演算精度を設定
+set_inference_precision(netG, inference_precision)
+
+if(streaming):
+	assert not isinstance(target_speaker_id, list), "streaming supports a single target_speaker_id"
+	#音声をstreaming_block_samplesずつ読み込みながら変換し、変換された音声を順にファイルへ書き出す
+	converter = StreamingVoiceConverter(netG, source_speaker_id, target_speaker_id, chunk_frames=streaming_chunk_frames, context_frames=streaming_context_frames, filter_length=filter_length, hop_length=hop_length, win_length=win_length)
+	print(f"algorithmic latency: {converter.algorithmic_latency_samples() / sampling_rate * 1000:.1f} ms")
+	chunk_times = []
+	n_output_samples = 0
+	with sf.SoundFile(os.path.join(output_dir, "output.wav"), mode="w", samplerate=sampling_rate, channels=1, subtype="FLOAT") as output_file:
+		blocks = read_wav_blocks(source_wav_path, streaming_block_samples)
+		while True:
+			block = next(blocks, None)
+			time_start = time.perf_counter()
+			output_wav_chunk = converter.push(block) if block is not None else converter.finish()
+			elapsed_time = time.perf_counter() - time_start
+			#音声が出力された場合のみ、入力を受け取ってから出力するまでの処理時間を記録
+			if(output_wav_chunk.size(0) > 0):
+				chunk_times.append(elapsed_time)
+				print(f"chunk {len(chunk_times)}: {output_wav_chunk.size(0)} samples, {elapsed_time*1000:.1f} ms")
+				output_file.write(output_wav_chunk.numpy())
+				n_output_samples += output_wav_chunk.size(0)
+			if block is None:
+				break
+	#chunkごとの処理時間と、(処理にかかった時間)/(変換された音声の長さ)をReal Time Factorとして出力
+	print(f"chunk latency: mean {sum(chunk_times) / len(chunk_times) * 1000:.1f} ms, max {max(chunk_times) * 1000:.1f} ms")
+	print(f"real time factor: {sum(chunk_times) / (n_output_samples / sampling_rate):.4f}")
+	sys.exit()
 
-###変換対象とするwavファイルの読み込み###
-#wavファイルをロード
-loaded_wav, _ = torchaudio.load(source_wav_path)
-#スペクトログラムを生成
-pad_size = int((filter_length-hop_length)/2)
-wav_padded = torch.nn.functional.pad(loaded_wav, (pad_size, pad_size), mode='reflect')
-spec = torchaudio.functional.spectrogram(
-					waveform=wav_padded,
-					pad=0,#torchaudio.functional.spectrogram内で使われているtorch.nn.functional.padはmode='constant'となっているが、今回はmode='reflect'としたいため手動でpaddingする
-					window=torch.hann_window(win_length),
-					n_fft=filter_length,
-					hop_length=hop_length,
-					win_length=win_length,
-					power=2,
-					normalized=False,
-					center=False
-				)
-spec = spec.to(device)
-spec_lengths = torch.tensor([spec.size(2)], dtype=torch.long).to(device)
-source_speaker_id = torch.tensor([source_speaker_id], dtype=torch.long).to(device)
-target_speaker_id = torch.tensor([target_speaker_id], dtype=torch.long).to(device)
-#推論(音声変換)を実行
-output_wav = netG.voice_conversion(spec, spec_lengths, source_speaker_id=source_speaker_id, target_speaker_id=target_speaker_id)[0].data.cpu()
-#結果と元音声を出力
-torchaudio.save(os.path.join(output_dir, "output.wav"), output_wav, sample_rate=sampling_rate)
+###推論(音声変換)###
+#変換元の音声のwavファイルの読み込み・PosteriorEncoder・順方向のFlowの結果(z_p)は、wavファイルの内容と変換元の話者idをkeyとしてcacheする
+#変換元側の処理は最初に1度だけ行い、得られたz_pを変換先の話者の全てのbatchで使い回す
+source_latent_cache = SourceLatentCache(netG, filter_length=filter_length, hop_length=hop_length, win_length=win_length)
+z_p, spec_mask, loaded_wav = source_latent_cache.encode(source_wav_path, source_speaker_id, device=device)
+target_speaker_ids = target_speaker_id if isinstance(target_speaker_id, list) else [target_speaker_id]
+output_wavs = []
+for batch_start in range(0, len(target_speaker_ids), fan_out_batch_size):
+	batch_target_speaker_ids = torch.tensor(target_speaker_ids[batch_start:batch_start+fan_out_batch_size], dtype=torch.long).to(device)
+	#全ての変換先話者について1つのbatchとして推論(音声変換)を実行
+	with torch.no_grad():
+		output_wavs.extend(netG.voice_conversion_fan_out(z_p, spec_mask, batch_target_speaker_ids, decoder_chunk_frames=decoder_chunk_frames).data.cpu())
+print("source latent cache: " + ", ".join(f"{key}: {value}" for key, value in source_latent_cache.stats().items()))
+#結果を出力　listで指定した場合は話者ごとに出力
+if(isinstance(target_speaker_id, list)):
+	for speaker_id, output_wav in zip(target_speaker_ids, output_wavs):
+		torchaudio.save(os.path.join(output_dir, f"output_{speaker_id}.wav"), output_wav, sample_rate=sampling_rate)
+else:
+	torchaudio.save(os.path.join(output_dir, "output.wav"), output_wavs[0], sample_rate=sampling_rate)
+#元音声を出力
 torchaudio.save(os.path.join(output_dir, "input.wav"), loaded_wav, sample_rate=sampling_rate)